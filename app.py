@@ -8,24 +8,41 @@
 #  ・APIキー不要（OSM/CARTOタイル）。天気APIは任意。
 # ============================================================
 
-import os, re, io, glob, json, time, math, random, inspect, traceback
-from datetime import datetime, timedelta, timezone
-from typing import Optional, Tuple, List, Dict
+from __future__ import annotations   # 型注釈（folium.Map 等）を評価しない＝注釈のために地図ライブラリを読み込まない
+
+import os, re, glob, json, time, hashlib, inspect, threading, traceback, unicodedata
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, List, Dict, Callable
 
-import requests
 import numpy as np
 import pandas as pd
 import streamlit as st
-import folium
-from folium.plugins import MiniMap, MousePosition, MeasureControl, Fullscreen, LocateControl, MarkerCluster
-from streamlit_folium import st_folium
-import chardet
-import streamlit.components.v1 as components
+
+from crime_data import (load_all_crime_2019, read_csv_bytes, HistoricalProfile, build_historical_profile,
+                        crime_dataset_version, IncidentBins, build_incident_bins, hex_polygon, HEX_CELL_M)
+from police_archive import PoliceArchive, parse_search_query, highlight_terms
+from lazy import lazy_import
+from municipalities import JST, CITY_NAMES, MUNI_CENTROIDS
+from http_client import USER_AGENT, CircuitOpenError, http_get, http_post, http_stats
+import sibyl_core
+from sibyl_core import (DATA_GLOBS, TTLCache,
+                        WEATHER_TIME_BUCKET_S, get_weather, get_weather_cache, get_mgpn_moon, get_moon_info,
+                        fetch_conditions_concurrent, compute_risk_score, compute_cc_from_risk_and_news, compute_cc_forecast,
+                        FORECAST_CACHE)
+from police_feed import EHIME_POLICE_URL, POLICE_ARCHIVE_PATH, PoliceFeed
+from spatial_index import GridIndex
+from poi_tiles import PoiTileStore, overpass_bbox_query
+import perf
+
+# 地図まわりは最初に地図/レイヤを作る時点で読み込む（読み込みだけで Streamlit 本体より重い）
+folium = lazy_import("folium")
+folium_plugins = lazy_import("folium.plugins")
+bcm = lazy_import("branca.colormap")
+components = lazy_import("streamlit.components.v1")
 
 # ---------------------------
 # 基本設定
 # ---------------------------
-JST = timezone(timedelta(hours=9))
 APP_TITLE = "愛媛セーフティ・プラットフォーム / Ehime Safety Platform"
 EHIME_CENTER_LAT = 33.8416
 EHIME_CENTER_LON = 132.7661
@@ -34,21 +51,17 @@ EHIME_BBOX = {"min_lat": 32.8, "max_lat": 34.6, "min_lon": 131.8, "max_lon": 134
 INIT_LAT = 34.27717   # 上島町付近
 INIT_LON = 133.20986
 
-DATA_GLOBS = [
-    "./ehime_2019*.csv",
-    "./data/ehime_2019*.csv",
-    "/mnt/data/ehime_2019*.csv",
-]
-
 MUNI_GEOCODE_CACHE_PATH = "/mnt/data/muni_geocode_cache.json"
-USER_AGENT = "ESP-v5/1.0 (Nominatim polite; contact: local-app)"
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
-EHIME_POLICE_URL = "https://www.police.pref.ehime.jp/sokuho/sokuho.htm"
-
-CITY_NAMES = [
-    "松山市","今治市","新居浜市","西条市","大洲市","伊予市","四国中央市","西予市","東温市",
-    "上島町","久万高原町","松前町","砥部町","内子町","伊方町","松野町","鬼北町","愛南町"
-]
+ADDRESS_GEOCODE_CACHE_PATH = "/mnt/data/address_geocode_cache.json"
+GEOCODE_NEGATIVE_TTL_S = 24 * 3600   # 失敗（座標なし）の記録はこの時間で失効し再問い合わせ
+GEOCODE_FLUSH_INTERVAL_S = 5.0       # 永続化はまとめて（最短この間隔で）書き出す
+NOMINATIM_URL = os.environ.get("ESP_NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")   # 検証用のローカル代替も可
+NOMINATIM_RATE_PER_S = 1.0   # Nominatim 利用規約: 最大 1 req/s
+OVERPASS_URL = os.environ.get("ESP_OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+POI_CACHE_PATH = os.environ.get("ESP_POI_CACHE_PATH", "/mnt/data/poi_tiles.sqlite3")
+POI_EXTRACT_PATH = os.environ.get("ESP_POI_EXTRACT_PATH", "/mnt/data/ehime_pois.geojson")   # .osm.pbf も可（要 pyosmium）
+POLICE_COUNT_WINDOWS = {"直近7日（蓄積）": 7, "直近30日（蓄積）": 30, "現在ページの出現回数": None}   # SIBYL の速報件数
+POLICE_VIEW_PERIODS = {"現在ページ": None, "直近7日": 7, "直近30日": 30, "直近1年": 365}
 
 # ---------------------------
 # スタイル（SIBYL風＋リストのスクロール枠）
@@ -76,374 +89,113 @@ DRAMA_CSS = """
   .feed-item b { color:#dff; }
   .feed-item .meta { color:#a8b7c7; font-size:12px; }
   .feed-item a { color:#7ff; }
+  .feed-item mark { background:rgba(9,251,211,.28); color:#fff; padding:0 1px; border-radius:3px; }
 </style>
 """
 
 # ---------------------------
-# Secrets / API Keys（任意）
+# Secrets / API Keys（任意）。sibyl_core の環境変数（ESP_WEATHERAPI_KEY 等）より優先
 # ---------------------------
-try:
-    WEATHERAPI_KEY = st.secrets.get("weatherapi", {}).get("api_key", "")
-    OPENWEATHER_KEY = st.secrets.get("openweather", {}).get("api_key", "")
-except Exception:
-    WEATHERAPI_KEY = OPENWEATHER_KEY = ""
+
+def load_api_keys():
+    # st.secrets は import 時ではなく実行時に読む（secrets.toml の解析を再利用側に持ち込まない）
+    try:
+        sibyl_core.WEATHERAPI_KEY = st.secrets.get("weatherapi", {}).get("api_key", "") or sibyl_core.WEATHERAPI_KEY
+        sibyl_core.OPENWEATHER_KEY = st.secrets.get("openweather", {}).get("api_key", "") or sibyl_core.OPENWEATHER_KEY
+    except Exception:
+        pass
 
 # ---------------------------
 # ユーティリティ
 # ---------------------------
 
-def read_csv_robust(path: str) -> pd.DataFrame:
-    with open(path, "rb") as f: raw = f.read()
-    enc_guess = (chardet.detect(raw).get("encoding") or "utf-8").lower()
-    for enc in (enc_guess, "utf-8-sig", "cp932", "shift_jis"):
-        try: return pd.read_csv(path, encoding=enc)
-        except Exception: continue
-    return pd.read_csv(path, encoding_errors="ignore")
+_SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
 
 
-def guess_columns(df: pd.DataFrame) -> dict:
-    cols_lower = {c: str(c).lower() for c in df.columns}
-    date_col = next((c for c in df.columns if re.search(r"(発生|年月日|日付|日時)", str(c))), None)
-    if not date_col: date_col = next((c for c in df.columns if any(k in cols_lower[c] for k in ["date","day","time","occur"])), None)
-    muni_col = next((c for c in df.columns if re.search(r"(市|町|村).*名", str(c)) or re.search(r"(市町村|自治体|地域)", str(c))), None)
-    if not muni_col: muni_col = next((c for c in df.columns if any(k in cols_lower[c] for k in ["municipality","city","town","area","region"])), None)
-    type_col = next((c for c in df.columns if re.search(r"(手口|罪|罪種|種別|分類)", str(c))), None)
-    if not type_col: type_col = next((c for c in df.columns if any(k in cols_lower[c] for k in ["type","category","kind","crime"])), None)
-    return {"date": date_col, "municipality": muni_col, "ctype": type_col}
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    # 64bit の整数ハッシュ（SplitMix64 の最終段）。uint64 の桁あふれは mod 2^64 として扱う
+    with np.errstate(over="ignore"):
+        z = x + _SPLITMIX_GAMMA
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
 
 
-def parse_date_series(s: pd.Series) -> pd.Series:
-    return pd.to_datetime(s, errors="coerce")
+def stable_seed(key) -> int:
+    # 任意の文字列/値 → 64bit シード（プロセスや実行回をまたいで同じ値。hash() は実行ごとに変わるので使わない）
+    return int.from_bytes(hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest(), "little")
 
 
-def jitter_latlon(lat: float, lon: float, meters: float = 110.0) -> tuple[float, float]:
-    dlat = (random.random() - 0.5) * (meters / 111000.0) * 2
-    scale = math.cos(math.radians(lat))
-    dlon = (random.random() - 0.5) * (meters / (111000.0 * max(scale, 1e-6))) * 2
+def jitter_latlon_arrays(lat, lon, seeds, meters: float = 110.0) -> tuple[np.ndarray, np.ndarray]:
+    # 重心からの一様ジッター（±meters）。オフセットは seeds（レコードごとの 64bit キー）だけで決まる
+    lat = np.asarray(lat, dtype=float); lon = np.asarray(lon, dtype=float)
+    seeds = np.asarray(seeds, dtype=np.uint64)
+    u1 = (_splitmix64(seeds) >> np.uint64(11)).astype(float) / float(1 << 53)
+    u2 = (_splitmix64(seeds ^ _SPLITMIX_GAMMA) >> np.uint64(11)).astype(float) / float(1 << 53)
+    dlat = (u1 - 0.5) * (meters / 111000.0) * 2
+    scale = np.maximum(np.cos(np.radians(lat)), 1e-6)
+    dlon = (u2 - 0.5) * (meters / (111000.0 * scale)) * 2
     return lat + dlat, lon + dlon
 
 
-def clamp(v, lo, hi): return lo if v < lo else (hi if v > hi else v)
-
-# ---------------------------
-# 2019 CSV ロード
-# ---------------------------
-
-def load_all_crime_2019(globs: List[str]) -> Optional[pd.DataFrame]:
-    files: List[str] = []
-    for g in globs: files.extend(glob.glob(g))
-    files = sorted(set(files))
-    if not files: return None
-    frames = []
-    for fp in files:
-        df = read_csv_robust(fp)
-        g = guess_columns(df)
-        if g["date"] is None: df["date"] = pd.NaT
-        else:
-            df.rename(columns={g["date"]: "date"}, inplace=True)
-            df["date"] = parse_date_series(df["date"])
-        if g["municipality"] is None: df["municipality"] = ""
-        else:
-            df.rename(columns={g["municipality"]: "municipality"}, inplace=True)
-            df["municipality"] = df["municipality"].astype(str)
-        if g["ctype"] is None:
-            base = os.path.basename(fp)
-            mapping = {
-                "hittakuri":"ひったくり","syazyounerai":"車上ねらい","buhinnerai":"部品ねらい",
-                "zidousyatou":"自動車盗","ootobaitou":"オートバイ盗","zitensyatou":"自転車盗",
-                "zidouhanbaikinerai":"自動販売機ねらい",
-            }
-            guess = None
-            for k,v in mapping.items():
-                if k in base: guess = v; break
-            df["ctype"] = guess if guess else "不明"
-        else:
-            df.rename(columns={g["ctype"]:"ctype"}, inplace=True)
-            df["ctype"] = df["ctype"].astype(str)
-        df = df[(df["date"].dt.year == 2019) | (df["date"].isna())]
-        frames.append(df[["date","municipality","ctype"]])
-    return pd.concat(frames, ignore_index=True) if frames else None
-
-# ---------------------------
-# 気象
-# ---------------------------
-
-def get_weather_weatherapi(lat, lon):
-    try:
-        if not WEATHERAPI_KEY: return None
-        base = "https://api.weatherapi.com/v1"
-        p = f"key={WEATHERAPI_KEY}&q={lat},{lon}"
-        r = requests.get(f"{base}/current.json?{p}&aqi=no", timeout=10)
-        r.raise_for_status()
-        curr = r.json()
-        return {
-            "temp_c": curr["current"]["temp_c"],
-            "humidity": curr["current"]["humidity"],
-            "condition": curr["current"]["condition"]["text"],
-            "precip_mm": curr["current"].get("precip_mm", 0.0),
-            "wind_kph": curr["current"].get("wind_kph", 0.0),
-        }
-    except Exception:
-        return None
+def jitter_latlon(lat: float, lon: float, key, meters: float = 110.0) -> tuple[float, float]:
+    la, lo = jitter_latlon_arrays([lat], [lon], [stable_seed(key)], meters)
+    return float(la[0]), float(lo[0])
 
 
-def get_weather_openweather(lat, lon):
-    try:
-        if not OPENWEATHER_KEY: return None
-        url = "https://api.openweathermap.org/data/2.5/weather"
-        p = {"lat": lat, "lon": lon, "appid": OPENWEATHER_KEY, "units": "metric", "lang":"ja"}
-        r = requests.get(url, params=p, timeout=10); r.raise_for_status(); jd = r.json()
-        return {
-            "temp_c": jd["main"]["temp"], "humidity": jd["main"]["humidity"],
-            "condition": jd["weather"][0]["description"], "precip_mm": 0.0,
-            "wind_kph": jd.get("wind",{}).get("speed",0.0)*3.6,
-        }
-    except Exception:
-        return None
+# ---------------------------
+# 県警速報（プロセス共通の取得器とアーカイブ）
+# ---------------------------
 
+@st.cache_resource(show_spinner=False)
+def get_police_archive() -> PoliceArchive:
+    with perf.span("police.archive.open"): return PoliceArchive(POLICE_ARCHIVE_PATH)
 
-def get_weather(lat, lon):
-    w = get_weather_weatherapi(lat, lon) or get_weather_openweather(lat, lon)
-    return w or {"temp_c": 26.0, "humidity": 70, "condition": "晴れ", "precip_mm": 0.0, "wind_kph": 8.0}
-
-# ---------------------------
-# 月齢（mgpn v2→v3）
-# ---------------------------
-
-def _extract_moonage(payload) -> float | None:
-    if payload is None: return None
-    obj = payload[0] if isinstance(payload, list) and payload else payload
-    for k in ["moonage","moon_age","moonAge","age"]:
-        if obj and k in obj and obj[k] is not None:
-            try: return float(obj[k])
-            except: pass
-    return None
-
-
-def _phase_text_from_age(age: float | None) -> str | None:
-    if age is None: return None
-    a = age % 29.53
-    if a < 1.0: return "新月"
-    if a < 6.0: return "三日月（若月）"
-    if a < 8.9: return "上弦前後"
-    if a < 13.5: return "十三夜～満月前"
-    if a < 16.0: return "満月前後"
-    if a < 21.0: return "満月後～下弦前"
-    if a < 23.5: return "下弦前後"
-    if a < 28.0: return "有明月（残月）"
-    return "新月に近い"
-
-
-@st.cache_data(show_spinner=False, ttl=60*30)
-def get_mgpn_moon(lat: float, lon: float, dt_jst: datetime) -> dict | None:
-    t = dt_jst.strftime("%Y-%m-%dT%H:%M")
-    headers = {"Accept":"application/json"}
-    for base in ["https://mgpn.org/api/moon/v2position.cgi", "https://mgpn.org/api/moon/v3position.cgi"]:
-        for _ in range(3):
-            try:
-                params = {"time": t, "lat": f"{lat:.6f}", "lon": f"{lon:.6f}"}
-                if "v2" in base: params.update({"loop":1,"interval":0})
-                r = requests.get(base, params=params, headers=headers, timeout=8)
-                r.raise_for_status(); payload = r.json()
-                age = _extract_moonage(payload)
-                obj = payload[0] if isinstance(payload,list) and payload else payload
-                alt = float(obj.get("altitude")) if obj and "altitude" in obj else None
-                azi = float(obj.get("azimuth")) if obj and "azimuth" in obj else None
-                return {"moon_age":age, "phase_text":_phase_text_from_age(age), "altitude":alt, "azimuth":azi}
-            except Exception:
-                time.sleep(0.6)
-    return None
-
-
-def is_full_moon_like_text(phase_text: str | None, age: float | None) -> bool:
-    if phase_text and ("満月" in phase_text): return True
-    if age is not None:
-        a = age % 29.53
-        return 13.3 <= a <= 16.3
-    return False
-
-# ---------------------------
-# リスクスコア（0–100）
-# ---------------------------
-
-def compute_risk_score(weather: dict, now_dt: datetime, all_df: Optional[pd.DataFrame], moon_info: dict | None) -> dict:
-    score = 0.0; reasons = []
-    temp = float(weather.get("temp_c", 20.0))
-    precip = float(weather.get("precip_mm", 0.0))
-    humidity = float(weather.get("humidity", 60))
-    cond = str(weather.get("condition", ""))
-
-    if   temp >= 32: add = 42
-    elif temp >= 30: add = 36
-    elif temp >= 27: add = 28
-    elif temp >= 25: add = 20
-    elif temp >= 22: add = 10
-    else: add = 0
-    score += add
-    if add>0: reasons.append(f"気温{temp:.0f}℃:+{add}")
-
-    if precip >= 10: score -= 20; reasons.append("強い降雨:-20")
-    elif precip >= 1: score -= 8; reasons.append("降雨あり:-8")
-
-    hour = now_dt.hour
-    if 20 <= hour <= 23 or 0 <= hour <= 4: score += 15; reasons.append("夜間:+15")
-    elif 17 <= hour < 20: score += 7; reasons.append("夕方:+7")
-
-    if now_dt.weekday() in (4,5): score += 6; reasons.append("週末(+金土):+6")
-
-    moon_age = moon_info.get("moon_age") if moon_info else None
-    phase_tx = moon_info.get("phase_text") if moon_info else None
-    if is_full_moon_like_text(phase_tx, moon_age): score += 5; reasons.append("満月相当:+5")
-
-    if humidity >= 80: score += 3; reasons.append("高湿度:+3")
-
-    if all_df is not None and not all_df.empty:
-        sub = all_df.copy(); sub["month"] = sub["date"].dt.month
-        month_ratio = len(sub[sub["month"]==now_dt.month]) / max(1,len(sub))
-        if   month_ratio >= 0.12: score += 6; reasons.append("2019傾向(同月比 多め):+6")
-        elif month_ratio >= 0.08: score += 3; reasons.append("2019傾向(同月比 やや多め):+3")
-        if "ctype" in sub.columns:
-            vc = sub["ctype"].value_counts(normalize=True)
-            outdoor_like = float(vc.get("ひったくり",0)+vc.get("車上ねらい",0)+vc.get("自転車盗",0)+vc.get("オートバイ盗",0))
-            if   outdoor_like >= 0.45: score += 5; reasons.append("2019傾向(屋外系多):+5")
-            elif outdoor_like >= 0.30: score += 2; reasons.append("2019傾向(屋外系やや多):+2")
-
-    score = float(np.clip(score, 0, 100))
-    level = "Low" if score<25 else ("Moderate" if score<50 else ("High" if score<75 else "Very High"))
-    color = {"Low":"#0aa0ff","Moderate":"#ffd033","High":"#ff7f2a","Very High":"#ff2a2a"}[level]
-    return {"score": round(score,1), "level": level, "color": color, "reasons": reasons,
-            "moon_phase": phase_tx, "moon_age": moon_age,
-            "temp_c": temp, "humidity": humidity, "precip_mm": precip, "condition": cond}
-
-# ---------------------------
-# 県警速報スクレイピング（最新記事 → 市町出現回数＆アイテム抽出）
-# ---------------------------
-
-@st.cache_data(show_spinner=False, ttl=10*60)
-def fetch_police_text() -> str:
-    r = requests.get(EHIME_POLICE_URL, headers={"User-Agent": USER_AGENT}, timeout=12)
-    r.raise_for_status()
-    r.encoding = r.apparent_encoding or r.encoding or "utf-8"
-    return r.text
-
-
-def parse_police_items(html: str) -> List[Dict]:
-    # タグ除去→テキスト正規化
-    text = re.sub(r"<[^>]+>", "\n", html)
-    text = re.sub(r"\u3000|\r", " ", text)
-    text = re.sub(r"\n+", "\n", text)
-    lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
-
-    # 見出しは「■」で始まる行を採用
-    items = []
-    cur = None
-    for ln in lines:
-        if ln.startswith("■"):
-            if cur: items.append(cur)
-            cur = {"heading": ln, "body": []}
-        else:
-            if cur: cur["body"].append(ln)
-    if cur: items.append(cur)
-
-    # 正規化と抽出
-    out: List[Dict] = []
-    today = datetime.now(JST).date(); cy = today.year
-    for b in items:
-        heading = b.get("heading", "").strip()
-        body = " ".join(b.get("body", [])).strip()
-        # （10月16日 今治署）などから日付/署
-        m_date = re.search(r"（?(\d{1,2})月(\d{1,2})日", heading)
-        incident_date = None
-        if m_date:
-            m, d = int(m_date.group(1)), int(m_date.group(2)); y = cy
-            try:
-                d0 = datetime(y, m, d).date()
-                if d0 > today: y -= 1
-                incident_date = datetime(y, m, d).date().isoformat()
-            except Exception:
-                incident_date = None
-        m_station = re.search(r"（\d{1,2}月\d{1,2}日\s*([^\s）]+)）", heading)
-        station = m_station.group(1) if m_station else None
-
-        # 市町の推定（見出し+本文）
-        muni = None
-        for c in CITY_NAMES:
-            if c in heading or c in body:
-                muni = c; break
-
-        # カテゴリ（簡易・推測無しに近い語彙ベース）
-        cat = "その他"
-        patterns = [
-            ("交通事故", r"交通.*事故|自転車|二輪|乗用|衝突|交差点|人身事故|バス"),
-            ("火災", r"火災|出火|全焼|半焼|延焼"),
-            ("死亡事案", r"死亡事案|死亡が確認"),
-            ("窃盗", r"窃盗|万引|盗"),
-            ("詐欺", r"詐欺|還付金|投資詐欺|特殊詐欺"),
-            ("事件", r"威力業務妨害|条例違反|暴行|傷害|脅迫|器物損壊|青少年保護"),
-        ]
-        alltext = heading + " " + body
-        for name, pat in patterns:
-            if re.search(pat, alltext): cat = name; break
-
-        # 要約は原文短縮（憶測なし）
-        def short(s: str, n=120):
-            s = re.sub(r"\s+", " ", s).strip()
-            return s if len(s) <= n else s[:n] + "…"
-
-        out.append({
-            "heading": heading.replace("■", "").strip(),
-            "body": body,
-            "summary": short(body) if body else short(heading, 80),
-            "municipality": muni,
-            "station": station,
-            "category": cat,
-            "date": incident_date,
-        })
-    return out
+
+@st.cache_resource(show_spinner=False)
+def get_police_feed() -> PoliceFeed:
+    return PoliceFeed(archive=get_police_archive())
+
+
+def fetch_police_page() -> Dict:
+    return get_police_feed().poll()
 
 
-@st.cache_data(show_spinner=False, ttl=10*60)
 def fetch_police_items() -> List[Dict]:
-    html = fetch_police_text()
-    return parse_police_items(html)
+    return fetch_police_page()["items"]
 
-# muniカウント（SIBYL用）
-@st.cache_data(show_spinner=False, ttl=10*60)
-def fetch_police_muni_counts() -> Dict[str,int]:
+# muniカウント（SIBYL用）。window_days 指定時はアーカイブの直近N日の事案件数、None なら現在ページの出現回数
+def fetch_police_muni_counts(window_days: Optional[int] = None) -> Dict[str,int]:
     try:
-        html = fetch_police_text()
+        page = fetch_police_page()
     except Exception:
-        return {}
-    # タグ除去
-    text = re.sub(r"<[^>]+>", " ", html)
-    counts = {c: 0 for c in CITY_NAMES}
-    for c in CITY_NAMES:
-        counts[c] = len(re.findall(re.escape(c), text))
-    mx = max(counts.values()) if counts else 0
-    if mx > 0:
-        for k,v in counts.items():
-            counts[k] = int(min(v, max(1, mx)))
-    return counts
+        page = None
+    if window_days:
+        try:
+            counts = get_police_archive().muni_counts(window_days)
+            return {c: counts.get(c, 0) for c in CITY_NAMES}
+        except Exception: pass
+    return page["muni_counts"] if page else {}
 
 # ---------------------------
-# CC（Crime Coefficient 0–300）
+# st_folium 互換ラッパ
 # ---------------------------
 
-def compute_cc_from_risk_and_news(risk_score_0_100: float, recent_count: int) -> int:
-    cc = int(round(risk_score_0_100 * 2.4 + 30 * min(int(recent_count), 5)))
-    return int(clamp(cc, 0, 300))
+def show_map_html(html: str, height: int):
+    # 描画済みの地図 HTML を iframe で表示（st.iframe が無い版は components.html）
+    with perf.span("map.iframe", bytes=len(html)):
+        if hasattr(st, "iframe"): st.iframe(html, height=height)
+        else: components.html(html, height=height, scrolling=False)
 
-# ---------------------------
-# st_folium 互換ラッパ
-# ---------------------------
 
 def call_st_folium_with_fallback(m: folium.Map, height: int, key: str, return_last_clicked: bool = False):
+    from streamlit_folium import st_folium
     args = inspect.signature(st_folium).parameters
     kwargs = {"height": height, "key": key}
     try:
         if "returned_objects" in args and return_last_clicked:
             kwargs["returned_objects"] = ["last_clicked"]
-        return st_folium(m, **kwargs)
+        with perf.span("map.st_folium", key=key): return st_folium(m, **kwargs)
     except TypeError:
         try:
             kwargs.pop("returned_objects", None)
@@ -453,8 +205,7 @@ def call_st_folium_with_fallback(m: folium.Map, height: int, key: str, return_la
     except Exception:
         pass
     try:
-        html = m.get_root().render()
-        components.html(html, height=height, scrolling=False)
+        show_map_html(m.get_root().render(), height)
     except Exception:
         st.error("地図描画に失敗しました。ネットワークやタイルの到達性をご確認ください。")
     return {}
@@ -467,16 +218,16 @@ def _add_common_map_ui(m: folium.Map):
     folium.TileLayer("cartodbpositron", name="Light").add_to(m)
     folium.TileLayer("cartodbdark_matter", name="Dark").add_to(m)
     folium.TileLayer("OpenStreetMap", name="OSM").add_to(m)
-    Fullscreen(position="topleft").add_to(m)
-    MiniMap(zoom_level_fixed=5, toggle_display=True).add_to(m)
-    MeasureControl(position="topleft", primary_length_unit="meters").add_to(m)
-    MousePosition(
+    folium_plugins.Fullscreen(position="topleft").add_to(m)
+    folium_plugins.MiniMap(zoom_level_fixed=5, toggle_display=True).add_to(m)
+    folium_plugins.MeasureControl(position="topleft", primary_length_unit="meters").add_to(m)
+    folium_plugins.MousePosition(
         position="bottomright", separator=" | ", prefix="座標",
         lat_formatter="function(num) {return L.Util.formatNum(num, 6);}",
         lng_formatter="function(num) {return L.Util.formatNum(num, 6);}"
     ).add_to(m)
     try:
-        LocateControl(auto_start=False, flyTo=True, keepCurrentZoomLevel=True).add_to(m)
+        folium_plugins.LocateControl(auto_start=False, flyTo=True, keepCurrentZoomLevel=True).add_to(m)
     except Exception:
         pass
     folium.LayerControl(collapsed=True).add_to(m)
@@ -510,77 +261,313 @@ def load_json_if_exists(path: str) -> dict:
 
 
 def save_json(obj: dict, path: str):
+    # 一時ファイルに書いてから rename（読み手が書きかけのファイルを見ない）
     try:
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path,"w",encoding="utf-8") as f: json.dump(obj, f, ensure_ascii=False, indent=2)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp,"w",encoding="utf-8") as f: json.dump(obj, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
     except Exception: pass
 
 
 def nominatim_search(q: str) -> Tuple[Optional[float], Optional[float]]:
-    try:
-        headers = {"User-Agent": USER_AGENT, "Accept": "application/json"}
-        params = {"q": q, "format": "jsonv2", "limit": 1, "countrycodes": "jp", "addressdetails": 0}
-        r = requests.get("https://nominatim.openstreetmap.org/search", params=params, headers=headers, timeout=12)
-        r.raise_for_status(); items = r.json()
-        if items:
-            return float(items[0]["lat"]), float(items[0]["lon"])
-    except Exception:
-        return None, None
+    # (None, None) は「該当なし」（200 で空の結果）だけ。通信失敗・200 以外・停止中（CircuitOpenError）は例外のまま
+    #  呼び出し側は該当なしだけを失敗として記録する（一時的な障害で 24 時間引けなくならないように）
+    headers = {"User-Agent": USER_AGENT, "Accept": "application/json"}
+    params = {"q": q, "format": "jsonv2", "limit": 1, "countrycodes": "jp", "addressdetails": 0}
+    r = http_get("nominatim", NOMINATIM_URL, params=params, headers=headers)
+    if r.status_code != 200: raise RuntimeError(f"nominatim: HTTP {r.status_code}")
+    items = r.json()
+    if not isinstance(items, list): raise ValueError(f"nominatim: 想定外の応答 {str(items)[:100]}")
+    if items: return float(items[0]["lat"]), float(items[0]["lon"])
     return None, None
 
 
+class TokenBucket:
+    # 単純なトークンバケット。acquire() はトークンが貯まるまでブロック
+    def __init__(self, rate_per_s: float, capacity: float = 1.0):
+        self.rate, self.capacity = float(rate_per_s), float(capacity)
+        self._tokens = self.capacity; self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._t) * self.rate); self._t = now
+                if self._tokens >= 1.0: self._tokens -= 1.0; return
+                wait_s = (1.0 - self._tokens) / self.rate
+            time.sleep(wait_s)
+
+
+@st.cache_resource(show_spinner=False)
+def get_nominatim_bucket() -> TokenBucket:
+    return TokenBucket(NOMINATIM_RATE_PER_S)
+
+
+class GeocodeStore:
+    # 文字列キー→座標の永続キャッシュ（JSON）。ファイルは初回だけ読み、ヒット時はメモリのみ参照
+    #  ・失敗は failed_at 付きで記録し GEOCODE_NEGATIVE_TTL_S 後に再試行
+    #  ・書き出しは間隔を空けてまとめて行い、既存ファイル（他プロセス分）とマージしてから原子的に置換
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        with perf.span("geocode.load"): self._entries: Dict[str, dict] = load_json_if_exists(path)
+        self._dirty: Dict[str, dict] = {}
+        self._last_flush = 0.0
+        self.hits = self.negative_hits = self.misses = self.flushes = 0
+
+    def get(self, key: str) -> Optional[Tuple[Optional[float], Optional[float]]]:
+        # None = 未登録または失効（要問い合わせ）
+        with self._lock: v = self._entries.get(key)
+        if v is None: self.misses += 1; return None
+        if v.get("lat") is not None and v.get("lon") is not None: self.hits += 1; return v["lat"], v["lon"]
+        if time.time() - float(v.get("failed_at", 0)) < GEOCODE_NEGATIVE_TTL_S: self.negative_hits += 1; return None, None
+        self.misses += 1
+        return None
+
+    def put(self, key: str, lat: Optional[float], lon: Optional[float]):
+        v = {"lat": lat, "lon": lon} if lat is not None and lon is not None else {"lat": None, "lon": None, "failed_at": time.time()}
+        with self._lock: self._entries[key] = v; self._dirty[key] = v
+
+    def flush(self, force: bool = True):
+        with self._lock:
+            if not self._dirty: return
+            if not force and time.monotonic() - self._last_flush < GEOCODE_FLUSH_INTERVAL_S: return
+            with perf.span("geocode.flush", entries=len(self._dirty)):
+                merged = load_json_if_exists(self.path); merged.update(self._dirty)
+                save_json(merged, self.path)
+            self._entries = {**merged, **self._entries}
+            self._dirty.clear(); self._last_flush = time.monotonic(); self.flushes += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock: n, d = len(self._entries), len(self._dirty)
+        return {"size": n, "dirty": d, "hits": self.hits, "negative_hits": self.negative_hits,
+                "misses": self.misses, "flushes": self.flushes}
+
+
+class MuniGeocodeIndex:
+    # プロセス共通の市町村→座標インデックス。CITY_NAMES は MUNI_CENTROIDS（静的表）から即答
+    def __init__(self, path: str = MUNI_GEOCODE_CACHE_PATH):
+        self.store = GeocodeStore(path)
+
+    def lookup(self, muni: str) -> Tuple[Optional[float], Optional[float]]:
+        if not muni: return None, None
+        if muni in MUNI_CENTROIDS: return MUNI_CENTROIDS[muni]
+        hit = self.store.get(muni)
+        if hit is not None: return hit
+        get_nominatim_bucket().acquire()  # polite
+        try: lat, lon = nominatim_search(f"{muni} 愛媛県 日本")
+        except Exception: return None, None   # 通信失敗は記録しない（次回また問い合わせる）
+        self.store.put(muni, lat, lon); self.store.flush(force=False)
+        return lat, lon
+
+    def flush(self):
+        self.store.flush()
+
+
+@st.cache_resource(show_spinner=False)
+def get_geocode_index() -> MuniGeocodeIndex:
+    return MuniGeocodeIndex()
+
+
+@st.cache_resource(show_spinner=False)
+def get_address_store() -> GeocodeStore:
+    return GeocodeStore(ADDRESS_GEOCODE_CACHE_PATH)
+
+
 def geocode_municipality(muni: str) -> Tuple[Optional[float], Optional[float]]:
-    if not muni: return None, None
-    cache = load_json_if_exists(MUNI_GEOCODE_CACHE_PATH)
-    if muni in cache: v = cache[muni]; return v.get("lat"), v.get("lon")
-    time.sleep(0.6)  # polite
-    lat, lon = nominatim_search(f"{muni} 愛媛県 日本")
-    cache[muni] = {"lat": lat, "lon": lon}; save_json(cache, MUNI_GEOCODE_CACHE_PATH)
-    return lat, lon
+    return get_geocode_index().lookup(muni)
 
 # ---------------------------
 # 2019概位置レイヤ
 # ---------------------------
 
-def add_2019_layer(m: folium.Map, all_df: Optional[pd.DataFrame], max_points: int = 800):
+CTYPE_COLORS_2019 = {
+    "ひったくり":"red","車上ねらい":"orange","部品ねらい":"#ff8e7f",
+    "自動車盗":"darkred","オートバイ盗":"cadetblue","自転車盗":"blue",
+    "自動販売機ねらい":"purple","不明":"gray"
+}
+# 1行 = [lat, lon, 市町番号, 種別番号]。市町名/種別/色は表で1回だけ送り、マーカーとポップアップはブラウザ側で生成
+_FAST_2019_CALLBACK = """
+var MUNI = %s, CTYPE = %s, COLOR = %s;
+function callback(row) {
+    var mk = L.circleMarker(new L.LatLng(row[0], row[1]),
+                            {radius: 5, color: COLOR[row[3]], fill: true, fillOpacity: 0.6});
+    mk.bindPopup(function () { return "<b>" + MUNI[row[2]] + "</b><br>種別: " + CTYPE[row[3]] + "<br>（概位置）"; },
+                 {maxWidth: 260});
+    return mk;
+}
+"""
+
+
+def build_2019_points(all_df: pd.DataFrame, jitter_m: float = 120.0) -> Tuple[List[list], List[str], List[str]]:
+    # 市町ごとに1回だけ座標を引き、ジッターは配列で一括。座標の引けない行（市町なし等）は除外
+    # ジッターのシードは行内容＋行番号のハッシュ（同じデータなら毎回同じ配置。同一内容の行も重ならない）
+    muni = all_df["municipality"].fillna("").astype(str).str.strip().to_numpy(dtype=object)
+    ctype = (all_df["ctype"].fillna("不明").astype(str).to_numpy(dtype=object) if "ctype" in all_df.columns
+             else np.full(len(all_df), "不明", dtype=object))
+    muni_code, munis = pd.factorize(muni)
+    ctype_code, ctypes = pd.factorize(ctype)
+    cent = np.array([geocode_municipality(u) if u else (None, None) for u in munis], dtype=float).reshape(-1, 2)
+    lat0, lon0 = cent[muni_code, 0], cent[muni_code, 1]
+    ok = np.isfinite(lat0) & np.isfinite(lon0) & (lat0 != 0) & (lon0 != 0)
+    seeds = pd.util.hash_pandas_object(all_df[[c for c in ("date", "municipality", "ctype") if c in all_df.columns]],
+                                       index=True).to_numpy(dtype=np.uint64)
+    lat, lon = jitter_latlon_arrays(lat0[ok], lon0[ok], seeds[ok], meters=jitter_m)
+    rows = [list(r) for r in zip(np.round(lat, 5).tolist(), np.round(lon, 5).tolist(),
+                                 muni_code[ok].tolist(), ctype_code[ok].tolist())]
+    return rows, list(munis), list(ctypes)
+
+
+@st.cache_data(show_spinner=False)
+def get_2019_points(dataset_version: str, _all_df: pd.DataFrame) -> Tuple[List[list], List[str], List[str]]:
+    # ジッターは決定的なので、同じデータ版なら点列も同じ
+    out = build_2019_points(_all_df)
+    get_geocode_index().flush()
+    return out
+
+
+def add_2019_layer(m: folium.Map, all_df: Optional[pd.DataFrame], max_points: Optional[int] = None,
+                   dataset_version: Optional[str] = None):
+    # 全件を FastMarkerCluster 1個（コンパクトな配列＋JS コールバック）で描画。max_points 指定時のみ間引く
     if all_df is None or all_df.empty: return
-    df = all_df.copy().sample(frac=1.0, random_state=42).head(max_points)
-    fg = folium.FeatureGroup(name="2019概位置（重心＋微ジッター）"); cl = MarkerCluster(name="2019クラスタ").add_to(fg)
-    color_map = {
-        "ひったくり":"red","車上ねらい":"orange","部品ねらい":"lightred",
-        "自動車盗":"darkred","オートバイ盗":"cadetblue","自転車盗":"blue",
-        "自動販売機ねらい":"purple","不明":"gray"
-    }
-    muni_cache = {}
-    for _, r in df.iterrows():
-        muni = str(r.get("municipality") or "").strip(); ctype = str(r.get("ctype") or "不明")
-        if not muni: continue
-        if muni in muni_cache: lat0, lon0 = muni_cache[muni]
-        else: lat0, lon0 = geocode_municipality(muni); muni_cache[muni]=(lat0,lon0)
-        if not lat0 or not lon0: continue
-        lat, lon = jitter_latlon(lat0, lon0, meters=120.0)
-        ic = color_map.get(ctype, "gray")
-        html = f"<b>{muni}</b><br>種別: {ctype}<br>（概位置）"
-        folium.CircleMarker([lat, lon], radius=5, color=ic, fill=True, fill_opacity=0.6,
-                            popup=folium.Popup(html, max_width=260)).add_to(cl)
+    if dataset_version is not None and (max_points is None or len(all_df) <= max_points):
+        rows, munis, ctypes = get_2019_points(dataset_version, all_df)
+    else:
+        df = all_df if max_points is None or len(all_df) <= max_points else all_df.sample(n=max_points, random_state=42)
+        rows, munis, ctypes = build_2019_points(df)
+        get_geocode_index().flush()
+    if not rows: return
+    fg = folium.FeatureGroup(name="2019概位置（重心＋微ジッター）")
+    dumps = lambda o: json.dumps(o, ensure_ascii=False)
+    callback = _FAST_2019_CALLBACK % (dumps(munis), dumps(ctypes), dumps([CTYPE_COLORS_2019.get(c, "gray") for c in ctypes]))
+    folium_plugins.FastMarkerCluster(rows, callback=callback, name="2019クラスタ").add_to(fg)
     fg.add_to(m)
 
+# ---------------------------
+# 2019集計レイヤ（ヘックス格子 × 手口 × 月）
+# ---------------------------
+
+MONTH_OPTIONS_2019 = [None] + list(range(1, 13))
+
+
+@st.cache_data(show_spinner=False)
+def get_incident_bins(dataset_version: str, _all_df: Optional[pd.DataFrame], cell_m: float = HEX_CELL_M) -> IncidentBins:
+    # データ版ごとに1回だけ集計（_all_df はハッシュ対象外。版が同じなら中身も同じ）
+    munis = [] if _all_df is None or _all_df.empty else _all_df["municipality"].astype(str).str.strip().unique().tolist()
+    centroids = {mu: geocode_municipality(mu) for mu in munis if mu}
+    get_geocode_index().flush()
+    return build_incident_bins(_all_df, centroids, dataset_version, cell_m, EHIME_CENTER_LAT)
+
+
+def add_incident_hex_layer(m: folium.Map, bins: Optional[IncidentBins], ctype: Optional[str] = None, month: Optional[int] = None):
+    # 描画量はヘックス数で決まり、元データの行数には依存しない
+    if bins is None or bins.empty: return
+    totals = bins.cell_totals(ctype, month)
+    if totals.empty: return
+    detail = {k: d for k, d in bins.muni_totals(ctype, month).groupby(["q", "r"])}
+    cmap = bcm.linear.YlOrRd_09.scale(0, max(1, int(totals["count"].max())))
+    features = []
+    for q, r, n in totals[["q", "r", "count"]].itertuples(index=False):
+        d = detail[(q, r)]
+        munis = "・".join(d.groupby("municipality")["count"].sum().sort_values(ascending=False).index[:4])
+        top = d.groupby("ctype")["count"].sum().sort_values(ascending=False).head(3)
+        ring = [[lon, lat] for lat, lon in hex_polygon(int(q), int(r), bins.cell_m, bins.origin_lat)]
+        features.append({"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring + ring[:1]]},
+                         "properties": {"count": int(n), "munis": munis, "fill": cmap(int(n)),
+                                        "top": " / ".join(f"{k} {int(v)}" for k, v in top.items())}})
+    name = "2019集計（ヘックス）" + (f"・{ctype}" if ctype else "") + (f"・{month}月" if month else "")
+    fg = folium.FeatureGroup(name=name)
+    folium.GeoJson({"type": "FeatureCollection", "features": features},
+                   style_function=lambda f: {"fillColor": f["properties"]["fill"], "color": "#ffffff", "weight": 0.5, "fillOpacity": 0.55},
+                   tooltip=folium.GeoJsonTooltip(fields=["count", "munis", "top"], aliases=["件数", "市町", "主な手口"])).add_to(fg)
+    fg.add_to(m)
+
+# ---------------------------
+# 選択地点の周辺（格子インデックスで半径/k近傍検索）
+# ---------------------------
+
+NEARBY_RADIUS_M = 5000        # スコアカード下に並べる範囲
+NEARBY_BANDWIDTH_M = 6000     # 密度のガウス核の幅（市町の代表点どうしの間隔程度）
+NEARBY_CELL_M = 2000
+
+
+class IncidentNearby:
+    # 2019件数を市町の代表点に置いた重み付き点群。基準は各市町の代表点での密度の平均（県平均）
+    def __init__(self, bins: Optional[IncidentBins]):
+        t = bins.by_muni.groupby("municipality")["count"].sum() if bins is not None and not bins.empty else pd.Series(dtype=float)
+        pts = {mu: geocode_municipality(mu) for mu in t.index}
+        t = t[[bool(pts[mu][0] and pts[mu][1]) for mu in t.index]]
+        self.munis: List[str] = t.index.tolist(); self.counts = t.to_numpy(dtype=float)
+        self.index = GridIndex([pts[mu][0] for mu in self.munis], [pts[mu][1] for mu in self.munis], self.counts,
+                               cell_m=NEARBY_CELL_M, origin_lat=EHIME_CENTER_LAT)
+        ref = [MUNI_CENTROIDS[mu] for mu in CITY_NAMES]
+        dens = self.index.densities([p[0] for p in ref], [p[1] for p in ref], NEARBY_BANDWIDTH_M)
+        self.baseline = float(np.mean(dens)) if len(self.index) else 0.0
+
+    def density_ratio(self, lat: float, lon: float) -> Optional[float]:
+        if self.baseline <= 0: return None
+        return self.index.density(lat, lon, NEARBY_BANDWIDTH_M) / self.baseline
+
+    def nearest(self, lat: float, lon: float, k: int = 3) -> List[Tuple[str, float, int]]:
+        idx, d = self.index.nearest(lat, lon, k)
+        return [(self.munis[i], float(di), int(self.counts[i])) for i, di in zip(idx.tolist(), d.tolist())]
+
+
+@st.cache_resource(show_spinner=False)
+def get_incident_nearby(dataset_version: str, _all_df: Optional[pd.DataFrame]) -> IncidentNearby:
+    return IncidentNearby(get_incident_bins(dataset_version, _all_df))
+
+
+def get_police_point_index(police_items: List[Dict]) -> Tuple[GridIndex, list]:
+    # 速報の内容ごとに1回だけ（地図と同じ TTL キャッシュに相乗り）
+    def _build():
+        placed = place_police_items(police_items)
+        return GridIndex([p[2] for p in placed], [p[3] for p in placed], cell_m=NEARBY_CELL_M, origin_lat=EHIME_CENTER_LAT), placed
+    return get_map_cache().get_or_fetch(("police_points", police_items_digest(police_items)), _build)
+
+
+def nearby_summary(lat: float, lon: float, all_df: Optional[pd.DataFrame], data_version: str,
+                   police_items: List[Dict], radius_m: float = NEARBY_RADIUS_M, limit: int = 8) -> dict:
+    # 地図クリックのたびに呼ぶ前提（索引の構築はデータ版/速報の内容ごとに1回、検索は格子数個分）
+    inc = get_incident_nearby(data_version, all_df)
+    pidx, placed = get_police_point_index(police_items)
+    idx, d = pidx.radius(lat, lon, radius_m)
+    return {"density_ratio": inc.density_ratio(lat, lon), "radius_m": radius_m,
+            "munis": inc.nearest(lat, lon),
+            "police": [(placed[i][0], placed[i][1], float(di)) for i, di in zip(idx[:limit].tolist(), d[:limit].tolist())],
+            "police_total": int(len(idx))}
+
 # ---------------------------
 # SIBYL：犯罪係数レイヤ（市町単位）
 # ---------------------------
 
-def add_sybil_cc_layer(m: folium.Map, muni_counts: Dict[str,int], base_dt: datetime, all_df: pd.DataFrame):
-    if not muni_counts: return
-    fg = folium.FeatureGroup(name="犯罪係数（SIBYL）")
-    ranks = []
+def compute_sibyl_cells(muni_counts: Dict[str,int], base_dt: datetime, history: Optional[HistoricalProfile]) -> List[tuple]:
+    # 市町ごとの (muni, lat, lon, cc, recent, risk)。地図に載せる前の計算部分（キャッシュ単位）
+    points = {}
     for muni in CITY_NAMES:
         lat0, lon0 = geocode_municipality(muni)
         if not lat0 or not lon0: continue
-        weather = get_weather(lat0, lon0)
-        moon = get_mgpn_moon(lat0, lon0, base_dt)
-        risk = compute_risk_score(weather, base_dt, all_df, moon)["score"]
+        points[muni] = (lat0, lon0)
+    with perf.span("sibyl.conditions", points=len(points)): conditions = fetch_conditions_concurrent(points, base_dt)
+    cells = []
+    for muni, (lat0, lon0) in points.items():
+        weather = conditions[muni]["weather"]
+        moon = conditions[muni]["moon"]
+        risk = compute_risk_score(weather, base_dt, history, moon)["score"]
         recent = int(muni_counts.get(muni, 0))
-        cc = compute_cc_from_risk_and_news(risk, recent)
+        cells.append((muni, lat0, lon0, compute_cc_from_risk_and_news(risk, recent), recent, risk))
+    return cells
+
+
+def add_sybil_cc_layer(m: folium.Map, muni_counts: Dict[str,int], base_dt: datetime, history: Optional[HistoricalProfile],
+                       cells: Optional[List[tuple]] = None):
+    if not muni_counts: return
+    if cells is None: cells = compute_sibyl_cells(muni_counts, base_dt, history)
+    fg = folium.FeatureGroup(name="犯罪係数（SIBYL）")
+    ranks = []
+    for muni, lat0, lon0, cc, recent, risk in cells:
         if   cc >= 250: color = "#ff1a1a"
         elif cc >= 150: color = "#ff9f2a"
         elif cc >= 100: color = "#ffd033"
@@ -599,21 +586,32 @@ def add_sybil_cc_layer(m: folium.Map, muni_counts: Dict[str,int], base_dt: datet
 # 県警速報レイヤ（事案アイテムをマッピング）
 # ---------------------------
 
-def add_police_items_layer(m: folium.Map, items: List[Dict]):
-    if not items: return
-    fg = folium.FeatureGroup(name="県警速報（近似プロット）")
-    cl = MarkerCluster(name="速報クラスタ").add_to(fg)
-    color_map = {
-        "交通事故":"orange","火災":"red","死亡事案":"purple","窃盗":"blue","詐欺":"green","事件":"cadetblue","その他":"gray"
-    }
+def place_police_items(items: List[Dict]) -> List[Tuple[Dict, str, float, float]]:
+    # 市町の代表点＋ジッターの位置 [(item, 市町, lat, lon)]。地図レイヤと周辺検索で同じ位置を使う
     muni_cache = {}
+    placed = []
     for it in items:
         muni = it.get("municipality")
         if not muni: continue
         if muni in muni_cache: lat0, lon0 = muni_cache[muni]
         else: lat0, lon0 = geocode_municipality(muni); muni_cache[muni]=(lat0,lon0)
         if not lat0 or not lon0: continue
-        lat, lon = jitter_latlon(lat0, lon0, meters=160.0)
+        placed.append((it, muni, lat0, lon0))
+    # ジッターは事案 key から決まる（再実行しても同じ位置）
+    seeds = [stable_seed(it.get("key") or it.get("heading") or "") for it, *_ in placed]
+    lats, lons = jitter_latlon_arrays([p[2] for p in placed], [p[3] for p in placed], seeds, meters=160.0)
+    get_geocode_index().flush()
+    return [(it, muni, lat, lon) for (it, muni, _, _), lat, lon in zip(placed, lats.tolist(), lons.tolist())]
+
+
+def add_police_items_layer(m: folium.Map, items: List[Dict]):
+    if not items: return
+    fg = folium.FeatureGroup(name="県警速報（近似プロット）")
+    cl = folium_plugins.MarkerCluster(name="速報クラスタ").add_to(fg)
+    color_map = {
+        "交通事故":"orange","火災":"red","死亡事案":"purple","窃盗":"blue","詐欺":"green","事件":"cadetblue","その他":"gray"
+    }
+    for it, muni, lat, lon in place_police_items(items):
         col = color_map.get(it.get("category") or "その他", "gray")
         h = it.get("heading") or ""
         d = it.get("date") or "日時不明"
@@ -622,35 +620,89 @@ def add_police_items_layer(m: folium.Map, items: List[Dict]):
         folium.Marker([lat,lon], popup=folium.Popup(html, max_width=320), icon=folium.Icon(color=col, icon="info-sign")).add_to(cl)
     fg.add_to(m)
 
+# ---------------------------
+# 結果地図（SIBYL/2019/速報）のキャッシュ
+# ---------------------------
+
+MAP_CACHE_TTL_S = 6 * 3600      # 内容はキーで決まる（TTL はメモリ解放のため）
+MAP_CACHE_MAXSIZE = 8
+SIBYL_TIME_BUCKET_S = WEATHER_TIME_BUCKET_S   # SIBYL の基準時刻の丸め（気象キャッシュと同じ粒度）
+
+
+@st.cache_resource(show_spinner=False)
+def get_map_cache() -> TTLCache:
+    return TTLCache(ttl=MAP_CACHE_TTL_S, maxsize=MAP_CACHE_MAXSIZE, name="map")
+
+
+def sibyl_base_time(now: Optional[float] = None) -> datetime:
+    t = time.time() if now is None else now
+    return datetime.fromtimestamp(int(t // SIBYL_TIME_BUCKET_S) * SIBYL_TIME_BUCKET_S, JST)
+
+
+def police_items_digest(items: List[Dict]) -> str:
+    # key は訂正されても変わらないので内容ハッシュも含める（地図のポップアップが古い本文のままにならないように）
+    return hashlib.sha1("\n".join(f"{it.get('key') or it.get('heading') or ''}:{it.get('hash') or ''}" for it in items)
+                        .encode("utf-8")).hexdigest()[:16]
+
+
+def get_result_map_html(all_df: Optional[pd.DataFrame], history: Optional[HistoricalProfile], data_version: str,
+                        police_items: List[Dict], muni_counts: Optional[Dict[str,int]], base_dt: datetime,
+                        hex_opts: Optional[tuple]) -> Tuple[str, Optional[list]]:
+    # 実際の入力（データ版・速報の内容・SIBYL の基準時刻と件数・表示設定）のハッシュで、描画済み HTML ごと再利用。
+    # folium.Map は描画のたびに要素が増える（同じ Map の再描画は不可）ため、保持するのは HTML 文字列
+    # SIBYL の計算結果は別キーで持つので、表示設定だけが変わった場合も気象取得/スコア計算はやり直さない
+    # muni_counts=None は SIBYL レイヤなし、hex_opts=None は集計レイヤなし
+    cache = get_map_cache()
+    counts_key = tuple(sorted(muni_counts.items())) if muni_counts else None
+    sibyl_key = ("sibyl", data_version, counts_key, base_dt.isoformat()) if counts_key else None
+    key = ("result_map", data_version, police_items_digest(police_items), sibyl_key, hex_opts)
+
+    def _build():
+        fmap2 = folium.Map(location=[EHIME_CENTER_LAT, EHIME_CENTER_LON], zoom_start=9, tiles="cartodbdark_matter")
+        _add_common_map_ui(fmap2)
+        ranks = None
+        if sibyl_key:
+            with perf.span("layer.sibyl"):
+                cells = cache.get_or_fetch(sibyl_key, lambda: compute_sibyl_cells(muni_counts, base_dt, history))
+                ranks = add_sybil_cc_layer(fmap2, muni_counts, base_dt, history, cells=cells)
+        with perf.span("layer.2019"): add_2019_layer(fmap2, all_df, dataset_version=data_version)
+        if hex_opts is not None:
+            with perf.span("layer.hex"): add_incident_hex_layer(fmap2, get_incident_bins(data_version, all_df), *hex_opts)
+        with perf.span("layer.police"): add_police_items_layer(fmap2, police_items)
+        with perf.span("map.result.render") as sp:
+            html = fmap2.get_root().render(); sp.set(bytes=len(html))
+        return html, ranks
+    return cache.get_or_fetch(key, _build)
+
 # ---------------------------
 # POI
 # ---------------------------
-@st.cache_data(show_spinner=False, ttl=60*30)
-def fetch_pois_overpass(lat: float, lon: float, radius_m: int = 1200) -> list[dict]:
-    q = f"""
-    [out:json][timeout:25];
-    (
-      node(around:{radius_m},{lat},{lon})["railway"="station"];
-      node(around:{radius_m},{lat},{lon})["public_transport"~"stop_position|platform"];
-      node(around:{radius_m},{lat},{lon})["amenity"="bicycle_parking"];
-      node(around:{radius_m},{lat},{lon})["amenity"="convenience"];
-      node(around:{radius_m},{lat},{lon})["amenity"="parking"];
-      node(around:{radius_m},{lat},{lon})["leisure"="park"];
-      node(around:{radius_m},{lat},{lon})["amenity"="atm"];
-      node(around:{radius_m},{lat},{lon})["amenity"~"bar|nightclub|pub"];
-    );
-    out center 200;
-    """
+@st.cache_resource(show_spinner=False)
+def get_poi_store() -> PoiTileStore:
+    store = PoiTileStore(POI_CACHE_PATH)
+    if os.path.exists(POI_EXTRACT_PATH):
+        try: store.load_extract(POI_EXTRACT_PATH, bbox=(EHIME_BBOX["min_lat"], EHIME_BBOX["min_lon"], EHIME_BBOX["max_lat"], EHIME_BBOX["max_lon"]))
+        except Exception as e: store.extract_error = f"{os.path.basename(POI_EXTRACT_PATH)}: {e}"
+    return store
+
+
+def fetch_overpass_bbox(bbox: Tuple[float, float, float, float]) -> Optional[list]:
+    # 失敗時は None（タイルを空として記録しない）
     try:
-        r = requests.post(OVERPASS_URL, data=q.encode("utf-8"), headers={"User-Agent": USER_AGENT}, timeout=30)
+        r = http_post("overpass", OVERPASS_URL, data=overpass_bbox_query(bbox).encode("utf-8"), headers={"User-Agent": USER_AGENT})
         r.raise_for_status(); js = r.json(); return js.get("elements", [])
     except Exception:
-        return []
+        return None
+
+
+def fetch_pois_overpass(lat: float, lon: float, radius_m: int = 1200) -> list[dict]:
+    # タイル単位のキャッシュ（＋県全域の抽出）から円内を切り出す。足りないタイルだけ Overpass に1回で問い合わせ
+    return get_poi_store().query(lat, lon, radius_m, fetch_bbox=fetch_overpass_bbox)
 
 
 def add_poi_layer(m: folium.Map, pois: list[dict]):
     if not pois: return
-    fg = folium.FeatureGroup(name="近傍POI"); cl = MarkerCluster(name="POIクラスタ").add_to(fg)
+    fg = folium.FeatureGroup(name="近傍POI"); cl = folium_plugins.MarkerCluster(name="POIクラスタ").add_to(fg)
     for e in pois:
         lat, lon = e.get("lat"), e.get("lon")
         if lat is None or lon is None: continue
@@ -666,24 +718,214 @@ def add_poi_layer(m: folium.Map, pois: list[dict]):
 # CSVアップロード（住所→座標）
 # ---------------------------
 
-def geocode_address_rows(df: pd.DataFrame, addr_col: str, muni_col: Optional[str]) -> pd.DataFrame:
-    res = []
-    for _, r in df.iterrows():
-        addr = str(r.get(addr_col,"")); muni = str(r.get(muni_col,"")) if (muni_col and muni_col in df.columns) else ""
-        if not addr.strip():
-            res.append({"lat": None, "lon": None}); continue
-        q = f"愛媛県 {muni} {addr}".strip()
-        lat, lon = nominatim_search(q); time.sleep(0.8)
-        res.append({"lat": lat, "lon": lon})
-    geo = pd.DataFrame(res)
+GEOCODE_CHECKPOINT_EVERY = 10   # 新規問い合わせ N 件ごとにキャッシュを書き出し（中断しても再実行で続きから）
+
+
+def normalize_address_query(q: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", q)).strip()
+
+
+def iter_geocode_queries(queries: List[str], store: GeocodeStore, bucket: TokenBucket):
+    # 重複を除いた問い合わせを順に解決して (完了数, 総数, 問い合わせ, lat, lon, キャッシュ由来か) を逐次返す
+    #  通信失敗は未解決として返すだけで記録しない。相手が停止中（ブレーカ open）になったら残りは問い合わせない
+    uniq = list(dict.fromkeys(q for q in queries if q))
+    fetched = 0; down = False
+    try:
+        for i, q in enumerate(uniq, start=1):
+            hit = store.get(q)
+            if hit is not None:
+                yield i, len(uniq), q, hit[0], hit[1], True; continue
+            if down:
+                yield i, len(uniq), q, None, None, False; continue
+            bucket.acquire()
+            try: lat, lon = nominatim_search(q)
+            except CircuitOpenError: down = True; yield i, len(uniq), q, None, None, False; continue
+            except Exception: yield i, len(uniq), q, None, None, False; continue
+            store.put(q, lat, lon); fetched += 1
+            if fetched % GEOCODE_CHECKPOINT_EVERY == 0: store.flush()
+            yield i, len(uniq), q, lat, lon, False
+    finally:
+        store.flush()
+
+
+def geocode_address_rows(df: pd.DataFrame, addr_col: str, muni_col: Optional[str],
+                         progress: Optional[Callable[[int, int, str, Optional[float], Optional[float]], None]] = None) -> pd.DataFrame:
+    addrs = df[addr_col].astype(str) if addr_col in df.columns else pd.Series([""] * len(df), index=df.index)
+    munis = df[muni_col].astype(str) if (muni_col and muni_col in df.columns) else pd.Series([""] * len(df), index=df.index)
+    queries = [normalize_address_query(f"愛媛県 {m} {a}") if a.strip() else "" for a, m in zip(addrs, munis)]
+    resolved: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+    for done, total, q, lat, lon, _cached in iter_geocode_queries(queries, get_address_store(), get_nominatim_bucket()):
+        resolved[q] = (lat, lon)
+        if progress: progress(done, total, q, lat, lon)
+    geo = pd.DataFrame([resolved.get(q, (None, None)) if q else (None, None) for q in queries], columns=["lat", "lon"])
     return pd.concat([df.reset_index(drop=True), geo], axis=1)
 
 # ---------------------------
 # メイン
 # ---------------------------
 
+# ---------------------------
+# 画面パーツ（地図に影響しない操作は fragment 内だけ再実行）
+# ---------------------------
+
+# st.fragment（1.37+）/ st.experimental_fragment（1.33–1.36）。どちらも無い版では通常の関数として実行
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+
+
+@fragment
+def police_feed_panel(police_items: List[Dict]):
+    # 速報リスト（スクロールボックス）
+    st.markdown("<div class='card'>**県警速報：事故事案/犯罪事案**</div>", unsafe_allow_html=True)
+    # 警察アイテムは左側でフェッチ済みのものを共有（この部分だけの再実行でも同じ一覧を使う）
+    feed = get_police_feed(); fresh = set(feed.new_keys)
+    fs = feed.stats()
+    st.caption(f"前回更新以降の新着: {len(fresh)}件 / 取得 {fs['polls']}回（うち変化なし {fs['not_modified']}回）"
+               + (f" / 取得失敗 {fs['errors']}回" if fs["errors"] else "")
+               + (f" / 最終変化 {datetime.fromtimestamp(fs['last_change'], JST):%H:%M}" if fs["last_change"] else ""))
+    # フィルタUI（アーカイブのバイグラム索引で検索。現在ページはページ上の key に限定）
+    #  現在ページの表示は police_items から作り、索引は絞り込みにだけ使う（蓄積に失敗した/他プロセスが蓄積した事案も出す）
+    period = POLICE_VIEW_PERIODS[st.selectbox("表示期間", list(POLICE_VIEW_PERIODS))]
+    q = st.text_input("キーワード（見出し/本文・空白区切りでAND・OR/| で OR）")
+    archive = get_police_archive()
+    since = datetime.now(JST).date() - timedelta(days=period - 1) if period else None
+    page_keys = None if period else [it["key"] for it in police_items]
+    if page_keys is not None: archive.index_items(police_items)
+    cats = sorted(archive.search("", start=since, keys=page_keys, limit=0)[1])
+    facets = archive.search(q, start=since, keys=page_keys, limit=0)[1] if q.strip() else None
+    sel = st.multiselect("表示カテゴリ", options=cats, default=cats,
+                         format_func=lambda c: f"{c}（{facets.get(c, 0)}）" if facets is not None else c)
+
+    # フィルタ適用
+    if page_keys is None: view, _, n_hit = archive.search(q, start=since, categories=sel, limit=500)
+    else:
+        by_key = {it["key"]: it for it in police_items}
+        hit_keys, _, n_hit = archive.search(q, categories=sel, keys=page_keys, limit=500, rows=False)
+        view = [by_key[k] for k in hit_keys]
+    if n_hit > len(view): st.caption(f"{n_hit}件中 新しい順に{len(view)}件を表示")
+    terms = [t for g in parse_search_query(q) for t in g]
+
+    # スクロール表示
+    html = ["<div class='scrollbox'>"]
+    color_map = {"交通事故":"#ffa64d","火災":"#ff4d4d","死亡事案":"#c37dff","窃盗":"#66a3ff","詐欺":"#33d1a5","事件":"#ffd94d","その他":"#9aa7b1"}
+    for it in view:
+        h = highlight_terms(it.get("heading") or "", terms)
+        d = it.get("date") or "日時不明"; muni = it.get("municipality") or "市町村不明"
+        cat = it.get("category") or "その他"; s = highlight_terms(it.get("summary") or "", terms)
+        color = color_map.get(cat, "#9aa7b1")
+        new_pill = "<span class='rank-pill'>NEW</span>" if it.get("key") in fresh else ""
+        html.append(
+            f"<div class='feed-item'>"
+            f"<b style='color:{color}'>{cat}</b>{new_pill}  <span class='meta'>{d} / {muni}</span><br>"
+            f"<div>{h}</div>"
+            f"<div class='meta'>{s}</div>"
+            f"<a href='{EHIME_POLICE_URL}' target='_blank'>出典: 愛媛県警 事件事故速報</a>"
+            f"</div>"
+        )
+    if not view:
+        html.append("<div class='feed-item'>該当する項目がありません。</div>")
+    html.append("</div>")
+    st.markdown("\n".join(html), unsafe_allow_html=True)
+
+
+@fragment
+def address_upload_panel():
+    # CSVアップロード（簡略）
+    st.markdown("<div class='card'>**CSVアップロード（住所→座標）**</div>", unsafe_allow_html=True)
+    up = st.file_uploader("住所CSVを選択（UTF-8/CP932等自動判別）", type=["csv"])
+    colu1, colu2, colu3 = st.columns([2,2,1])
+    with colu1: addr_col = st.text_input("住所列名（必須）", value="住所")
+    with colu2: muni_col = st.text_input("市町村列名（任意）", value="市町村")
+    with colu3: geo_run = st.button("ジオコーディング実行", use_container_width=True)
+
+    if up is not None and geo_run:
+        try:
+            raw = up.read()
+            df_tmp = read_csv_bytes(raw, engine="python")
+            with st.spinner("Nominatimで住所を座標化中（礼節1秒/件・重複/取得済みは省略）…"):
+                prog = st.progress(0.0); latest = st.empty(); recent_rows: List[dict] = []
+                def _on_progress(done, total, q, lat, lon):
+                    prog.progress(done / max(1, total), text=f"{done}/{total} 件（重複除外後）")
+                    recent_rows.append({"住所": q, "lat": lat, "lon": lon})
+                    latest.dataframe(pd.DataFrame(recent_rows[-8:]), hide_index=True, use_container_width=True)
+                udf = geocode_address_rows(df_tmp, addr_col, muni_col if muni_col in df_tmp.columns else None, progress=_on_progress)
+                st.session_state.user_geo_df = udf
+            ok = udf[["lat","lon"]].notna().all(axis=1).sum()
+            st.success(f"ジオコーディング完了：{ok}/{len(udf)} 行で座標取得")
+        except Exception as e:
+            st.error(f"CSV読込/ジオコーディングに失敗: {e}")
+
+
+@fragment
+def forecast_panel(count_window: Optional[int], history: Optional[HistoricalProfile]):
+    # SIBYL 予報タイムライン（下段共通）
+    st.markdown("<div class='card'>**SIBYL：犯罪係数 予報タイムライン（市町×1時間）**</div>", unsafe_allow_html=True)
+    colf1, colf2 = st.columns([1,3])
+    with colf1:
+        horizon = st.radio("予報期間", [24, 168], format_func=lambda h: f"{h}時間", horizontal=True)
+        fc_btn = st.button("予報を計算", use_container_width=True)
+    with colf2: st.caption("時間別の気象予報（API未設定時は既定値）・月齢・週末/時間帯・2019傾向・速報件数から各市町のCCを一括算出")
+    if fc_btn:
+        with st.spinner("市町別の時間予報を計算中…"):
+            st.session_state.cc_forecast = compute_cc_forecast(fetch_police_muni_counts(count_window), datetime.now(JST), horizon, history)
+    fc = st.session_state.cc_forecast
+    if fc is not None and not fc.empty:
+        pivot = fc.pivot(index="time", columns="municipality", values="cc")
+        pivot = pivot[[c for c in CITY_NAMES if c in pivot.columns]]
+        pivot.index = pivot.index.tz_localize(None)
+        st.line_chart(pivot, height=320)
+        peak = fc.loc[fc.groupby("municipality", sort=False)["cc"].idxmax(), ["municipality","time","cc","score","level"]]
+        peak = peak.sort_values("cc", ascending=False).rename(columns={
+            "municipality":"市町","time":"ピーク時刻","cc":"最大CC","score":"基礎リスク","level":"レベル"})
+        peak["ピーク時刻"] = peak["ピーク時刻"].dt.strftime("%m/%d %H:00")
+        st.dataframe(peak, hide_index=True, use_container_width=True)
+
+
+@fragment
+def poi_panel():
+    # 近傍POI（下段共通）
+    st.markdown("<div class='card'>**近傍POI（Overpass）**</div>", unsafe_allow_html=True)
+    pr = st.slider("探索半径[m]", 400, 3000, 1200, 100)
+    colp1, colp2 = st.columns([1,3])
+    with colp1: poi_btn = st.button("取得", use_container_width=True)
+    with colp2: st.caption("駅・停留所・駐輪場・コンビニ・駐車場・公園・ATM・夜間娯楽")
+    ps = get_poi_store().stats()
+    st.caption(f"POIタイル: {ps['tiles']}枚・{ps['pois']}件（うち抽出 {ps['extract_tiles']}枚）/ Overpass {ps['fetches']}回・キャッシュのみ {ps['hits']}回"
+               + ("・メモリのみ" if ps["path"] == ":memory:" else ""))
+    if get_poi_store().extract_error: st.caption(f"抽出の読込失敗: {get_poi_store().extract_error}")
+    if poi_btn:
+        with st.spinner("POI取得中…"):
+            st.session_state.pois = fetch_pois_overpass(st.session_state.sel_lat, st.session_state.sel_lon, pr)
+        st.success(f"取得: {len(st.session_state.pois)} 件")
+
+
+def cache_stats() -> Dict[str, dict]:
+    # プロセス共通のキャッシュ/取得器の累計（起動からの回数）
+    return {"天気": get_weather_cache().stats(), "気象予報": FORECAST_CACHE.stats(), "結果地図": get_map_cache().stats(),
+            "市町ジオコード": get_geocode_index().store.stats(), "住所ジオコード": get_address_store().stats(),
+            "POIタイル": get_poi_store().stats(), "県警速報": get_police_feed().stats()}
+
+
+def render_perf_panel(box, rec: Optional[dict]):
+    # 今回の再実行の区間別時間・回数とキャッシュ統計（計測オフの run では何もしない）
+    if rec is None: return
+    with box, st.expander(f"パフォーマンス（今回 {rec['total_ms']:.0f} ms）", expanded=True):
+        rows = [{"区間": "　" * a["depth"] + a["name"], "回数": a["count"], "合計ms": round(a["total_ms"], 1),
+                 "最大ms": round(a["max_ms"], 1)} for a in perf.summarize(rec)]
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+        if rec["counters"]: st.caption(" / ".join(f"{k}: {v}" for k, v in sorted(rec["counters"].items())))
+        cs = pd.DataFrame.from_dict(cache_stats(), orient="index")
+        cs = cs[[c for c in ("size", "hits", "stale_hits", "negative_hits", "misses", "evictions", "fetches", "polls", "not_modified", "errors") if c in cs.columns]]
+        st.dataframe(cs, use_container_width=True)
+        hs = http_stats()   # ホスト別のブレーカ（open = 一時停止中で通信せずに失敗）
+        if hs: st.caption("外部接続: " + " / ".join(f"{h} {b['state']}（連続失敗 {b['failures']}・停止 {b['opens']}回・即失敗 {b['rejected']}件）"
+                                                 for h, b in sorted(hs.items())))
+        if perf.TRACER.sink_path: st.caption(f"JSONL 出力: {perf.TRACER.sink_path}")
+
+
 def main():
     st.set_page_config(APP_TITLE, page_icon="🧭", layout="wide")
+    load_api_keys()
+    perf.TRACER.begin_run("main", enabled=st.session_state.get("perf_on", perf.TRACER.enabled))
     st.markdown(DRAMA_CSS, unsafe_allow_html=True)
 
     st.markdown(f"<h1 style='margin:0 0 8px 0;'>{APP_TITLE}</h1>", unsafe_allow_html=True)
@@ -695,6 +937,7 @@ def main():
     if "last_snap" not in st.session_state: st.session_state.last_snap = None
     if "pois" not in st.session_state: st.session_state.pois = []
     if "user_geo_df" not in st.session_state: st.session_state.user_geo_df = None
+    if "cc_forecast" not in st.session_state: st.session_state.cc_forecast = None
 
     # サイドバー
     with st.sidebar:
@@ -702,26 +945,53 @@ def main():
         st.session_state.sel_lat = st.number_input("選択緯度", value=float(st.session_state.sel_lat), format="%.6f")
         st.session_state.sel_lon = st.number_input("選択経度", value=float(st.session_state.sel_lon), format="%.6f")
         sibyl_on = st.toggle("SIBYL（犯罪係数）モード", value=True)
+        count_window = POLICE_COUNT_WINDOWS[st.radio("SIBYLの速報件数", list(POLICE_COUNT_WINDOWS))]
+        moon_check = st.toggle("月齢をmgpn.orgで照合（任意・通信あり）", value=False)
         st.divider()
         st.markdown("#### データ検出（2019）")
         files = sorted(set(sum([glob.glob(g) for g in DATA_GLOBS], [])))
         if files: [st.write("・", os.path.basename(fp), f"〔{os.path.dirname(fp) or '.'}〕") for fp in files]
         else: st.warning("データが見つかりません: " + ", ".join(DATA_GLOBS))
+        hex_on = st.toggle("2019集計レイヤ（ヘックス格子）", value=True)
+        hex_box = st.container()   # 手口の選択肢はデータ読込後に埋める
         st.divider()
         st.markdown("#### APIキー")
-        st.write(f"- WeatherAPI: {'✅' if WEATHERAPI_KEY else '—'}")
-        st.write(f"- OpenWeather: {'✅' if OPENWEATHER_KEY else '—'}")
+        st.write(f"- WeatherAPI: {'✅' if sibyl_core.WEATHERAPI_KEY else '—'}")
+        st.write(f"- OpenWeather: {'✅' if sibyl_core.OPENWEATHER_KEY else '—'}")
+        wc = get_weather_cache().stats()
+        st.caption(f"天気キャッシュ: {wc['size']}件 / hit {wc['hits']}・stale {wc['stale_hits']}・miss {wc['misses']}・evict {wc['evictions']}")
+        pa = get_police_archive().stats()
+        st.caption(f"速報アーカイブ: {pa['items']}件" + (f"（{pa['first_day']}〜{pa['last_day']}）" if pa["items"] else "")
+                   + ("・メモリのみ" if pa["path"] == ":memory:" else ""))
+        st.divider()
+        st.toggle("パフォーマンス計測（区間別の時間）", value=perf.TRACER.enabled, key="perf_on")
+        perf_box = st.container()   # 計測結果は最後に埋める
 
     # データ
     @st.cache_data(show_spinner=False)
-    def _load2019():
-        return load_all_crime_2019(DATA_GLOBS)
-    all_df = _load2019()
+    def _load2019(dataset_version: str):   # 版（ファイルのサイズ/mtime）が変われば読み直す
+        errors: Dict[str, str] = {}
+        df = load_all_crime_2019(DATA_GLOBS, errors=errors)
+        return df, errors, build_historical_profile(df)
+    with perf.span("data.load2019"):
+        data_version = crime_dataset_version(DATA_GLOBS)
+        all_df, load_errors, history = _load2019(data_version)
+    if load_errors:
+        with st.sidebar:
+            for fp, err in load_errors.items(): st.error(f"読込失敗: {os.path.basename(fp)}（{err}）")
+    # 集計レイヤの絞り込み（手口は読み込んだデータに現れるものを件数順に）
+    with perf.span("data.bins"): bins = get_incident_bins(data_version, all_df)
+    with hex_box:
+        hex_ctype = st.selectbox("集計の手口", [None] + bins.ctypes(), format_func=lambda c: c or "すべて")
+        hex_month = st.selectbox("集計の月", MONTH_OPTIONS_2019, format_func=lambda mo: f"{mo}月" if mo else "通年")
+        if hex_on and bins.cell_totals(hex_ctype, hex_month).empty:
+            st.info("この手口・月の2019集計はありません。" if not bins.empty else "2019集計の対象データがありません。")
 
     # 地図（選択）
     st.markdown("<div class='card'>**地図：クリックで任意地点を選択（ドラッグ可）**</div>", unsafe_allow_html=True)
-    fmap = render_map_selectable(st.session_state.sel_lat, st.session_state.sel_lon, st.session_state.last_snap)
-    out = call_st_folium_with_fallback(fmap, height=540, key="map_select", return_last_clicked=True)
+    with perf.span("map.select"):
+        fmap = render_map_selectable(st.session_state.sel_lat, st.session_state.sel_lon, st.session_state.last_snap)
+        out = call_st_folium_with_fallback(fmap, height=540, key="map_select", return_last_clicked=True)
     if out and isinstance(out, dict) and out.get("last_clicked"):
         lat = out["last_clicked"].get("lat"); lon = out["last_clicked"].get("lng")
         if lat is not None and lon is not None:
@@ -740,12 +1010,23 @@ def main():
         st.session_state.sel_lat = INIT_LAT; st.session_state.sel_lon = INIT_LON
         st.session_state.last_snap = None; st.rerun()
 
+    # 県警速報（周辺検索・レイヤ・右リストで共有）
+    with st.spinner("県警速報を取得しています…"), perf.span("police.fetch"):
+        police_items = fetch_police_items()
+    # 選択地点の周辺（格子インデックス。クリックごとに再計算しても数ms）
+    with perf.span("nearby"):
+        nearby = nearby_summary(st.session_state.sel_lat, st.session_state.sel_lon, all_df, data_version, police_items)
+
     if analyze:
-        with st.spinner("解析中（気象・月齢・2019傾向…）"):
+        with st.spinner("解析中（気象・月齢・2019傾向…）"), perf.span("analyze"):
             now_dt = datetime.now(JST)
             lat, lon = st.session_state.sel_lat, st.session_state.sel_lon
-            weather = get_weather(lat, lon); moon = get_mgpn_moon(lat, lon, now_dt)
-            snap = compute_risk_score(weather, now_dt, all_df, moon)
+            with perf.span("analyze.weather"): weather = get_weather(lat, lon)
+            with perf.span("analyze.moon"): moon = get_moon_info(lat, lon, now_dt)
+            snap = compute_risk_score(weather, now_dt, history, moon, nearby=nearby)
+            if moon_check:
+                with perf.span("analyze.mgpn"): mg = get_mgpn_moon(lat, lon, now_dt.replace(second=0, microsecond=0))
+                snap["moon_check"] = mg.get("moon_age") if mg else None
             st.session_state.last_snap = snap
 
     snap = st.session_state.last_snap
@@ -773,30 +1054,34 @@ def main():
             if snap:
                 st.markdown("<div class='card'>**内部理由（気象/時間帯/週末/月齢/2019）**</div>", unsafe_allow_html=True)
                 for r in snap["reasons"]: st.write("・", r)
+                if snap.get("moon_age") is not None:
+                    mg = snap.get("moon_check")
+                    st.caption(f"月齢 {snap['moon_age']:.1f}（{snap.get('moon_phase') or '—'}・ローカル計算）"
+                               + (f" / mgpn: {mg:.1f}" if mg is not None else ""))
+
+            st.markdown(f"<div class='card'>**周辺の事案（半径{NEARBY_RADIUS_M // 1000}km）**</div>", unsafe_allow_html=True)
+            ratio = nearby["density_ratio"]
+            if ratio is not None: st.caption(f"2019件数の周辺密度: 県平均の {ratio:.2f} 倍")
+            if nearby["munis"]: st.caption("近い市町（2019件数）: " + " / ".join(f"{mu} {d/1000:.1f}km・{n}件" for mu, d, n in nearby["munis"]))
+            for it, muni, d in nearby["police"]:
+                st.markdown(f"・{it.get('category') or 'その他'}：{it.get('heading') or ''} <span class='mute'>({muni}・約{d/1000:.1f}km)</span>",
+                            unsafe_allow_html=True)
+            if nearby["police_total"] > len(nearby["police"]): st.caption(f"ほか {nearby['police_total'] - len(nearby['police'])}件")
+            if not nearby["police"]: st.caption("半径内の県警速報はありません（速報は市町の代表点付近に近似配置）。")
 
         with colL2:
             st.markdown("<div class='card'>**SIBYL：犯罪係数レイヤ（市町単位）**</div>", unsafe_allow_html=True)
-            fmap2 = folium.Map(location=[EHIME_CENTER_LAT, EHIME_CENTER_LON], zoom_start=9, tiles="cartodbdark_matter")
-            _add_common_map_ui(fmap2)
-
-            ranks = None
-            # 県警速報（レイヤ＆右リストで共有）
-            with st.spinner("県警速報を取得しています…"):
-                police_items = fetch_police_items()
-
+            muni_counts = None
             if sibyl_on:
-                with st.spinner("県警速報の市町出現回数を推定…"):
-                    muni_counts = fetch_police_muni_counts()
-                now_dt = datetime.now(JST)
-                safe_all_df = all_df if (all_df is not None) else pd.DataFrame({"date": pd.to_datetime([])})
-                ranks = add_sybil_cc_layer(fmap2, muni_counts, now_dt, safe_all_df)
-
-            # 2019概位置
-            add_2019_layer(fmap2, all_df)
-            # 速報レイヤ（ON）
-            add_police_items_layer(fmap2, police_items)
+                with st.spinner("県警速報の市町出現回数を推定…"), perf.span("police.muni_counts"):
+                    muni_counts = fetch_police_muni_counts(count_window)
 
-            call_st_folium_with_fallback(fmap2, height=540, key="map_result", return_last_clicked=False)
+            # SIBYL / 2019概位置 / 2019集計 / 速報レイヤ（入力が同じなら構築済みの地図を再利用）
+            with perf.span("map.result"):
+                map_html, ranks = get_result_map_html(all_df, history, data_version, police_items, muni_counts, sibyl_base_time(),
+                                                      (hex_ctype, hex_month) if hex_on else None)
+            # クリック結果を使わない地図なので st_folium は通さない（パン/ズームで再実行されない）
+            show_map_html(map_html, height=540)
 
             if ranks:
                 st.markdown("<div class='card'>**市町別 犯罪係数（上位）**</div>", unsafe_allow_html=True)
@@ -806,82 +1091,18 @@ def main():
                     st.markdown(f"{i}. **{muni}**  —  **{cc}** <span class='rank-pill'>{lvl}</span>  <span class='mute'>(速報:{rc})</span>", unsafe_allow_html=True)
 
     with right:
-        # 速報リスト（スクロールボックス）
-        st.markdown("<div class='card'>**県警速報：事故事案/犯罪事案（直近ページ）**</div>", unsafe_allow_html=True)
-        # 警察アイテムは左側でフェッチ済みなので共有
-        police_items = 'police_items' in locals() and police_items or fetch_police_items()
-        # フィルタUI
-        cats = sorted({it.get("category","その他") for it in police_items})
-        sel = st.multiselect("表示カテゴリ", options=cats, default=cats)
-        q = st.text_input("キーワード（見出し/本文）")
-
-        # フィルタ適用
-        view = []
-        for it in police_items:
-            if it.get("category","その他") not in sel: continue
-            if q:
-                blob = (it.get("heading","")+" "+it.get("body",""))
-                if q not in blob: continue
-            view.append(it)
-
-        # スクロール表示
-        html = ["<div class='scrollbox'>"]
-        color_map = {"交通事故":"#ffa64d","火災":"#ff4d4d","死亡事案":"#c37dff","窃盗":"#66a3ff","詐欺":"#33d1a5","事件":"#ffd94d","その他":"#9aa7b1"}
-        for it in view:
-            h = it.get("heading") or ""
-            d = it.get("date") or "日時不明"; muni = it.get("municipality") or "市町村不明"
-            cat = it.get("category") or "その他"; s = it.get("summary") or ""
-            color = color_map.get(cat, "#9aa7b1")
-            html.append(
-                f"<div class='feed-item'>"
-                f"<b style='color:{color}'>{cat}</b>  <span class='meta'>{d} / {muni}</span><br>"
-                f"<div>{h}</div>"
-                f"<div class='meta'>{s}</div>"
-                f"<a href='{EHIME_POLICE_URL}' target='_blank'>出典: 愛媛県警 事件事故速報</a>"
-                f"</div>"
-            )
-        if not view:
-            html.append("<div class='feed-item'>該当する項目がありません。</div>")
-        html.append("</div>")
-        st.markdown("\n".join(html), unsafe_allow_html=True)
-
-        # CSVアップロード（簡略）
-        st.markdown("<div class='card'>**CSVアップロード（住所→座標）**</div>", unsafe_allow_html=True)
-        up = st.file_uploader("住所CSVを選択（UTF-8/CP932等自動判別）", type=["csv"])
-        colu1, colu2, colu3 = st.columns([2,2,1])
-        with colu1: addr_col = st.text_input("住所列名（必須）", value="住所")
-        with colu2: muni_col = st.text_input("市町村列名（任意）", value="市町村")
-        with colu3: geo_run = st.button("ジオコーディング実行", use_container_width=True)
-
-        if up is not None and geo_run:
-            try:
-                raw = up.read()
-                enc_guess = (chardet.detect(raw).get("encoding") or "utf-8").lower()
-                df_tmp = pd.read_csv(io.BytesIO(raw), encoding=enc_guess, engine="python")
-                with st.spinner("Nominatimで住所を座標化中（礼節1秒/件）…"):
-                    udf = geocode_address_rows(df_tmp, addr_col, muni_col if muni_col in df_tmp.columns else None)
-                    st.session_state.user_geo_df = udf
-                ok = udf[["lat","lon"]].notna().all(axis=1).sum()
-                st.success(f"ジオコーディング完了：{ok}/{len(udf)} 行で座標取得")
-            except Exception as e:
-                st.error(f"CSV読込/ジオコーディングに失敗: {e}")
+        with perf.span("panel.police_feed"): police_feed_panel(police_items)
+        with perf.span("panel.address_upload"): address_upload_panel()
 
-    # 近傍POI（下段共通）
-    st.markdown("<div class='card'>**近傍POI（Overpass）**</div>", unsafe_allow_html=True)
-    pr = st.slider("探索半径[m]", 400, 3000, 1200, 100)
-    colp1, colp2 = st.columns([1,3])
-    with colp1: poi_btn = st.button("取得", use_container_width=True)
-    with colp2: st.caption("駅・停留所・駐輪場・コンビニ・駐車場・公園・ATM・夜間娯楽")
-    if poi_btn:
-        with st.spinner("POI取得中…"):
-            st.session_state.pois = fetch_pois_overpass(st.session_state.sel_lat, st.session_state.sel_lon, pr)
-        st.success(f"取得: {len(st.session_state.pois)} 件")
+    with perf.span("panel.forecast"): forecast_panel(count_window, history)
+    with perf.span("panel.poi"): poi_panel()
 
     st.markdown("---")
     st.caption(
         "※ 県警速報の記載は“最近の出来事”の**近似指標**。個別事件の真偽・詳細は必ず出典を参照。\n"
         " CCは注意喚起のための相対値であり、断定・差別・排除に用いるものではありません。"
     )
+    render_perf_panel(perf_box, perf.TRACER.end_run())
 
 
 if __name__ == "__main__":
@@ -889,3 +1110,5 @@ if __name__ == "__main__":
         main()
     except Exception as e:
         st.error("致命的エラーが発生しました：\n" + "".join(traceback.format_exception(e)))
+    finally:
+        perf.TRACER.end_run(record=False)   # 例外・st.rerun で途中終了した run を閉じる（正常終了なら何もしない）
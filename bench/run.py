@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# アプリのホットパスのベンチマーク（合成データ＋ローカルスタブ、外部通信なし）
+#  ・段階ごとに 経過時間（repeat 回の最小）/ ピークメモリ（tracemalloc）/ 生成 HTML サイズ を記録
+#  ・保存済みの基準（bench/baseline.json）と比べ、許容幅を超えた悪化を REGRESSION として表示（終了コード 1）
+#  ・基準はマシン依存。最適化の前後は同じマシンで --update-baseline → 変更 → 比較 の順で使う
+#  ・各モジュールの読み込み時間（新しいプロセスでの import）は基準との比較に加えて目安の上限を超えたら警告（失敗にはしない）
+#    読み込んではいけないモジュールの確認は tests/test_imports.py
+#  ・HTTP クライアントの再試行/ブレーカ/Retry-After の動作は tests/test_http_client.py（ここでは時間だけ）
+#  python bench/run.py [--profile quick|default|full] [--stages a,b] [--out result.json]
+#                      [--baseline bench/baseline.json] [--update-baseline] [--tolerance 0.25] [--no-mem]
+# ============================================================
+
+import argparse, gc, json, os, platform, subprocess, sys, tempfile, time, tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT); sys.path.insert(0, HERE)
+
+from stubs import StubServer
+import synth
+
+JST = timezone(timedelta(hours=9))
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+
+# プロファイル別のサイズ（CSV 行数 / 速報件数 / 住所件数 など）
+PROFILES = {
+    "quick":   {"csv": [1_000, 10_000], "page": [10, 100], "calls": [1_000], "batch": [10_000], "addr": [10], "radius": [1200], "http": [50]},
+    "default": {"csv": [1_000, 10_000, 100_000], "page": [10, 100, 1_000], "calls": [1_000, 10_000],
+                "batch": [10_000, 100_000], "addr": [10, 100], "radius": [1200, 3000], "http": [200]},
+    "full":    {"csv": [1_000, 10_000, 100_000, 1_000_000], "page": [10, 100, 1_000, 10_000], "calls": [1_000, 10_000],
+                "batch": [10_000, 100_000, 1_000_000], "addr": [10, 100, 1_000], "radius": [1200, 3000], "http": [200]},
+}
+# 悪化とみなさない絶対差（小さい計測のゆらぎ対策）
+MIN_WALL_DIFF_S = 0.015   # スタブ経由の HTTP 1往復で 10ms 程度は揺れる
+MIN_MEM_DIFF_MB = 1.0
+MIN_HTML_DIFF_KB = 1.0
+
+# 読み込み時間の目安（秒。このマシンの実測の約2倍）。マシンの速さで変わるので超過は警告のみ
+IMPORT_BUDGETS = {"police_feed": 0.10, "crime_data": 1.00, "sibyl_core": 1.00, "sibyl_batch": 1.10, "app": 1.50}
+_IMPORT_PROBE = "import json, time; t = time.perf_counter(); import {mod}; print(json.dumps({{'s': time.perf_counter() - t}}))"
+
+
+@dataclass
+class Case:
+    stage: str
+    size: int
+    run: Callable[[Any], Any]             # 戻り値が str なら HTML とみなしてサイズを記録
+    setup: Optional[Callable[[], Any]] = None   # 計測ごとに呼ぶ（キャッシュを冷やす等）。戻り値を run に渡す
+
+    @property
+    def key(self) -> str:
+        return f"{self.stage}@{self.size}"
+
+
+def measure(c: Case, repeat: int = 3, mem: bool = True) -> Dict:
+    walls, out = [], None
+    for i in range(max(1, repeat)):
+        arg = c.setup() if c.setup else None
+        gc.collect(); t0 = time.perf_counter()
+        out = c.run(arg)
+        walls.append(time.perf_counter() - t0)
+        if walls[-1] > 2.0: break   # 重い計測は1回で十分
+    res = {"wall_s": round(min(walls), 6), "runs": len(walls)}
+    if mem:
+        arg = c.setup() if c.setup else None
+        gc.collect(); tracemalloc.start()
+        try: c.run(arg); res["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 3)
+        finally: tracemalloc.stop()
+    if isinstance(out, str): res["html_kb"] = round(len(out.encode("utf-8")) / 1024, 2)
+    return res
+
+
+# ---------------------------
+# 段階の定義
+# ---------------------------
+
+def build_cases(app, stub: StubServer, sizes: Dict[str, List[int]], work: str) -> List[Case]:
+    import folium
+    import sibyl_core as core, police_feed, http_client
+    cases: List[Case] = []
+    now = datetime(2025, 7, 4, 21, 0, tzinfo=JST)
+
+    def new_map():
+        return folium.Map(location=[app.EHIME_CENTER_LAT, app.EHIME_CENTER_LON], zoom_start=9)
+
+    # 読込（CSV → 正規化）。初回（スナップショットなし）と2回目（スナップショット）を別に測る
+    for n in sizes["csv"]:
+        d = os.path.join(work, f"csv{n}")
+        synth.write_crime_csvs(d, n)
+        glob_ = [os.path.join(d, "ehime_2019*.csv")]
+
+        def _cold(d=d):
+            snap = os.path.join(d, ".esp_cache")
+            if os.path.isdir(snap):
+                for f in os.listdir(snap): os.remove(os.path.join(snap, f))
+        cases.append(Case("load_all_crime_2019", n, lambda _, g=glob_: app.load_all_crime_2019(g, workers=1), _cold))
+        cases.append(Case("load_all_crime_2019_snapshot", n, lambda _, g=glob_: app.load_all_crime_2019(g)))
+
+    # 速報ページの解析（全件が新規）
+    for n in sizes["page"]:
+        html = synth.police_page(n)
+        cases.append(Case("parse_police_items", n, lambda _, h=html: police_feed.parse_police_items(h)))
+
+    # 取得（スタブ）→ 差分解析 → アーカイブ蓄積 → 市町別件数
+    for n in sizes["page"]:
+        def _fresh(n=n):
+            stub.police_html = synth.police_page(n)
+            app.POLICE_ARCHIVE_PATH = os.path.join(work, f"archive{n}-{time.monotonic_ns()}.sqlite3")
+            app.get_police_archive.clear(); app.get_police_feed.clear()
+        cases.append(Case("fetch_police_muni_counts", n, lambda _: app.fetch_police_muni_counts(7), _fresh))
+
+    # リスクスコア（1地点ずつ N 回 / 一括）
+    df_hist = synth.crime_rows(10_000)
+    history = app.build_historical_profile(df_hist)
+    weather = {"temp_c": 28.0, "precip_mm": 0.0, "humidity": 82, "condition": "晴れ"}
+    moon = core.get_moon_info(33.84, 132.77, now)
+    for n in sizes["calls"]:
+        def _scalar(_, n=n):
+            for i in range(n): core.compute_risk_score(weather, now + timedelta(hours=i), history, moon)
+        cases.append(Case("compute_risk_score", n, _scalar))
+    for n in sizes["batch"]:
+        times = [now + timedelta(hours=i) for i in range(n)]
+        cases.append(Case("compute_risk_scores_batch", n,
+                          lambda _, t=times, n=n: core.compute_risk_scores_batch(28.0, 0.0, 82, t, 14.0, history)))
+
+    # 市町 × 時刻の CC 表（sibyl_batch の計算部分。気象は既定値、件数は時刻ごとの配列）
+    for n in sizes["batch"]:
+        hours = max(1, n // len(core.CITY_NAMES))
+        times = pd.date_range(now, periods=hours, freq="h")
+        per_time = {m: (np.arange(hours) + i) % 6 for i, m in enumerate(core.CITY_NAMES)}
+        cases.append(Case("compute_cc_table", n, lambda _, t=times, c=per_time: core.compute_cc_table(t, c, history)))
+
+    # SIBYL レイヤ（気象はスタブ。キャッシュを空にして全市町を取得する場合）
+    counts = {m: (i * 7) % 11 for i, m in enumerate(core.CITY_NAMES)}
+
+    def _sibyl(_):
+        m = new_map(); app.add_sybil_cc_layer(m, counts, now, history)
+        return m.get_root().render()
+    cases.append(Case("add_sybil_cc_layer", len(counts), _sibyl, lambda: core.get_weather_cache().clear()))
+
+    # 2019 レイヤ / ヘックス集計（読込済みの行から）
+    for n in sizes["csv"]:
+        rows = synth.crime_rows(n)
+
+        def _layer(_, rows=rows):
+            m = new_map(); app.add_2019_layer(m, rows)
+            return m.get_root().render()
+
+        def _hex(ver, rows=rows):
+            m = new_map(); app.add_incident_hex_layer(m, app.get_incident_bins(ver, rows))
+            return m.get_root().render()
+        cases.append(Case("add_2019_layer", n, _layer))
+        cases.append(Case("add_incident_hex_layer", n, _hex, lambda n=n: f"bench-{n}-{time.monotonic_ns()}"))
+
+    # 住所ジオコーディング（Nominatim スタブ。重複込みで 2 倍の行、キャッシュは毎回空）
+    for n in sizes["addr"]:
+        df = synth.address_frame(2 * n, n)
+
+        def _fresh_store(n=n):
+            app.ADDRESS_GEOCODE_CACHE_PATH = os.path.join(work, f"addr{n}-{time.monotonic_ns()}.json")
+            app.get_address_store.clear()
+        cases.append(Case("geocode_address_rows", n, lambda _, df=df: app.geocode_address_rows(df, "住所", "市町村"), _fresh_store))
+
+    # POI（Overpass スタブ）。タイル未取得 → 取得済み
+    for r in sizes["radius"]:
+        def _fresh_poi(r=r):
+            app.POI_CACHE_PATH = os.path.join(work, f"poi{r}-{time.monotonic_ns()}.sqlite3")
+            app.get_poi_store.clear()
+        cases.append(Case("fetch_pois_cold", r, lambda _, r=r: app.fetch_pois_overpass(33.84, 132.77, r), _fresh_poi))
+        cases.append(Case("fetch_pois_warm", r, lambda _, r=r: app.fetch_pois_overpass(33.8402, 132.7703, r)))
+
+    # HTTP クライアント: 共有プールでの連続取得 / 障害中のホスト（503）への連続要求（ブレーカが開いてからは通信なし）
+    stub.fail["/down"] = 503
+    for n in sizes["http"]:
+        def _keepalive(_, n=n):
+            for i in range(n): http_client.http_get("weatherapi", f"{stub.base}/weatherapi/current.json", params={"q": f"33.{i},132.7"})
+        cases.append(Case("http_keepalive", n, _keepalive))
+
+        def _down(cl, n=n):
+            for _ in range(n):
+                try: cl.get("weatherapi", f"{stub.base}/down")
+                except http_client.CircuitOpenError: pass
+        cases.append(Case("http_circuit_open", n, _down, lambda: http_client.HttpClient(backoff_base_s=0.01)))
+    return cases
+
+
+# ---------------------------
+# 読み込み時間
+# ---------------------------
+
+def measure_import(mod: str, repeat: int = 3) -> Dict:
+    # 新しいインタプリタで import した時間（repeat 回の最小）
+    best = None
+    for _ in range(max(1, repeat)):
+        p = subprocess.run([sys.executable, "-W", "ignore", "-c", _IMPORT_PROBE.format(mod=mod)],
+                           cwd=ROOT, capture_output=True, text=True, timeout=120)
+        if p.returncode != 0: raise RuntimeError(f"import {mod} に失敗: {p.stderr.strip()[-300:]}")
+        out = json.loads(p.stdout.strip().splitlines()[-1])
+        best = out["s"] if best is None else min(best, out["s"])
+    return {"wall_s": round(best, 6), "runs": max(1, repeat)}
+
+# ---------------------------
+# 基準との比較
+# ---------------------------
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    # 悪化した項目の説明。基準に無い項目は比較しない
+    bad = []
+    for key, cur in results.items():
+        base = baseline.get(key)
+        if not base: continue
+        for field, floor in (("wall_s", MIN_WALL_DIFF_S), ("peak_mb", MIN_MEM_DIFF_MB), ("html_kb", MIN_HTML_DIFF_KB)):
+            a, b = cur.get(field), base.get(field)
+            if a is None or b is None: continue
+            if a > b * (1 + tolerance) and a - b > floor:
+                bad.append(f"{key} {field}: {b} → {a} (×{a / b if b else float('inf'):.2f})")
+    return bad
+
+
+def _fmt(v, unit: str) -> str:
+    return "—" if v is None else f"{v:.4g}{unit}"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="hot-path benchmarks with synthetic data and local stubs")
+    ap.add_argument("--profile", choices=list(PROFILES), default="default")
+    ap.add_argument("--stages", default="", help="カンマ区切り（省略時はすべて。import で読み込み時間のみ）")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--no-mem", action="store_true", help="tracemalloc の計測を省く")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="スタブの往復遅延")
+    ap.add_argument("--out", default="", help="結果の JSON")
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args(argv)
+
+    stub = StubServer(latency_ms=args.latency_ms).start()
+    work = tempfile.mkdtemp(prefix="esp-bench-")
+    os.environ.update(stub.env())
+    os.environ.update({"ESP_POLICE_ARCHIVE_PATH": os.path.join(work, "archive.sqlite3"),
+                       "ESP_POI_CACHE_PATH": os.path.join(work, "poi.sqlite3"),
+                       "ESP_POI_EXTRACT_PATH": os.path.join(work, "none.geojson"),
+                       "ESP_WEATHERAPI_KEY": "bench"})   # 気象はスタブから取得
+    import app   # 通信先の環境変数を設定してから読み込む
+    app.NOMINATIM_RATE_PER_S = 1e9               # スタブ相手なので礼節待ちなし
+    app.MUNI_GEOCODE_CACHE_PATH = os.path.join(work, "muni.json")
+    app.ADDRESS_GEOCODE_CACHE_PATH = os.path.join(work, "addr.json")
+    app.get_nominatim_bucket.clear()
+
+    only = {s for s in args.stages.split(",") if s}
+    cases = [c for c in build_cases(app, stub, PROFILES[args.profile], work) if not only or c.stage in only]
+    results: Dict[str, Dict] = {}
+    print(f"{'stage':34s} {'size':>9s} {'wall':>10s} {'peak':>10s} {'html':>10s}")
+    for c in cases:
+        r = measure(c, repeat=args.repeat, mem=not args.no_mem)
+        results[c.key] = r
+        print(f"{c.stage:34s} {c.size:>9d} {_fmt(r['wall_s'], 's'):>10s} {_fmt(r.get('peak_mb'), 'MB'):>10s} {_fmt(r.get('html_kb'), 'KB'):>10s}",
+              flush=True)
+    stub.stop()
+    over_budget = []
+    for mod, budget in IMPORT_BUDGETS.items():
+        stage = f"import_{mod}"
+        if only and stage not in only and "import" not in only: continue
+        r = measure_import(mod, args.repeat)
+        results[f"{stage}@0"] = r
+        if r["wall_s"] > budget: over_budget.append(f"import {mod}: {r['wall_s']:.3f}s > 目安 {budget:.2f}s")
+        print(f"{stage:34s} {0:>9d} {_fmt(r['wall_s'], 's'):>10s} {'—':>10s} {'—':>10s}", flush=True)
+    for b in over_budget: print("SLOW (警告)", b)
+
+    meta = {"profile": args.profile, "python": platform.python_version(), "machine": platform.machine(),
+            "created": datetime.now(JST).isoformat(timespec="seconds"), "stub_calls": dict(stub.calls)}
+    doc = {"meta": meta, "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: json.dump(doc, f, ensure_ascii=False, indent=1)
+    if args.update_baseline:
+        base = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f: base = json.load(f).get("results", {})
+        base.update(results)   # 一部の段階だけ測った場合も他の基準は残す
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": dict(sorted(base.items()))}, f, ensure_ascii=False, indent=1)
+        print(f"基準を更新: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("基準なし（--update-baseline で作成）"); return 0
+    with open(args.baseline, encoding="utf-8") as f: baseline = json.load(f).get("results", {})
+    bad = compare(results, baseline, args.tolerance)
+    for b in bad: print("REGRESSION", b)
+    print(f"基準との比較: {len(results)}項目中 悪化 {len(bad)}（許容 +{args.tolerance:.0%}）/ 読み込み目安超過（警告） {len(over_budget)}")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
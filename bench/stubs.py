@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# 外部サービスのローカル代替（ベンチマーク用）
+#  ・1つの HTTP サーバで weatherapi / openweather / mgpn / nominatim / overpass / 県警速報 を返す
+#  ・応答は要求内容から決定的に生成。latency_ms で往復遅延を模擬
+#  ・env() の環境変数を app の import 前に設定すると、アプリの通信先がすべてこのサーバになる
+#  ・calls にパス別の要求回数を記録（キャッシュの効き具合の確認用）
+#  ・fail[path] = status でそのパスを障害中にする（再試行・サーキットブレーカの確認用）
+#    [status, …] なら要求ごとに先頭から1つずつ返し、尽きたら通常の応答。fail_headers[path] は障害応答に付けるヘッダ
+# ============================================================
+
+import hashlib, json, math, re, threading, time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+def _unit(*parts) -> float:
+    # 引数から決まる [0, 1) の値
+    return int.from_bytes(hashlib.blake2b(repr(parts).encode(), digest_size=8).digest(), "little") / 2.0**64
+
+
+class StubServer:
+    def __init__(self, latency_ms: float = 0.0, poi_per_km2: float = 40.0):
+        self.latency_s = latency_ms / 1000.0
+        self.poi_per_km2 = poi_per_km2
+        self.police_html = "<html><body></body></html>"
+        self.calls: Counter = Counter()
+        self.fail: Dict[str, object] = {}
+        self.fail_headers: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True   # ヘッダと本文を別々に書くので、keep-alive の接続で遅延 ACK（約40ms）待ちにならないように
+
+            def log_message(self, *a): pass
+
+            def _send(self, code: int, body: bytes = b"", ctype: str = "application/json", headers: Optional[Dict] = None):
+                self.send_response(code)
+                self.send_header("Content-Type", ctype); self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items(): self.send_header(k, v)
+                self.end_headers()
+                if body: self.wfile.write(body)
+
+            def do_GET(self):
+                u = urlparse(self.path); q = {k: v[0] for k, v in parse_qs(u.query).items()}
+                stub._hit(u.path)
+                code = stub._failure(u.path)
+                if code: return self._send(code, headers=stub.fail_headers.get(u.path))
+                if u.path == "/police":
+                    body = stub.police_html.encode("cp932", errors="ignore")
+                    etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+                    if self.headers.get("If-None-Match") == etag: return self._send(304, headers={"ETag": etag})
+                    return self._send(200, body, "text/html; charset=Shift_JIS", {"ETag": etag})
+                route = {"/weatherapi/current.json": stub.weatherapi_current, "/weatherapi/forecast.json": stub.weatherapi_forecast,
+                         "/openweather/weather": stub.openweather_current, "/openweather/forecast": stub.openweather_forecast,
+                         "/mgpn/v2position.cgi": stub.mgpn, "/mgpn/v3position.cgi": stub.mgpn,
+                         "/nominatim/search": stub.nominatim}.get(u.path)
+                if route is None: return self._send(404)
+                self._send(200, json.dumps(route(q), ensure_ascii=False).encode("utf-8"))
+
+            def do_POST(self):
+                u = urlparse(self.path)
+                stub._hit(u.path)
+                data = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8", errors="ignore")
+                code = stub._failure(u.path)
+                if code: return self._send(code, headers=stub.fail_headers.get(u.path))
+                if u.path != "/overpass": return self._send(404)
+                self._send(200, json.dumps(stub.overpass(data)).encode("utf-8"))
+
+        class _Server(ThreadingHTTPServer):
+            request_queue_size = 128   # 既定の 5 では一斉接続（SIBYL の 18 市町など）で SYN が落ち、1秒の再送待ちが混ざる
+
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def _hit(self, path: str):
+        with self._lock: self.calls[path] += 1
+        if self.latency_s: time.sleep(self.latency_s)
+
+    def _failure(self, path: str) -> Optional[int]:
+        with self._lock:
+            f = self.fail.get(path)
+            if isinstance(f, list): return f.pop(0) if f else None
+            return f
+
+    def start(self) -> "StubServer":
+        self._thread.start(); return self
+
+    def stop(self):
+        self._server.shutdown(); self._server.server_close()
+
+    def env(self) -> Dict[str, str]:
+        return {"ESP_WEATHERAPI_URL": f"{self.base}/weatherapi", "ESP_OPENWEATHER_URL": f"{self.base}/openweather",
+                "ESP_MGPN_URL": f"{self.base}/mgpn", "ESP_NOMINATIM_URL": f"{self.base}/nominatim/search",
+                "ESP_OVERPASS_URL": f"{self.base}/overpass", "ESP_POLICE_FEED_URL": f"{self.base}/police"}
+
+    # --- 応答 ---
+    @staticmethod
+    def _latlon(q: Dict, key: str = "q") -> tuple:
+        if key in q: lat, lon = (float(x) for x in q[key].split(","))
+        else: lat, lon = float(q.get("lat", 33.8)), float(q.get("lon", 132.8))
+        return lat, lon
+
+    def weatherapi_current(self, q: Dict) -> Dict:
+        lat, lon = self._latlon(q)
+        u = _unit("w", round(lat, 2), round(lon, 2))
+        return {"current": {"temp_c": round(18 + 14 * u, 1), "humidity": int(50 + 45 * u), "condition": {"text": "晴れ"},
+                            "precip_mm": round(max(0.0, 12 * u - 8), 1), "wind_kph": round(20 * u, 1)}}
+
+    def weatherapi_forecast(self, q: Dict) -> Dict:
+        lat, lon = self._latlon(q); days = int(q.get("days", 2))
+        t0 = int(time.time() // 86400) * 86400
+        out = []
+        for d in range(days):
+            hours = [{"time_epoch": t0 + (d * 24 + h) * 3600, "temp_c": round(20 + 8 * math.sin((h - 9) / 24 * 2 * math.pi), 1),
+                      "humidity": 60 + (h % 7) * 4, "precip_mm": 0.0 if _unit(lat, lon, d, h) < 0.85 else 2.0} for h in range(24)]
+            out.append({"hour": hours})
+        return {"forecast": {"forecastday": out}}
+
+    def openweather_current(self, q: Dict) -> Dict:
+        w = self.weatherapi_current(q)["current"]
+        return {"main": {"temp": w["temp_c"], "humidity": w["humidity"]}, "weather": [{"description": "晴れ"}], "wind": {"speed": 3.0}}
+
+    def openweather_forecast(self, q: Dict) -> Dict:
+        t0 = int(time.time() // 10800) * 10800
+        return {"list": [{"dt": t0 + i * 10800, "main": {"temp": 22.0, "humidity": 70}} for i in range(40)]}
+
+    def mgpn(self, q: Dict) -> list:
+        return [{"moonage": 14.2, "altitude": 30.5, "azimuth": 120.0}]
+
+    def nominatim(self, q: Dict) -> list:
+        s = q.get("q", "")
+        if not s: return []
+        return [{"lat": f"{33.2 + 1.0 * _unit('lat', s):.6f}", "lon": f"{132.4 + 1.1 * _unit('lon', s):.6f}", "display_name": s}]
+
+    def overpass(self, query: str) -> Dict:
+        # 問い合わせ中の bbox（最初の1つ）に一様な擬似 POI を置く。同じ bbox なら同じ結果
+        m = re.search(r"\((-?[\d.]+),(-?[\d.]+),(-?[\d.]+),(-?[\d.]+)\)", query)
+        if not m: return {"elements": []}
+        s, w, n, e = (float(x) for x in m.groups())
+        tags = [{"amenity": "parking"}, {"amenity": "atm"}, {"railway": "station"}, {"leisure": "park"}, {"amenity": "pub"}]
+        # 格子点単位で生成（bbox を分割して問い合わせても同じ POI になる）
+        step = 0.005; k = max(1, round(self.poi_per_km2 * (step * 110.54) * (step * 111.32 * math.cos(math.radians(s)))))
+        els = []
+        for i in range(math.floor(s / step), math.ceil(n / step)):
+            for j in range(math.floor(w / step), math.ceil(e / step)):
+                for t in range(k):
+                    lat = (i + _unit(i, j, t, "a")) * step; lon = (j + _unit(i, j, t, "o")) * step
+                    if s <= lat < n and w <= lon < e:
+                        els.append({"type": "node", "id": (i * 100000 + j) * 100 + t, "lat": lat, "lon": lon,
+                                    "tags": dict(tags[(i + j + t) % len(tags)], name=f"POI{i}-{j}-{t}")})
+        return {"elements": els}
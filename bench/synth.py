@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# ベンチマーク用の合成データ
+#  ・2019年オープンデータ形式（県警公開の列構成・cp932）の手口別CSV
+#  ・県警速報ページ（■見出し（月日　署）＋本文の段落）
+#  ・住所CSV（ジオコーディング用）
+#  すべて seed で決まる（同じ引数なら同じバイト列）
+#  python bench/synth.py csv 100000 out_dir / python bench/synth.py page 1000 out.htm
+# ============================================================
+
+import os, sys, random
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# 市町 → (市区町村コード, 管轄署)。件数の偏りは人口比の目安
+SYNTH_MUNIS: Dict[str, tuple] = {
+    "松山市": (382019, "松山東", 0.38), "今治市": (382027, "今治", 0.12), "新居浜市": (382051, "新居浜", 0.09),
+    "西条市": (382060, "西条", 0.08), "大洲市": (382078, "大洲", 0.03), "伊予市": (382108, "伊予", 0.03),
+    "四国中央市": (382132, "四国中央", 0.06), "西予市": (382141, "西予", 0.03), "東温市": (382159, "松山南", 0.03),
+    "上島町": (383562, "今治", 0.005), "久万高原町": (383864, "久万高原", 0.005), "松前町": (384011, "伊予", 0.03),
+    "砥部町": (384020, "松山南", 0.02), "内子町": (384224, "内子", 0.01), "伊方町": (384429, "八幡浜", 0.01),
+    "松野町": (384844, "宇和島", 0.005), "鬼北町": (384887, "宇和島", 0.01), "愛南町": (385069, "愛南", 0.015),
+}
+# ファイル名の手口キー（crime_data.CRIME_TYPE_BY_FILENAME と同じ）→ (罪名, 手口)
+SYNTH_FILES = {
+    "hittakuri": ("窃盗", "ひったくり"), "syazyounerai": ("窃盗", "車上ねらい"), "buhinnerai": ("窃盗", "部品ねらい"),
+    "zidouhanbaikinerai": ("窃盗", "自動販売機ねらい"), "zidousyatou": ("窃盗", "自動車盗"),
+    "ootobaitou": ("窃盗", "オートバイ盗"), "zitensyatou": ("窃盗", "自転車盗"),
+}
+CSV_COLUMNS = ["罪名", "手口", "管轄警察署（発生地）", "管轄交番・駐在所（発生地）", "市区町村コード（発生地）",
+               "都道府県（発生地）", "市区町村（発生地）", "町丁目（発生地）", "発生年月日（始期）", "発生時（始期）",
+               "発生場所の属性", "被害者の性別", "被害者の年齢", "現金被害の有無"]
+_PLACES = ["道路上", "駐車場", "駐輪場", "一戸建住宅", "共同住宅", "その他"]
+_AGES = ["10歳代", "20歳代", "30歳代", "40歳代", "50歳代", "60-64歳", "65-69歳", "70歳以上", "法人・団体"]
+_CHOME = ["一丁目", "二丁目", "三丁目", "本町", "駅前", "港町", "新町", "大手町"]
+
+
+def crime_frame(n_rows: int, seed: int = 0, kind: str = "zitensyatou") -> pd.DataFrame:
+    # 公開CSVと同じ列構成の DataFrame（n_rows 行）
+    rng = np.random.default_rng(seed)
+    names = list(SYNTH_MUNIS); p = np.array([SYNTH_MUNIS[m][2] for m in names]); p = p / p.sum()
+    mi = rng.choice(len(names), size=n_rows, p=p)
+    days = pd.Timestamp("2019-01-01") + pd.to_timedelta(rng.integers(0, 365, n_rows), unit="D")
+    zai, teguchi = SYNTH_FILES[kind]
+    muni = np.array(names, dtype=object)[mi]
+    return pd.DataFrame({
+        "罪名": zai, "手口": teguchi,
+        "管轄警察署（発生地）": np.array([SYNTH_MUNIS[m][1] for m in names], dtype=object)[mi],
+        "管轄交番・駐在所（発生地）": "駅前交番",
+        "市区町村コード（発生地）": np.array([SYNTH_MUNIS[m][0] for m in names])[mi],
+        "都道府県（発生地）": "愛媛県", "市区町村（発生地）": muni,
+        "町丁目（発生地）": np.array(_CHOME, dtype=object)[rng.integers(0, len(_CHOME), n_rows)],
+        "発生年月日（始期）": days.strftime("%Y-%m-%d"),
+        "発生時（始期）": np.char.zfill(rng.integers(0, 24, n_rows).astype(str), 2),
+        "発生場所の属性": np.array(_PLACES, dtype=object)[rng.integers(0, len(_PLACES), n_rows)],
+        "被害者の性別": np.where(rng.random(n_rows) < 0.6, "男性", "女性"),
+        "被害者の年齢": np.array(_AGES, dtype=object)[rng.integers(0, len(_AGES), n_rows)],
+        "現金被害の有無": np.where(rng.random(n_rows) < 0.2, "あり", "なし"),
+    }, columns=CSV_COLUMNS)
+
+
+def write_crime_csvs(out_dir: str, n_rows: int, seed: int = 0, kinds: Optional[List[str]] = None) -> List[str]:
+    # n_rows を手口別ファイルに振り分けて ehime_2019<kind>.csv（cp932）として書き出す
+    kinds = kinds or list(SYNTH_FILES)
+    os.makedirs(out_dir, exist_ok=True)
+    sizes = np.full(len(kinds), n_rows // len(kinds)); sizes[: n_rows % len(kinds)] += 1
+    paths = []
+    for i, (kind, n) in enumerate(zip(kinds, sizes.tolist())):
+        fp = os.path.join(out_dir, f"ehime_2019{kind}.csv")
+        crime_frame(n, seed + i, kind).to_csv(fp, index=False, encoding="cp932")
+        paths.append(fp)
+    return paths
+
+
+def crime_rows(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    # load_all_crime_2019 の出力と同じ形（date, municipality, ctype）。読込を経ずに後段を測る用
+    rng = np.random.default_rng(seed)
+    names = list(SYNTH_MUNIS); p = np.array([SYNTH_MUNIS[m][2] for m in names]); p = p / p.sum()
+    kinds = [t for _, t in SYNTH_FILES.values()]
+    return pd.DataFrame({
+        "date": pd.Timestamp("2019-01-01") + pd.to_timedelta(rng.integers(0, 365, n_rows), unit="D"),
+        "municipality": np.array(names, dtype=object)[rng.choice(len(names), size=n_rows, p=p)],
+        "ctype": np.array(kinds, dtype=object)[rng.integers(0, len(kinds), n_rows)],
+    })
+
+
+_HEAD_WORDS = ["交通死亡事故", "人身事故", "火災", "建物火災", "ひったくり", "自転車盗", "万引き", "還付金詐欺",
+               "特殊詐欺", "不審者", "声かけ事案", "暴行", "器物損壊", "死亡事案"]
+_BODY = ["午後3時ごろ、", "市内の路上において、", "男性（40歳代）が", "徒歩で帰宅中のところ、", "後方から来た",
+         "何者かに", "手提げかばんを", "奪われる事案が", "発生しました。", "犯人は", "黒っぽい服装で", "逃走しています。",
+         "不審な人物を見かけたら", "すぐに110番通報してください。", "交差点で", "乗用車と自転車が衝突し、",
+         "被害者に", "けがはありませんでした。", "付近の住民に", "注意を呼びかけています。"]
+_STATIONS = ["松山東署", "松山西署", "松山南署", "今治署", "新居浜署", "西条署", "大洲署", "宇和島署", "四国中央署"]
+
+
+def police_page(n_items: int, seed: int = 0) -> str:
+    # 県警速報ページ相当の HTML（事案 n_items 件）
+    r = random.Random(seed)
+    parts = ["<html><head><meta charset='Shift_JIS'><title>事件事故速報</title></head><body>",
+             "<div>愛媛県警 事件事故速報</div>"]
+    munis = list(SYNTH_MUNIS)
+    for i in range(n_items):
+        parts.append(f"<p>■{r.choice(_HEAD_WORDS)}の発生（{r.randint(1, 12)}月{r.randint(1, 28)}日　{r.choice(_STATIONS)}）</p>")
+        body = "".join(r.choice(_BODY) for _ in range(r.randint(6, 14)))
+        k = r.randint(0, len(body)); body = body[:k] + r.choice(munis) + body[k:]
+        parts.append(f"<p>{body}（No.{i}）</p>")
+    parts.append("</body></html>")
+    return "\n".join(parts)
+
+
+def address_frame(n_rows: int, n_unique: Optional[int] = None, seed: int = 0) -> pd.DataFrame:
+    # 住所CSV（列: 住所, 市町村）。n_unique 種類の住所を繰り返す（重複の除去も測れる）
+    r = random.Random(seed)
+    n_unique = n_unique or n_rows
+    munis = list(SYNTH_MUNIS)
+    uniq = [(f"{r.choice(_CHOME)}{r.randint(1, 30)}-{r.randint(1, 20)}", r.choice(munis)) for _ in range(n_unique)]
+    rows = [uniq[i % n_unique] for i in range(n_rows)]
+    return pd.DataFrame(rows, columns=["住所", "市町村"])
+
+
+if __name__ == "__main__":
+    kind, n, out = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+    if kind == "csv": print("\n".join(write_crime_csvs(out, n)))
+    elif kind == "page":
+        with open(out, "w", encoding="cp932", errors="ignore") as f: f.write(police_page(n))
+        print(out)
+    else: raise SystemExit("usage: synth.py csv|page N OUT")
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# 2019 犯罪オープンデータ（CSV）の取り込み
+#  ・文字コード判別（先頭サンプルのみ）→メモリ上のバッファを1回だけ解析
+#  ・列推定（日付/市町村/手口）→ date / municipality / ctype に正規化
+#  ・ファイル単位の列指向スナップショット（.npz）で再起動時の再解析を省略
+#  ・未キャッシュのファイルはプロセスプールで並列に取り込み
+#  ・リスクスコア用の集計（HistoricalProfile）はロード時に1回だけ作成
+#  ・地図用の事前集計（IncidentBins: ヘックス格子/市町 × 手口 × 月）もデータ版ごとに1回だけ作成
+#  ※ プールのワーカーはこのモジュールから import される（app.py は Streamlit が
+#    __main__ として実行するため、子プロセスから参照できない）
+# ============================================================
+
+import os, re, io, glob, math, hashlib, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+# ---------------------------
+# 読み込み / 列推定
+# ---------------------------
+
+ENCODING_SNIFF_BYTES = 64 * 1024   # 判別は先頭のみ（ファイルサイズに依存しない）
+ENCODING_FAST_PATH = ("utf-8", "cp932")   # 県警オープンデータ（CP932）とUTF-8を先に厳密デコードで確認
+
+
+def sniff_encoding(sample: bytes) -> str:
+    if sample.startswith(b"\xef\xbb\xbf"): return "utf-8-sig"
+    for enc in ENCODING_FAST_PATH:
+        try:
+            sample.decode(enc); return enc
+        except UnicodeDecodeError as e:
+            # 先頭切り出しでマルチバイト文字が途中で切れただけなら合格扱い
+            if len(sample) >= ENCODING_SNIFF_BYTES and e.start >= len(sample) - 3: return enc
+    import chardet   # 上の2つで決まらないときだけ（取り込みワーカーの起動を軽くするため遅延読み込み）
+    return (chardet.detect(sample).get("encoding") or "utf-8").lower()
+
+
+def read_csv_bytes(raw: bytes, **kwargs) -> pd.DataFrame:
+    enc_guess = sniff_encoding(raw[:ENCODING_SNIFF_BYTES])
+    for enc in dict.fromkeys((enc_guess, "utf-8-sig", "cp932", "shift_jis")):
+        try: return pd.read_csv(io.BytesIO(raw), encoding=enc, **kwargs)
+        except Exception: continue
+    return pd.read_csv(io.BytesIO(raw), encoding_errors="ignore", **kwargs)
+
+
+def read_csv_robust(path: str) -> pd.DataFrame:
+    with open(path, "rb") as f: raw = f.read()
+    return read_csv_bytes(raw)
+
+
+# 県警オープンデータの列名（完全一致 → 前方一致の順）。緩い推定（正規表現）より先に見る
+#  「管轄警察署（発生地）」が「発生」に、「市区町村コード（発生地）」が市区町村に先に当たらないように
+PREFERRED_COLUMNS = {"date": ("発生年月日",), "municipality": ("市区町村（発生地）", "市区町村名"), "ctype": ("手口",)}
+
+
+def _preferred_column(df: pd.DataFrame, names) -> Optional[str]:
+    cols = [str(c) for c in df.columns]
+    for n in names:
+        if n in cols: return df.columns[cols.index(n)]
+    return next((c for n in names for c, sc in zip(df.columns, cols) if sc.startswith(n)), None)
+
+
+def guess_columns(df: pd.DataFrame) -> dict:
+    cols_lower = {c: str(c).lower() for c in df.columns}
+    date_col = _preferred_column(df, PREFERRED_COLUMNS["date"])
+    if not date_col: date_col = next((c for c in df.columns if re.search(r"(発生|年月日|日付|日時)", str(c))), None)
+    if not date_col: date_col = next((c for c in df.columns if any(k in cols_lower[c] for k in ["date","day","time","occur"])), None)
+    muni_col = _preferred_column(df, PREFERRED_COLUMNS["municipality"])
+    if not muni_col: muni_col = next((c for c in df.columns if re.search(r"(市|町|村).*名", str(c)) or re.search(r"(市町村|自治体|地域)", str(c))), None)
+    if not muni_col: muni_col = next((c for c in df.columns if any(k in cols_lower[c] for k in ["municipality","city","town","area","region"])), None)
+    type_col = _preferred_column(df, PREFERRED_COLUMNS["ctype"])   # 罪名（全件「窃盗」）より手口を優先
+    if not type_col: type_col = next((c for c in df.columns if re.search(r"(手口|罪|罪種|種別|分類)", str(c))), None)
+    if not type_col: type_col = next((c for c in df.columns if any(k in cols_lower[c] for k in ["type","category","kind","crime"])), None)
+    return {"date": date_col, "municipality": muni_col, "ctype": type_col}
+
+
+def parse_date_series(s: pd.Series) -> pd.Series:
+    return pd.to_datetime(s, errors="coerce")
+
+
+# ---------------------------
+# 正規化 / スナップショット
+# ---------------------------
+
+CRIME_SNAPSHOT_DIRNAME = ".esp_cache"   # データと同じ場所に置く列指向スナップショット
+CRIME_SNAPSHOT_VERSION = 3   # 2: 列推定の修正（発生年月日・市区町村（発生地）を優先） 3: 手口列を優先。旧スナップショットは読み直す
+CRIME_TYPE_BY_FILENAME = {
+    "hittakuri":"ひったくり","syazyounerai":"車上ねらい","buhinnerai":"部品ねらい",
+    "zidousyatou":"自動車盗","ootobaitou":"オートバイ盗","zitensyatou":"自転車盗",
+    "zidouhanbaikinerai":"自動販売機ねらい",
+}
+
+
+def normalize_crime_frame(df: pd.DataFrame, fp: str) -> pd.DataFrame:
+    g = guess_columns(df)
+    if g["date"] is None: df["date"] = pd.NaT
+    else:
+        df.rename(columns={g["date"]: "date"}, inplace=True)
+        df["date"] = parse_date_series(df["date"])
+    if g["municipality"] is None: df["municipality"] = ""
+    else:
+        df.rename(columns={g["municipality"]: "municipality"}, inplace=True)
+        df["municipality"] = df["municipality"].astype(str)
+    if g["ctype"] is None:
+        base = os.path.basename(fp)
+        guess = None
+        for k,v in CRIME_TYPE_BY_FILENAME.items():
+            if k in base: guess = v; break
+        df["ctype"] = guess if guess else "不明"
+    else:
+        df.rename(columns={g["ctype"]:"ctype"}, inplace=True)
+        df["ctype"] = df["ctype"].astype(str)
+    df = df[(df["date"].dt.year == 2019) | (df["date"].isna())]
+    return df[["date","municipality","ctype"]]
+
+
+def _crime_source_key(fp: str) -> tuple[str, int, int]:
+    stt = os.stat(fp)
+    return os.path.abspath(fp), int(stt.st_size), int(stt.st_mtime_ns)
+
+
+def _crime_snapshot_path(fp: str) -> str:
+    d, base = os.path.split(os.path.abspath(fp))
+    return os.path.join(d, CRIME_SNAPSHOT_DIRNAME, base + ".npz")
+
+
+def load_crime_snapshot(fp: str) -> Optional[pd.DataFrame]:
+    # キー（パス・サイズ・mtime）が一致する場合のみ採用。不一致/破損は None（→再取り込み）
+    path = _crime_snapshot_path(fp)
+    if not os.path.exists(path): return None
+    try:
+        src, size, mtime_ns = _crime_source_key(fp)
+        with np.load(path, allow_pickle=False) as z:
+            if int(z["version"]) != CRIME_SNAPSHOT_VERSION: return None
+            if str(z["src"]) != src or int(z["size"]) != size or int(z["mtime_ns"]) != mtime_ns: return None
+            muni = z["muni_cats"].astype(object)[z["muni_codes"]]
+            ctype = z["ctype_cats"].astype(object)[z["ctype_codes"]]
+            return pd.DataFrame({
+                "date": pd.Series(z["date"].view("datetime64[ns]")),
+                "municipality": pd.Series(muni, dtype=object).astype(str),
+                "ctype": pd.Series(ctype, dtype=object).astype(str),
+            })
+    except Exception:
+        return None
+
+
+def save_crime_snapshot(fp: str, df: pd.DataFrame):
+    # 文字列列は辞書符号化（codes + categories）して allow_pickle 不要の形で保存。一時ファイル→rename で原子的に置換
+    try:
+        path = _crime_snapshot_path(fp)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        src, size, mtime_ns = _crime_source_key(fp)
+        dates = pd.to_datetime(df["date"], errors="coerce").astype("datetime64[ns]").to_numpy().view("int64")
+        muni_codes, muni_cats = pd.factorize(df["municipality"].astype(str), sort=False)
+        ctype_codes, ctype_cats = pd.factorize(df["ctype"].astype(str), sort=False)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, version=np.int64(CRIME_SNAPSHOT_VERSION), src=np.str_(src),
+                     size=np.int64(size), mtime_ns=np.int64(mtime_ns), date=dates,
+                     muni_codes=muni_codes.astype(np.int32), muni_cats=np.asarray(muni_cats, dtype=str),
+                     ctype_codes=ctype_codes.astype(np.int32), ctype_cats=np.asarray(ctype_cats, dtype=str))
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+# ---------------------------
+# 並列取り込み
+# ---------------------------
+
+PARALLEL_INGEST_MIN_BYTES = 8 * 1024 * 1024   # 自動モード: 未キャッシュ分の合計がこれ未満なら逐次（プール起動の方が高くつく）
+
+
+def ingest_crime_file(fp: str, use_snapshot: bool = True) -> pd.DataFrame:
+    df = normalize_crime_frame(read_csv_robust(fp), fp)
+    if use_snapshot: save_crime_snapshot(fp, df)
+    return df
+
+
+def _ingest_worker(fp: str, use_snapshot: bool) -> Tuple[str, Optional[pd.DataFrame], Optional[str]]:
+    # 1ファイルの失敗は他に波及させず、エラー文字列として返す
+    try: return fp, ingest_crime_file(fp, use_snapshot), None
+    except Exception as e: return fp, None, f"{type(e).__name__}: {e}"
+
+
+def _ingest_files(files: List[str], use_snapshot: bool, workers: Optional[int]) -> list:
+    if workers is None:
+        total = sum(os.path.getsize(fp) for fp in files if os.path.exists(fp))
+        workers = (os.cpu_count() or 1) if total >= PARALLEL_INGEST_MIN_BYTES else 1
+    workers = min(workers, len(files))
+    if workers > 1:
+        try:
+            # spawn: Streamlit のサーバはマルチスレッドなので fork だと他スレッドが持つロックごと複製されて止まりうる
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+                return list(ex.map(_ingest_worker, files, [use_snapshot] * len(files)))
+        except Exception:
+            pass  # プールが使えない環境（セマフォ不可等）は逐次にフォールバック
+    return [_ingest_worker(fp, use_snapshot) for fp in files]
+
+
+def crime_dataset_version(globs: List[str]) -> str:
+    # 対象ファイル（パス・サイズ・mtime）とスナップショット形式から決まる版。ファイルが変われば変わる
+    files = sorted(set(fp for g in globs for fp in glob.glob(g)))
+    h = hashlib.sha1(str(CRIME_SNAPSHOT_VERSION).encode())
+    for fp in files:
+        try: h.update(repr(_crime_source_key(fp)).encode())
+        except OSError: continue
+    return h.hexdigest()[:16]
+
+
+def load_all_crime_2019(globs: List[str], use_snapshot: bool = True, workers: Optional[int] = None,
+                        errors: Optional[Dict[str, str]] = None) -> Optional[pd.DataFrame]:
+    # workers: None=自動 / 1=逐次 / 2以上=プロセス数。errors を渡すとファイル別の失敗理由を格納
+    files: List[str] = []
+    for g in globs: files.extend(glob.glob(g))
+    files = sorted(set(files))
+    if not files: return None
+    frames: Dict[str, pd.DataFrame] = {}
+    pending = []
+    for fp in files:
+        df = load_crime_snapshot(fp) if use_snapshot else None
+        if df is None: pending.append(fp)
+        else: frames[fp] = df
+    for fp, df, err in _ingest_files(pending, use_snapshot, workers) if pending else []:
+        if err is not None:
+            if errors is not None: errors[fp] = err
+            continue
+        frames[fp] = df
+    ordered = [frames[fp] for fp in files if fp in frames]   # 結合順はファイル名順で固定
+    return pd.concat(ordered, ignore_index=True) if ordered else None
+
+# ---------------------------
+# 履歴プロファイル（リスクスコアの「2019傾向」用の事前集計）
+# ---------------------------
+
+OUTDOOR_LIKE_CTYPES = ("ひったくり", "車上ねらい", "自転車盗", "オートバイ盗")
+
+
+@dataclass(frozen=True)
+class HistoricalProfile:
+    n_rows: int
+    month_share: Tuple[float, ...]              # [0]は未使用、[1..12] = 同月件数 / 全件数（日付不明行も分母に含む）
+    ctype_share: Tuple[Tuple[str, float], ...]  # 手口の構成比（多い順）
+    outdoor_like: Optional[float]               # 屋外系手口の合計構成比。ctype 列が無ければ None
+
+    @property
+    def empty(self) -> bool:
+        return self.n_rows == 0
+
+
+def build_historical_profile(df: Optional[pd.DataFrame]) -> HistoricalProfile:
+    if df is None or df.empty: return HistoricalProfile(0, (0.0,) * 13, (), None)
+    n = len(df)
+    by_month = df["date"].dt.month.value_counts()
+    month_share = tuple(int(by_month.get(m, 0)) / max(1, n) for m in range(13))
+    ctype_share: Tuple[Tuple[str, float], ...] = ()
+    outdoor_like = None
+    if "ctype" in df.columns:
+        vc = df["ctype"].value_counts(normalize=True)
+        ctype_share = tuple((str(k), float(v)) for k, v in vc.items())
+        a, b, c, d = (vc.get(k, 0) for k in OUTDOOR_LIKE_CTYPES)
+        outdoor_like = float(a + b + c + d)
+    return HistoricalProfile(n, month_share, ctype_share, outdoor_like)
+
+# ---------------------------
+# 地図用の事前集計（ヘックス格子 / 市町 × 手口 × 月）
+# ---------------------------
+
+HEX_CELL_M = 3000.0     # ヘックスの中心→頂点距離[m]
+_M_PER_DEG_LAT = 110540.0
+_M_PER_DEG_LON = 111320.0
+
+
+def _hex_scale(origin_lat: float) -> Tuple[float, float]:
+    return _M_PER_DEG_LON * math.cos(math.radians(origin_lat)), _M_PER_DEG_LAT
+
+
+def hex_bin(lat, lon, cell_m: float, origin_lat: float) -> Tuple[np.ndarray, np.ndarray]:
+    # 緯度経度 → 尖頂ヘックスの軸座標 (q, r)。origin_lat を基準にした正距円筒（県域なら歪みは小さい）
+    kx, ky = _hex_scale(origin_lat)
+    x = np.asarray(lon, dtype=float) * kx / cell_m; y = np.asarray(lat, dtype=float) * ky / cell_m
+    qf = math.sqrt(3) / 3 * x - y / 3; rf = 2 / 3 * y; sf = -qf - rf
+    q, r, s = np.round(qf), np.round(rf), np.round(sf)
+    dq, dr, ds = np.abs(q - qf), np.abs(r - rf), np.abs(s - sf)
+    fix_q = (dq > dr) & (dq > ds); fix_r = ~fix_q & (dr > ds)
+    q = np.where(fix_q, -r - s, q); r = np.where(fix_r, -q - s, r)
+    return q.astype(np.int64), r.astype(np.int64)
+
+
+def hex_polygon(q: int, r: int, cell_m: float, origin_lat: float) -> List[Tuple[float, float]]:
+    # (q, r) のヘックス頂点 [(lat, lon) × 6]
+    kx, ky = _hex_scale(origin_lat)
+    cx = cell_m * math.sqrt(3) * (q + r / 2); cy = cell_m * 1.5 * r
+    pts = []
+    for i in range(6):
+        a = math.radians(60 * i - 30)
+        pts.append(((cy + cell_m * math.sin(a)) / ky, (cx + cell_m * math.cos(a)) / kx))
+    return pts
+
+
+@dataclass(frozen=True)
+class IncidentBins:
+    version: str
+    cell_m: float
+    origin_lat: float
+    by_muni: pd.DataFrame   # municipality, q, r, ctype, month(0=不明), count
+    by_cell: pd.DataFrame   # q, r, ctype, month, count
+
+    @property
+    def empty(self) -> bool:
+        return self.by_cell.empty
+
+    def ctypes(self) -> List[str]:
+        # データに現れる手口（件数の多い順）
+        return self.by_cell.groupby("ctype")["count"].sum().sort_values(ascending=False, kind="stable").index.tolist()
+
+    def cell_totals(self, ctype: Optional[str] = None, month: Optional[int] = None) -> pd.DataFrame:
+        # ヘックス別の件数（手口/月で絞り込み可）→ q, r, count（件数の多い順）
+        d = self.by_cell
+        if ctype is not None: d = d[d["ctype"] == ctype]
+        if month is not None: d = d[d["month"] == month]
+        return d.groupby(["q", "r"], as_index=False)["count"].sum().sort_values("count", ascending=False, ignore_index=True)
+
+    def muni_totals(self, ctype: Optional[str] = None, month: Optional[int] = None) -> pd.DataFrame:
+        d = self.by_muni
+        if ctype is not None: d = d[d["ctype"] == ctype]
+        if month is not None: d = d[d["month"] == month]
+        return d.groupby(["municipality", "q", "r", "ctype"], as_index=False)["count"].sum()
+
+
+def build_incident_bins(df: Optional[pd.DataFrame], centroids: Dict[str, Tuple[Optional[float], Optional[float]]],
+                        version: str = "", cell_m: float = HEX_CELL_M, origin_lat: float = 33.8) -> IncidentBins:
+    # 行は市町の代表点に置く（元データに座標は無い）。まず市町×手口×月に集計してから格子へ割り当てるので、
+    # 行数に比例するのは最初の groupby だけ
+    cols = ["municipality", "q", "r", "ctype", "month", "count"]
+    if df is None or df.empty:
+        return IncidentBins(version, cell_m, origin_lat, pd.DataFrame(columns=cols), pd.DataFrame(columns=cols[1:]))
+    month = df["date"].dt.month.fillna(0).astype(np.int64)
+    ctype = df["ctype"].astype(str) if "ctype" in df.columns else pd.Series("不明", index=df.index)
+    g = (pd.DataFrame({"municipality": df["municipality"].astype(str).str.strip(), "ctype": ctype, "month": month})
+         .groupby(["municipality", "ctype", "month"], as_index=False).size().rename(columns={"size": "count"}))
+    pts = {m: c for m, c in centroids.items() if c and c[0] and c[1]}
+    g = g[g["municipality"].isin(list(pts))].reset_index(drop=True)
+    lat = g["municipality"].map(lambda m: pts[m][0]).to_numpy(dtype=float)
+    lon = g["municipality"].map(lambda m: pts[m][1]).to_numpy(dtype=float)
+    g["q"], g["r"] = hex_bin(lat, lon, cell_m, origin_lat)
+    by_muni = g[cols]
+    by_cell = by_muni.groupby(["q", "r", "ctype", "month"], as_index=False)["count"].sum()
+    return IncidentBins(version, cell_m, origin_lat, by_muni, by_cell)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# 外部 HTTP の共通入口
+#  ・service（weatherapi / openweather / mgpn / police / nominatim / overpass）ごとに計測と回数を記録
+#  ・requests は最初の通信で読み込む（解析・計算だけの利用では読み込まない）
+#  ・接続はプロセス共通の Session で使い回す（ホストごとに keep-alive のプール。再実行のたびに TLS 接続し直さない）
+#  ・接続失敗/タイムアウト/429・5xx は指数バックオフ（full jitter）で再試行。Retry-After があれば従う（上限あり）
+#  ・ホストごとのサーキットブレーカ: 連続 N 回失敗すると cooldown 秒は通信せずに即失敗（CircuitOpenError）
+#    cooldown 後は1本だけ試し、成功で閉じる / 失敗で再び開く
+#  ・タイムアウト・再試行回数は service ごとの既定。呼び出し側の timeout= / retries= で上書き可
+# ============================================================
+
+import os, random, threading, time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from lazy import lazy_import
+import perf
+
+requests = lazy_import("requests")
+
+USER_AGENT = "ESP-v5/1.0 (Nominatim polite; contact: local-app)"
+
+HTTP_RETRIES = int(os.environ.get("ESP_HTTP_RETRIES", 2))                        # 初回に加えて最大何回
+HTTP_BACKOFF_BASE_S = float(os.environ.get("ESP_HTTP_BACKOFF_BASE_S", 0.5))      # n 回目の待ちは [0, base×2^n) から
+HTTP_BACKOFF_MAX_S = float(os.environ.get("ESP_HTTP_BACKOFF_MAX_S", 4.0))
+HTTP_BREAKER_FAILS = int(os.environ.get("ESP_HTTP_BREAKER_FAILS", 5))            # 連続失敗がこの回数で開く
+HTTP_BREAKER_COOLDOWN_S = float(os.environ.get("ESP_HTTP_BREAKER_COOLDOWN_S", 60))
+HTTP_POOL_MAXSIZE = 32   # ホストあたりの保持接続数（SIBYL の全市町の同時取得が収まる数）
+
+# service → ((接続, 読み取り) タイムアウト秒, 再試行回数)。接続は短く（落ちた相手で待たない）
+SERVICES = {
+    "weatherapi":  ((3.05, 10), HTTP_RETRIES),
+    "openweather": ((3.05, 10), HTTP_RETRIES),
+    "mgpn":        ((3.05, 8), HTTP_RETRIES),
+    "police":      ((3.05, 12), HTTP_RETRIES),
+    "nominatim":   ((3.05, 12), min(1, HTTP_RETRIES)),   # 利用規約上、連打しない
+    "overpass":    ((5, 30), min(1, HTTP_RETRIES)),      # 重い問い合わせ。混雑時は 429 と Retry-After が返る
+}
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(ConnectionError):
+    # ブレーカが開いているホストへの要求（通信せずに失敗）
+    pass
+
+
+class CircuitBreaker:
+    # closed → (連続 fails 回失敗) → open → (cooldown_s 経過) → half_open（1本だけ通す）→ 成功で closed / 失敗で open
+    def __init__(self, fails: int = HTTP_BREAKER_FAILS, cooldown_s: float = HTTP_BREAKER_COOLDOWN_S):
+        self.fails, self.cooldown_s = max(1, int(fails)), float(cooldown_s)
+        self.state = "closed"; self.failures = 0; self.opened_at = 0.0; self._probing = False
+        self.opens = self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed": return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown_s:
+                self.state = "half_open"; self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True; return True
+            self.rejected += 1; return False
+
+    def record(self, ok: bool):
+        with self._lock:
+            self._probing = False
+            if ok: self.state = "closed"; self.failures = 0; return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.fails:
+                if self.state != "open": self.opens += 1
+                self.state = "open"; self.opened_at = time.monotonic()
+
+    def release(self):
+        # 結果を数えずに half_open の試行枠だけ返す
+        with self._lock: self._probing = False
+
+    def retry_in(self) -> float:
+        with self._lock:
+            return max(0.0, self.cooldown_s - (time.monotonic() - self.opened_at)) if self.state == "open" else 0.0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "opens": self.opens, "rejected": self.rejected}
+
+
+class HttpClient:
+    def __init__(self, breaker_fails: int = HTTP_BREAKER_FAILS, breaker_cooldown_s: float = HTTP_BREAKER_COOLDOWN_S,
+                 backoff_base_s: float = HTTP_BACKOFF_BASE_S, backoff_max_s: float = HTTP_BACKOFF_MAX_S,
+                 pool_maxsize: int = HTTP_POOL_MAXSIZE):
+        self.breaker_fails, self.breaker_cooldown_s = breaker_fails, breaker_cooldown_s
+        self.backoff_base_s, self.backoff_max_s = backoff_base_s, backoff_max_s
+        self.pool_maxsize = int(pool_maxsize)
+        self._session = None
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def session(self) -> "requests.Session":
+        # 最初の通信で作成。urllib3 の接続プールはスレッド間で共有できる（満杯時は待たずに使い捨て接続）
+        s = self._session
+        if s is None:
+            with self._lock:
+                s = self._session
+                if s is None:
+                    s = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=self.pool_maxsize)
+                    s.mount("http://", adapter); s.mount("https://", adapter)
+                    self._session = s
+        return s
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).netloc
+        with self._lock:
+            b = self._breakers.get(host)
+            if b is None: b = self._breakers[host] = CircuitBreaker(self.breaker_fails, self.breaker_cooldown_s)
+            return b
+
+    def _backoff(self, attempt: int, r=None) -> float:
+        ra = r.headers.get("Retry-After") if r is not None else None
+        if ra and ra.strip().isdigit(): return min(float(ra), self.backoff_max_s)
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * 2 ** attempt))
+
+    def request(self, service: str, method: str, url: str, retries: Optional[int] = None, **kw) -> "requests.Response":
+        # 最後の応答を返す（429/5xx のままでも。raise_for_status は呼び出し側）。通信の例外は再試行後に送出
+        timeout, n_retry = SERVICES.get(service, ((3.05, 10), HTTP_RETRIES))
+        kw.setdefault("timeout", timeout)
+        if retries is None: retries = n_retry
+        br = self.breaker(url); sess = self.session()
+        perf.count(f"http.{service}")
+        with perf.span(f"http.{service}") as sp:
+            for attempt in range(retries + 1):
+                if not br.allow():
+                    perf.count(f"http.{service}.rejected"); sp.set(circuit="open")
+                    raise CircuitOpenError(f"{service}: {urlsplit(url).netloc} は一時停止中（残り {br.retry_in():.0f}s）")
+                r = None
+                try:
+                    r = sess.request(method, url, **kw)
+                except (requests.ConnectionError, requests.Timeout):
+                    br.record(False)
+                    if attempt >= retries: raise
+                except Exception:
+                    br.release(); raise   # URL 不正など相手の状態と無関係な失敗は数えない
+                else:
+                    ok = r.status_code not in RETRY_STATUS; br.record(ok)
+                    if ok or attempt >= retries: break
+                perf.count(f"http.{service}.retry")
+                time.sleep(self._backoff(attempt, r))
+            sp.set(status=r.status_code, attempts=attempt + 1)
+        return r
+
+    def get(self, service: str, url: str, **kw) -> "requests.Response":
+        return self.request(service, "GET", url, **kw)
+
+    def post(self, service: str, url: str, **kw) -> "requests.Response":
+        return self.request(service, "POST", url, **kw)
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock: items = list(self._breakers.items())
+        return {host: b.stats() for host, b in items}
+
+    def close(self):
+        with self._lock:
+            if self._session is not None: self._session.close()
+            self._session = None; self._breakers.clear()
+
+
+HTTP = HttpClient()   # プロセス共通（Streamlit の再実行をまたいで接続とブレーカの状態を保つ）
+http_get, http_post, http_stats = HTTP.get, HTTP.post, HTTP.stats
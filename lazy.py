@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# 重い依存の遅延読み込み
+#  ・lazy_import("folium") は代理オブジェクトを返し、属性に最初に触れた時点で import する
+#    （地図を描かない処理・一括計算・プールのワーカーは読み込みの時間を払わない）
+#  ・読み込み後は本物のモジュールの属性をそのまま返す（2回目以降は dict 参照1回）
+#  ・型注釈で使う場合は注釈を評価しない（from __future__ import annotations）こと
+# ============================================================
+
+import importlib, sys, threading
+
+_lock = threading.Lock()
+
+
+class LazyModule:
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_mod"] = None
+
+    def _load(self):
+        mod = self.__dict__["_mod"]
+        if mod is None:
+            with _lock:
+                mod = self.__dict__["_mod"]
+                if mod is None: mod = self.__dict__["_mod"] = importlib.import_module(self._name)
+        return mod
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    @property
+    def loaded(self) -> bool:
+        return self.__dict__["_mod"] is not None or self._name in sys.modules
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}{'' if self.__dict__['_mod'] is None else ' (loaded)'}>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
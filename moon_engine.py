@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# 月齢・月の位置（オフライン計算）
+#  ・新月/満月時刻: Meeus『Astronomical Algorithms』49章（主要項＋惑星摂動項、誤差 数分）
+#  ・月齢 = 直前の新月からの経過日数（mgpn.org の moonage と同じ定義）
+#  ・高度/方位: 天文年鑑の低精度式（誤差 0.3°程度、視差補正あり・大気差なし）
+#  ・すべて NumPy 配列で一括評価できる（スカラーも可）
+#  python moon_engine.py で既知の新月/満月時刻表との誤差を表示
+# ============================================================
+
+from datetime import datetime, timezone
+
+import numpy as np
+
+SYNODIC_MONTH = 29.530588861
+JD_UNIX_EPOCH = 2440587.5
+DELTA_T_DAYS = 69.0 / 86400.0   # TT−UT（2020年代は約69秒）。分単位の精度には十分
+
+# 既知の新月/満月（UTC, 分単位）。主に日食・月食の日付で照合用
+MOON_REFERENCE_PHASES_UTC = (
+    ("new",  "2019-01-06T01:28"), ("full", "2019-01-21T05:16"),
+    ("new",  "2019-07-02T19:16"), ("full", "2019-07-16T21:38"),
+    ("new",  "2020-06-21T06:41"), ("full", "2021-05-26T11:14"),
+    ("full", "2022-11-08T11:02"), ("new",  "2023-04-20T04:12"),
+    ("new",  "2023-10-14T17:55"), ("new",  "2024-04-08T18:21"),
+    ("full", "2024-09-18T02:34"), ("full", "2025-03-14T06:55"),
+    ("full", "2025-09-07T18:09"), ("new",  "2025-09-21T19:54"),
+)
+
+# 新月/満月の補正項（係数, E の次数, M, M', F, Ω の倍数）。満月は先頭7項の係数のみ異なる
+_PHASE_TERMS = (
+    (-0.40720, -0.40614, 0, 0, 1, 0, 0), (0.17241, 0.17302, 1, 1, 0, 0, 0),
+    (0.01608, 0.01614, 0, 0, 2, 0, 0), (0.01039, 0.01043, 0, 0, 0, 2, 0),
+    (0.00739, 0.00734, 1, -1, 1, 0, 0), (-0.00514, -0.00515, 1, 1, 1, 0, 0),
+    (0.00208, 0.00209, 2, 2, 0, 0, 0), (-0.00111, -0.00111, 0, 0, 1, -2, 0),
+    (-0.00057, -0.00057, 0, 0, 1, 2, 0), (0.00056, 0.00056, 1, 1, 2, 0, 0),
+    (-0.00042, -0.00042, 0, 0, 3, 0, 0), (0.00042, 0.00042, 1, 1, 0, 2, 0),
+    (0.00038, 0.00038, 1, 1, 0, -2, 0), (-0.00024, -0.00024, 1, -1, 2, 0, 0),
+    (-0.00017, -0.00017, 0, 0, 0, 0, 1), (-0.00007, -0.00007, 0, 2, 1, 0, 0),
+    (0.00004, 0.00004, 0, 0, 2, -2, 0), (0.00004, 0.00004, 0, 3, 0, 0, 0),
+    (0.00003, 0.00003, 0, 1, 1, -2, 0), (0.00003, 0.00003, 0, 0, 2, 2, 0),
+    (-0.00003, -0.00003, 0, 1, 1, 2, 0), (0.00003, 0.00003, 0, -1, 1, 2, 0),
+    (-0.00002, -0.00002, 0, -1, 1, -2, 0), (-0.00002, -0.00002, 0, 1, 3, 0, 0),
+    (0.00002, 0.00002, 0, 0, 4, 0, 0),
+)
+# 惑星摂動項 A1..A14: (初期値, k の係数, 振幅[日])。A1 のみ T² 項 −0.009173 あり
+_PLANETARY_TERMS = (
+    (299.77, 0.107408, 0.000325), (251.88, 0.016321, 0.000165), (251.83, 26.651886, 0.000164),
+    (349.42, 36.412478, 0.000126), (84.66, 18.206239, 0.000110), (141.74, 53.303771, 0.000062),
+    (207.14, 2.453732, 0.000060), (154.84, 7.306860, 0.000056), (34.52, 27.261239, 0.000047),
+    (207.19, 0.121824, 0.000042), (291.34, 1.844379, 0.000040), (161.72, 24.198154, 0.000037),
+    (239.56, 25.513099, 0.000035), (331.55, 3.592518, 0.000023),
+)
+
+
+def to_julian_day(t) -> np.ndarray:
+    # datetime / datetime64 / pandas の時刻（配列可）→ ユリウス日（UT）。naive は UTC とみなす
+    if isinstance(t, datetime):
+        if t.tzinfo is not None: t = t.astimezone(timezone.utc).replace(tzinfo=None)
+        t = np.datetime64(t, "us")
+    elif hasattr(t, "tz_convert"):   # pandas DatetimeIndex / Series（Timestamp は datetime 側で処理済み）
+        acc = (lambda x: x.dt) if hasattr(t, "dt") else (lambda x: x)
+        if acc(t).tz is not None: t = acc(acc(t).tz_convert("UTC")).tz_localize(None)
+        t = np.asarray(t)
+    secs = np.asarray(t, dtype="datetime64[us]").astype(np.int64) / 1e6
+    return JD_UNIX_EPOCH + secs / 86400.0
+
+
+def phase_jde(k, full: bool = False) -> np.ndarray:
+    # k: 2000年1月の新月を 0 とする朔望の通し番号（整数）。full=True で同じ周の満月
+    k = np.asarray(k, dtype=float) + (0.5 if full else 0.0)
+    T = k / 1236.85
+    jde = (2451550.09766 + SYNODIC_MONTH * k + 0.00015437 * T**2 - 0.000000150 * T**3 + 0.00000000073 * T**4)
+    E = 1 - 0.002516 * T - 0.0000074 * T**2
+    M = np.radians(2.5534 + 29.10535670 * k - 0.0000014 * T**2 - 0.00000011 * T**3)
+    Mp = np.radians(201.5643 + 385.81693528 * k + 0.0107582 * T**2 + 0.00001238 * T**3 - 0.000000058 * T**4)
+    F = np.radians(160.7108 + 390.67050284 * k - 0.0016118 * T**2 - 0.00000227 * T**3 + 0.000000011 * T**4)
+    Om = np.radians(124.7746 - 1.56375588 * k + 0.0020672 * T**2 + 0.00000215 * T**3)
+    for c_new, c_full, e_pow, cm, cmp, cf, co in _PHASE_TERMS:
+        jde = jde + (c_full if full else c_new) * E**e_pow * np.sin(cm * M + cmp * Mp + cf * F + co * Om)
+    for i, (a0, ak, amp) in enumerate(_PLANETARY_TERMS):
+        a = a0 + ak * k - (0.009173 * T**2 if i == 0 else 0.0)
+        jde = jde + amp * np.sin(np.radians(a))
+    return jde
+
+
+def moon_age_days(t) -> np.ndarray:
+    # 直前の新月からの経過日数。t はスカラー/配列どちらでも
+    jd = to_julian_day(t)
+    k = np.floor((jd + DELTA_T_DAYS - 2451550.09766) / SYNODIC_MONTH)
+    nm = phase_jde(k) - DELTA_T_DAYS
+    k = np.where(nm > jd, k - 1, k)
+    nm = phase_jde(k) - DELTA_T_DAYS
+    nxt = phase_jde(k + 1) - DELTA_T_DAYS
+    nm = np.where(nxt <= jd, nxt, nm)
+    return jd - nm
+
+
+def moon_alt_az(t, lat, lon) -> tuple[np.ndarray, np.ndarray]:
+    # 地平座標（度）。方位は北=0°から東回り
+    jd = to_julian_day(t)
+    T = (jd - 2451545.0) / 36525.0
+    sd = lambda a, b: np.sin(np.radians(a + b * T))
+    cd = lambda a, b: np.cos(np.radians(a + b * T))
+    lam = (218.32 + 481267.881 * T + 6.29 * sd(135.0, 477198.87) - 1.27 * sd(259.3, -413335.36)
+           + 0.66 * sd(235.7, 890534.22) + 0.21 * sd(269.9, 954397.74) - 0.19 * sd(357.5, 35999.05)
+           - 0.11 * sd(186.5, 966404.03))
+    beta = (5.13 * sd(93.3, 483202.02) + 0.28 * sd(228.2, 960400.89) - 0.28 * sd(318.3, 6003.15)
+            - 0.17 * sd(217.6, -407332.21))
+    par = (0.9508 + 0.0518 * cd(135.0, 477198.87) + 0.0095 * cd(259.3, -413335.36)
+           + 0.0078 * cd(235.7, 890534.22) + 0.0028 * cd(269.9, 954397.74))
+    eps = np.radians(23.4393 - 0.0130 * T)
+    lam, beta = np.radians(lam), np.radians(beta)
+    l = np.cos(beta) * np.cos(lam)
+    m = np.cos(eps) * np.cos(beta) * np.sin(lam) - np.sin(eps) * np.sin(beta)
+    n = np.sin(eps) * np.cos(beta) * np.sin(lam) + np.cos(eps) * np.sin(beta)
+    ra, dec = np.arctan2(m, l), np.arcsin(n)
+    gmst = np.radians(280.46061837 + 360.98564736629 * (jd - 2451545.0))
+    h = gmst + np.radians(np.asarray(lon, dtype=float)) - ra
+    phi = np.radians(np.asarray(lat, dtype=float))
+    alt = np.arcsin(np.sin(phi) * np.sin(dec) + np.cos(phi) * np.cos(dec) * np.cos(h))
+    az = np.arctan2(-np.cos(dec) * np.sin(h), np.sin(dec) * np.cos(phi) - np.cos(dec) * np.sin(phi) * np.cos(h))
+    alt_deg = np.degrees(alt) - par * np.cos(alt)   # 地心→地表（視差）
+    return alt_deg, np.mod(np.degrees(az), 360.0)
+
+
+def check_against_reference() -> list[tuple[str, str, float]]:
+    # 参照表との差（分）。[(種別, 参照時刻, 差分[分])]
+    out = []
+    for kind, ts in MOON_REFERENCE_PHASES_UTC:
+        jd = to_julian_day(np.datetime64(ts))
+        k = np.round((jd - 2451550.09766) / SYNODIC_MONTH - (0.5 if kind == "full" else 0.0))
+        calc = phase_jde(k, full=(kind == "full")) - DELTA_T_DAYS
+        out.append((kind, ts, float((calc - jd) * 1440.0)))
+    return out
+
+
+if __name__ == "__main__":
+    errs = check_against_reference()
+    for kind, ts, d in errs: print(f"{kind:4s} {ts}  {d:+6.1f} min")
+    print(f"max |error| = {max(abs(d) for *_, d in errs):.1f} min")
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# 愛媛県の市町（一覧と代表点）と日本時間
+#  ・画面・一括計算・速報解析で共通に使う定数だけを置く（numpy/pandas も読み込まない）
+# ============================================================
+
+from datetime import timedelta, timezone
+from typing import Dict, Tuple
+
+JST = timezone(timedelta(hours=9))
+
+CITY_NAMES = [
+    "松山市","今治市","新居浜市","西条市","大洲市","伊予市","四国中央市","西予市","東温市",
+    "上島町","久万高原町","松前町","砥部町","内子町","伊方町","松野町","鬼北町","愛南町"
+]
+
+# 市町の代表点（役所・役場付近）。ジオコーディング不要の高速パス
+MUNI_CENTROIDS: Dict[str, Tuple[float, float]] = {
+    "松山市": (33.8392, 132.7657), "今治市": (34.0661, 132.9978), "新居浜市": (33.9604, 133.2834),
+    "西条市": (33.9196, 133.1812), "大洲市": (33.5064, 132.5447), "伊予市": (33.7575, 132.7017),
+    "四国中央市": (33.9808, 133.5492), "西予市": (33.3626, 132.5110), "東温市": (33.7911, 132.8706),
+    "上島町": (34.2570, 133.2050), "久万高原町": (33.6553, 132.9016), "松前町": (33.7874, 132.7113),
+    "砥部町": (33.7492, 132.7922), "内子町": (33.5331, 132.6580), "伊方町": (33.4886, 132.3539),
+    "松野町": (33.2273, 132.7106), "鬼北町": (33.2544, 132.6856), "愛南町": (32.9620, 132.5667),
+}
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# 処理時間の計測（span）と回数カウンタ
+#  ・with span("名前"): ... で区間を記録。入れ子はスレッドごとのスタックで親子関係（depth）を持つ
+#  ・記録は「再実行1回（run）」単位。begin_run / end_run の間の span とカウンタを1件にまとめる
+#  ・ワーカースレッドへは bind(fn) で run を引き継ぐ（ThreadPoolExecutor 等）
+#  ・計測していない run（既定）の span は共有の no-op を返すだけ（スレッドローカル参照1回＋分岐1回）
+#  ・有効/無効は run ごと（Streamlit のセッションごとに切り替えられる）。enabled は既定値
+#  ・sink_path を指定すると run ごとに JSON 1行を追記（JSON Lines）
+#  ESP_PERF=1 で起動時から有効、ESP_PERF_LOG=<path> で JSONL 出力
+# ============================================================
+
+import json, os, threading, time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exc): return False
+
+    def set(self, **attrs): pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _Local(threading.local):
+    # 既定値をクラス属性に置き、未設定時の getattr が例外経由にならないようにする
+    run: Optional["_Run"] = None
+    stack: Optional[list] = None
+
+
+class _Run:
+    def __init__(self, name: str):
+        self.name = name
+        self.t0 = time.perf_counter(); self.wall0 = time.time()
+        self.spans: List[dict] = []
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.lock = threading.Lock()
+        self.total_s: Optional[float] = None
+
+
+class _Span:
+    __slots__ = ("tracer", "run", "name", "attrs", "t0", "depth")
+
+    def __init__(self, tracer: "Tracer", run: _Run, name: str, attrs: dict):
+        self.tracer, self.run, self.name, self.attrs = tracer, run, name, attrs
+
+    def __enter__(self):
+        st = self.tracer._stack()
+        self.depth = len(st); st.append(self.name)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.perf_counter()
+        self.tracer._stack().pop()
+        rec = {"name": self.name, "start_ms": round((self.t0 - self.run.t0) * 1000, 3),
+               "dur_ms": round((t1 - self.t0) * 1000, 3), "depth": self.depth, "thread": threading.current_thread().name}
+        if exc_type is not None: rec["error"] = exc_type.__name__
+        if self.attrs: rec.update(self.attrs)
+        with self.run.lock: self.run.spans.append(rec)
+        return False
+
+    def set(self, **attrs):
+        # 区間の途中で分かった属性（キャッシュ命中、HTTP ステータス等）
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    def __init__(self, enabled: bool = False, sink_path: Optional[str] = None, keep: int = 20):
+        self.enabled = bool(enabled)
+        self.sink_path = sink_path
+        self.keep = int(keep)
+        self._local = _Local()
+        self._active = 0   # 計測中の run の数。0 なら span はスレッドローカルも見ずに no-op
+        self._lock = threading.Lock()
+        self.history: List[dict] = []   # 直近の run（新しいものが末尾）
+
+    def _stack(self) -> list:
+        st = self._local.stack
+        if st is None: st = self._local.stack = []
+        return st
+
+    def _run(self) -> Optional[_Run]:
+        return self._local.run
+
+    # --- run ---
+    def begin_run(self, name: str = "run", enabled: Optional[bool] = None):
+        on = self.enabled if enabled is None else enabled
+        if self._local.run is not None: self.end_run(record=False)   # 例外/再実行で閉じられなかった前回分
+        if on:
+            with self._lock: self._active += 1
+        self._local.run = _Run(name) if on else None; self._local.stack = []
+
+    def end_run(self, record: bool = True) -> Optional[dict]:
+        run = self._run(); self._local.run = None
+        if run is None: return None
+        with self._lock: self._active -= 1
+        if not record: return None
+        run.total_s = time.perf_counter() - run.t0
+        rec = {"run": run.name, "ts": round(run.wall0, 3), "total_ms": round(run.total_s * 1000, 3),
+               "spans": run.spans, "counters": dict(run.counters)}
+        with self._lock:
+            self.history.append(rec); del self.history[:-self.keep]
+            if self.sink_path:
+                try:
+                    with open(self.sink_path, "a", encoding="utf-8") as f: f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                except OSError: pass   # 計測の失敗で本処理は止めない
+        return rec
+
+    # --- 計測 ---
+    def span(self, name: str, **attrs):
+        if not self._active: return _NOOP
+        run = self._local.run
+        return _NOOP if run is None else _Span(self, run, name, attrs)
+
+    def count(self, name: str, n: int = 1):
+        if not self._active: return
+        run = self._local.run
+        if run is not None:
+            with run.lock: run.counters[name] += n
+
+    def bind(self, fn: Callable) -> Callable:
+        # 呼び出し元の run を引き継いで fn を実行する関数（別スレッドで呼ぶ用）
+        run = self._run()
+        if run is None: return fn
+        parent_depth = len(self._stack())
+
+        def _bound(*a, **kw):
+            self._local.run = run; self._local.stack = [None] * parent_depth
+            try: return fn(*a, **kw)
+            finally: self._local.run = None; self._local.stack = []
+        return _bound
+
+    def last(self) -> Optional[dict]:
+        with self._lock: return self.history[-1] if self.history else None
+
+
+def summarize(rec: dict) -> List[dict]:
+    # span を名前ごとに集計（回数・合計・最大）。最初に現れた順
+    agg: Dict[str, dict] = {}
+    for s in rec.get("spans", []):
+        a = agg.setdefault(s["name"], {"name": s["name"], "depth": s["depth"], "first_ms": s["start_ms"],
+                                       "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        a["count"] += 1; a["total_ms"] += s["dur_ms"]; a["max_ms"] = max(a["max_ms"], s["dur_ms"])
+        a["depth"] = min(a["depth"], s["depth"]); a["first_ms"] = min(a["first_ms"], s["start_ms"])
+    return sorted(agg.values(), key=lambda a: a["first_ms"])
+
+
+TRACER = Tracer(enabled=os.environ.get("ESP_PERF", "") == "1", sink_path=os.environ.get("ESP_PERF_LOG") or None)
+span, count, bind = TRACER.span, TRACER.count, TRACER.bind
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# 近傍POIのタイルキャッシュ（SQLite）とオフライン抽出の取り込み
+#  ・緯度経度を tile_deg 刻みのタイルに分け、POI はタイル単位で保持（タイル = 格子バケットの空間索引）
+#  ・任意の円は掛かるタイルを集めて距離で切り出す。地点や半径が多少変わっても、タイルが揃っていれば通信なし
+#  ・足りないタイルだけを外接矩形1つにまとめて取得（Overpass への問い合わせは1回）
+#  ・取得済みタイルは SQLite に保存し TTL で取り直し。保存先に書けない場合はメモリ上の DB
+#  ・県全域の抽出（GeoJSON。pyosmium があれば .osm.pbf も）を読み込むと、その範囲のタイルは取得済み扱い
+# ============================================================
+
+import json, math, os, re, sqlite3, threading, time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+POI_TILE_DEG = 0.02                 # 約 2.2km × 1.9km（愛媛の緯度）
+POI_TILE_TTL_S = 30 * 24 * 3600     # Overpass 由来のタイルの有効期間（抽出由来は読み直すまで有効）
+POI_QUERY_LIMIT = 200
+
+# (タグ, 演算子, 値)。Overpass の問い合わせと抽出の絞り込みの両方に使う（"~" は正規表現）
+POI_FILTERS: Tuple[Tuple[str, str, str], ...] = (
+    ("railway", "=", "station"),
+    ("public_transport", "~", "stop_position|platform"),
+    ("amenity", "=", "bicycle_parking"),
+    ("amenity", "=", "convenience"),
+    ("amenity", "=", "parking"),
+    ("leisure", "=", "park"),
+    ("amenity", "=", "atm"),
+    ("amenity", "~", "bar|nightclub|pub"),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS poi_tiles (
+    tile TEXT PRIMARY KEY,
+    fetched REAL NOT NULL,
+    source TEXT NOT NULL,
+    elements TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS poi_meta (
+    k TEXT PRIMARY KEY,
+    v TEXT
+);
+"""
+
+Tile = Tuple[int, int]
+BBox = Tuple[float, float, float, float]   # (south, west, north, east)
+
+
+def poi_matches(tags: Dict) -> bool:
+    for k, op, v in POI_FILTERS:
+        t = tags.get(k)
+        if t is None: continue
+        if (t == v) if op == "=" else re.search(v, str(t)): return True
+    return False
+
+
+def overpass_bbox_query(bbox: BBox, limit: Optional[int] = None) -> str:
+    s, w, n, e = bbox
+    body = "\n".join(f'  node({s:.5f},{w:.5f},{n:.5f},{e:.5f})["{k}"{op}"{v}"];' for k, op, v in POI_FILTERS)
+    return f"[out:json][timeout:25];\n(\n{body}\n);\nout center{'' if limit is None else f' {limit}'};\n"
+
+
+def _equirect_m(lat0: float, lon0: float, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    kx = 111320.0 * math.cos(math.radians(lat0))
+    return np.hypot((lon - lon0) * kx, (lat - lat0) * 110540.0)
+
+
+def _tile_key(t: Tile) -> str:
+    return f"{t[0]}:{t[1]}"
+
+
+class PoiTileStore:
+    def __init__(self, path: str, tile_deg: float = POI_TILE_DEG, ttl_s: float = POI_TILE_TTL_S):
+        self.path, self.tile_deg, self.ttl_s = path, float(tile_deg), float(ttl_s)
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = self._open(path)
+        except (OSError, sqlite3.Error):
+            self.path = ":memory:"; self._conn = self._open(":memory:")
+        # タイル → (取得時刻, 由来, 要素, lat配列, lon配列)
+        self._tiles: Dict[Tile, tuple] = {}
+        self.fetches = 0; self.hits = 0
+        self.extract_error: Optional[str] = None   # 抽出の読込失敗（アプリは Overpass だけで継続）
+        for key, fetched, source, elements in self._conn.execute("SELECT tile, fetched, source, elements FROM poi_tiles"):
+            i, j = (int(x) for x in key.split(":"))
+            self._set((i, j), json.loads(elements), fetched, source)
+
+    @staticmethod
+    def _open(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:": conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _set(self, t: Tile, elements: List[Dict], fetched: float, source: str):
+        lat = np.array([e["lat"] for e in elements], dtype=float); lon = np.array([e["lon"] for e in elements], dtype=float)
+        self._tiles[t] = (fetched, source, elements, lat, lon)
+
+    # --- タイルの幾何 ---
+    def tile_of(self, lat: float, lon: float) -> Tile:
+        return math.floor(lat / self.tile_deg), math.floor(lon / self.tile_deg)
+
+    def tile_bbox(self, t: Tile) -> BBox:
+        d = self.tile_deg
+        return t[0] * d, t[1] * d, (t[0] + 1) * d, (t[1] + 1) * d
+
+    def tiles_in_bbox(self, bbox: BBox) -> List[Tile]:
+        # 矩形に掛かるタイル（端がタイル境界ちょうどなら外側は含めない）
+        s, w, n, e = bbox; d = self.tile_deg
+        i0, j0 = math.floor(s / d), math.floor(w / d)
+        i1, j1 = math.ceil(n / d) - 1, math.ceil(e / d) - 1
+        return [(i, j) for i in range(i0, max(i0, i1) + 1) for j in range(j0, max(j0, j1) + 1)]
+
+    def tiles_for_circle(self, lat: float, lon: float, radius_m: float) -> List[Tile]:
+        dlat = radius_m / 110540.0; dlon = radius_m / (111320.0 * math.cos(math.radians(lat)))
+        return self.tiles_in_bbox((lat - dlat, lon - dlon, lat + dlat, lon + dlon))
+
+    def missing(self, tiles: Iterable[Tile], now: Optional[float] = None) -> List[Tile]:
+        now = time.time() if now is None else now
+        out = []
+        for t in tiles:
+            rec = self._tiles.get(t)
+            if rec is None or (rec[1] == "overpass" and now - rec[0] > self.ttl_s): out.append(t)
+        return out
+
+    # --- 書き込み ---
+    def put_bbox(self, bbox_tiles: Sequence[Tile], elements: Iterable[Dict], source: str = "overpass",
+                 fetched_at: Optional[float] = None) -> int:
+        # bbox_tiles のタイルを elements で置き換える（POI の無いタイルも空として記録）。戻り値 = 保存した POI 数
+        now = time.time() if fetched_at is None else float(fetched_at)
+        buckets: Dict[Tile, List[Dict]] = {t: [] for t in bbox_tiles}
+        seen = set()
+        for e in elements:
+            lat, lon = e.get("lat"), e.get("lon")
+            if lat is None or lon is None: continue
+            uid = (e.get("type", "node"), e.get("id"), lat, lon)
+            if uid in seen: continue
+            seen.add(uid)
+            b = buckets.get(self.tile_of(lat, lon))
+            if b is not None: b.append(e)
+        rows = [(_tile_key(t), now, source, json.dumps(els, ensure_ascii=False)) for t, els in buckets.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO poi_tiles (tile, fetched, source, elements) VALUES (?, ?, ?, ?)", rows)
+            for t, els in buckets.items(): self._set(t, els, now, source)
+        return sum(len(els) for els in buckets.values())
+
+    # --- 検索 ---
+    def query(self, lat: float, lon: float, radius_m: float,
+              fetch_bbox: Optional[Callable[[BBox], Optional[List[Dict]]]] = None,
+              limit: Optional[int] = POI_QUERY_LIMIT) -> List[Dict]:
+        # 半径内の POI（近い順）。足りないタイルは fetch_bbox（None を返したら失敗扱いで記録しない）で補う
+        tiles = self.tiles_for_circle(lat, lon, radius_m)
+        need = self.missing(tiles)
+        if need and fetch_bbox is not None:
+            i0 = min(t[0] for t in need); i1 = max(t[0] for t in need)
+            j0 = min(t[1] for t in need); j1 = max(t[1] for t in need)
+            s, w, _, _ = self.tile_bbox((i0, j0)); _, _, n, e = self.tile_bbox((i1, j1))
+            got = fetch_bbox((s, w, n, e))
+            if got is not None:
+                self.fetches += 1
+                self.put_bbox(need, got)   # 外接矩形で取得しても記録は不足分だけ（L 字のときに抽出/取得済みタイルを上書きしない）
+        elif not need: self.hits += 1
+        els: List[Dict] = []; lats, lons = [], []
+        for t in tiles:
+            rec = self._tiles.get(t)
+            if rec is None: continue
+            els += rec[2]; lats.append(rec[3]); lons.append(rec[4])
+        if not els: return []
+        d = _equirect_m(lat, lon, np.concatenate(lats), np.concatenate(lons))
+        order = [int(k) for k in np.argsort(d, kind="stable") if d[k] <= radius_m]
+        return [els[k] for k in order[:limit]]
+
+    # --- オフライン抽出 ---
+    def load_extract(self, path: str, bbox: Optional[BBox] = None, force: bool = False) -> int:
+        # GeoJSON（Point の Feature、properties = OSM タグ）または .osm.pbf（要 pyosmium）。
+        # bbox（省略時は抽出の範囲）に掛かるタイルはすべて抽出の内容で置き換える。同じファイルは読み直さない
+        st = os.stat(path)
+        sig = f"{os.path.abspath(path)}|{st.st_size}|{int(st.st_mtime)}"
+        with self._lock:
+            row = self._conn.execute("SELECT v FROM poi_meta WHERE k = 'extract'").fetchone()
+        if row and row[0] == sig and not force: return 0
+        elements = list(_read_pbf(path) if path.endswith(".pbf") else _read_geojson(path))
+        if bbox is None and elements:
+            la = [e["lat"] for e in elements]; lo = [e["lon"] for e in elements]
+            bbox = (min(la), min(lo), max(la), max(lo))
+        n = self.put_bbox(self.tiles_in_bbox(bbox), elements, source="extract") if bbox else 0
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO poi_meta (k, v) VALUES ('extract', ?)", (sig,))
+        return n
+
+    def stats(self) -> Dict:
+        with self._lock:
+            recs = list(self._tiles.values())
+        return {"tiles": len(recs), "pois": sum(len(r[2]) for r in recs),
+                "extract_tiles": sum(r[1] == "extract" for r in recs),
+                "fetches": self.fetches, "hits": self.hits, "path": self.path}
+
+    def close(self):
+        with self._lock: self._conn.close()
+
+
+def _read_geojson(path: str):
+    # Overpass の要素と同じ形 {"type","id","lat","lon","tags"} にそろえる。Point 以外は重心代わりに先頭座標
+    with open(path, "r", encoding="utf-8") as f: js = json.load(f)
+    for i, ft in enumerate(js.get("features", [])):
+        geom = ft.get("geometry") or {}; tags = dict(ft.get("properties") or {})
+        coords = geom.get("coordinates")
+        while isinstance(coords, list) and coords and isinstance(coords[0], list): coords = coords[0]
+        if not coords or len(coords) < 2 or not poi_matches(tags): continue
+        osm_id = tags.pop("@id", None) or ft.get("id") or i
+        kind, _, num = str(osm_id).rpartition("/")
+        yield {"type": kind or "node", "id": int(num) if num.isdigit() else num, "lat": float(coords[1]), "lon": float(coords[0]), "tags": tags}
+
+
+def _read_pbf(path: str):
+    try:
+        import osmium
+    except ImportError as e:
+        raise RuntimeError(".osm.pbf の読み込みには pyosmium が必要です（pip install osmium）。GeoJSON に書き出したものは不要") from e
+    out = []
+
+    class _H(osmium.SimpleHandler):
+        def node(self, n):
+            tags = {t.k: t.v for t in n.tags}
+            if tags and poi_matches(tags) and n.location.valid():
+                out.append({"type": "node", "id": n.id, "lat": n.location.lat, "lon": n.location.lon, "tags": tags})
+    _H().apply_file(path)
+    return out
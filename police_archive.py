@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# 県警速報の履歴アーカイブ（SQLite）
+#  ・parse_police_page が出した事案を key（見出し＋発生日＋署の同一性。item_identity）で一意に蓄積
+#    本文の訂正・追記は content_hash の変化として同じ行を上書き（別の事案として二重に数えない）
+#  ・day = 見出しの発生日（不明なら初回取得日, JST）。day/市町/署/カテゴリに索引
+#  ・期間＋条件の絞り込み（query）と、市町別の直近N日件数（muni_counts）を SQL の集計で返す
+#  ・WAL モードの単一接続をロックで共有（Streamlit のセッションスレッド間で共用）
+#  ・保存先に書けない場合はメモリ上の DB に切り替える（アプリは継続）
+#  ・キーワード検索は見出し＋本文の文字バイグラム転置索引（メモリ上、起動時に構築し追加分だけ更新）
+# ============================================================
+
+import os, hashlib, sqlite3, threading, time, unicodedata
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone, date as date_cls
+from typing import Optional, List, Dict, Iterable, Sequence, Tuple
+
+JST = timezone(timedelta(hours=9))
+ARCHIVE_COLUMNS = ("key", "day", "date", "municipality", "station", "category",
+                   "heading", "body", "summary", "first_seen", "last_seen", "content_hash")
+ARCHIVE_SCHEMA_VERSION = 2   # 2: key を内容ハッシュから同一性（item_identity）に変更、content_hash を追加
+_UPDATABLE = ("municipality", "category", "heading", "body", "summary", "content_hash")   # 内容が変わったときに上書きする列
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS police_items (
+    key TEXT PRIMARY KEY,
+    day TEXT NOT NULL,
+    date TEXT,
+    municipality TEXT,
+    station TEXT,
+    category TEXT,
+    heading TEXT,
+    body TEXT,
+    summary TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_police_day ON police_items(day);
+CREATE INDEX IF NOT EXISTS ix_police_muni_day ON police_items(municipality, day);
+CREATE INDEX IF NOT EXISTS ix_police_station_day ON police_items(station, day);
+CREATE INDEX IF NOT EXISTS ix_police_category_day ON police_items(category, day);
+"""
+
+
+def _day_of(item: Dict, seen_at: float) -> str:
+    return item.get("date") or datetime.fromtimestamp(seen_at, JST).date().isoformat()
+
+
+def item_identity(heading: Optional[str], date: Optional[str], station: Optional[str], n: int = 0) -> str:
+    # 事案の同一性: 正規化した見出し＋発生日＋署（n = 同じページで同じ組が何件目か）。本文の訂正では変わらない
+    head = "".join(normalize_search_text(heading or "").replace("■", "").split())
+    return hashlib.sha1(f"{head}\n{date or ''}\n{station or ''}\n{int(n)}".encode("utf-8")).hexdigest()[:16]
+
+
+def _iso(d) -> Optional[str]:
+    if d is None: return None
+    return d.isoformat() if isinstance(d, (datetime, date_cls)) else str(d)
+
+
+# ---------------------------
+# 文字バイグラム転置索引
+# ---------------------------
+
+QUERY_OR_TOKENS = ("or", "|")   # 正規化後（OR/Or/｜ も含む）
+
+
+def normalize_search_text(s: str) -> str:
+    # 全角英数/半角カナ等を NFKC で揃え、英字は小文字化（索引・クエリ共通）
+    return unicodedata.normalize("NFKC", s or "").lower()
+
+
+def parse_search_query(q: str) -> List[List[str]]:
+    # 「窃盗 今治 OR 詐欺」→ [["窃盗","今治"], ["詐欺"]]（空白区切り = AND、OR/| でグループ区切り）
+    groups: List[List[str]] = [[]]
+    for tok in normalize_search_text(q).split():
+        if tok in QUERY_OR_TOKENS: groups.append([])
+        else: groups[-1].append(tok)
+    return [g for g in groups if g]
+
+
+def highlight_terms(text: str, terms: Iterable[str], before: str = "<mark>", after: str = "</mark>") -> str:
+    # 正規化後の文字列で一致位置を探し、元の文字列の区間に印を付ける（1文字ずつ正規化して位置を対応付け）
+    terms = [t for t in terms if t]
+    if not text or not terms: return text or ""
+    norm, owner = [], []
+    for i, c in enumerate(text):
+        for nc in normalize_search_text(c): norm.append(nc); owner.append(i)
+    norm = "".join(norm)
+    marked = [False] * len(text)
+    for t in terms:
+        j = norm.find(t)
+        while j >= 0:
+            for k in range(j, j + len(t)): marked[owner[k]] = True
+            j = norm.find(t, j + 1)
+    out, inside = [], False
+    for c, mk in zip(text, marked):
+        if mk != inside: out.append(before if mk else after); inside = mk
+        out.append(c)
+    if inside: out.append(after)
+    return "".join(out)
+
+
+def _mask_of(docs: Iterable[int]) -> int:
+    docs = list(docs)
+    if not docs: return 0
+    buf = bytearray(max(docs) // 8 + 1)
+    for d in docs: buf[d >> 3] |= 1 << (d & 7)
+    return int.from_bytes(buf, "little")
+
+
+def _grams(norm: str) -> set:
+    return {g for g in set(norm) | {norm[i:i+2] for i in range(len(norm) - 1)} if not g.isspace()}
+
+
+def _docs_of(mask: int) -> List[int]:
+    s = bin(mask)[:1:-1]; out = []; i = s.find("1")
+    while i >= 0: out.append(i); i = s.find("1", i + 1)
+    return out
+
+
+class BigramIndex:
+    # 文書 = 事案（見出し＋本文）。文書番号は追加順の連番
+    #  ・posting は 1文字/2文字 → 文書集合のビット列（Python int）。AND/OR はビット演算、件数は bit_count
+    #  ・2文字以下の語は posting そのものが答え、3文字以上はバイグラムの積で候補を絞って部分一致で確認
+    #    （確認済みの結果は語ごとに保持し、次回は追加された文書だけ確認）
+    #  ・カテゴリ/日付も同じビット列で持ち、期間の絞り込みとカテゴリ別件数（ファセット）を集合演算で求める
+    TERM_CACHE_SIZE = 256
+
+    def __init__(self):
+        self._postings: Dict[str, int] = {}
+        self._cat_mask: Dict[str, int] = {}
+        self._day_mask: Dict[str, int] = {}
+        self._ids: Dict[str, int] = {}
+        self._terms: Dict[str, Tuple[int, int]] = {}   # 語 → (確認済み文書数, 一致ビット列)
+        self._period: Tuple = (None, None, -1, 0)       # 直近の期間ビット列 (start, end, 文書数, ビット列)
+        self.keys: List[str] = []
+        self._text: List[str] = []
+        self.category: List[str] = []
+        self.day: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def doc_id(self, key: str) -> Optional[int]:
+        return self._ids.get(key)
+
+    def add_many(self, docs: Iterable[Tuple[str, str, Optional[str], str]]) -> int:
+        # docs: (key, 本文, カテゴリ, day)。既知の key は無視。戻り値 = 追加件数
+        grams: Dict[str, List[int]] = defaultdict(list)
+        cats: Dict[str, List[int]] = defaultdict(list); days: Dict[str, List[int]] = defaultdict(list)
+        n0 = len(self.keys)
+        for key, text, category, day in docs:
+            if key in self._ids: continue
+            doc = len(self.keys); category = category or "その他"
+            self._ids[key] = doc; self.keys.append(key); self.category.append(category); self.day.append(day)
+            norm = normalize_search_text(text); self._text.append(norm)
+            for g in _grams(norm): grams[g].append(doc)
+            cats[category].append(doc); days[day].append(doc)
+        for table, pending in ((self._postings, grams), (self._cat_mask, cats), (self._day_mask, days)):
+            for k, ds in pending.items(): table[k] = table.get(k, 0) | _mask_of(ds)
+        return len(self.keys) - n0
+
+    def add(self, key: str, text: str, category: Optional[str], day: str) -> bool:
+        return self.add_many([(key, text, category, day)]) == 1
+
+    def replace(self, key: str, text: str, category: Optional[str], day: str):
+        # 内容が変わった文書を同じ文書番号のまま入れ替える（旧本文の posting からビットを外して付け直す）
+        doc = self._ids.get(key)
+        if doc is None: self.add(key, text, category, day); return
+        bit = 1 << doc; category = category or "その他"; norm = normalize_search_text(text)
+        for table, old, new in ((self._postings, _grams(self._text[doc]), _grams(norm)),
+                                (self._cat_mask, {self.category[doc]}, {category}), (self._day_mask, {self.day[doc]}, {day})):
+            for k in old - new:
+                m = table.get(k, 0) & ~bit
+                if m: table[k] = m
+                else: table.pop(k, None)
+            for k in new - old: table[k] = table.get(k, 0) | bit
+        self._text[doc], self.category[doc], self.day[doc] = norm, category, day
+        self._terms.clear(); self._period = (None, None, -1, 0)   # 確認済みの語・期間の結果はこの文書の分が古い
+
+    def match_term(self, term: str) -> int:
+        if len(term) <= 2: return self._postings.get(term, 0)
+        n = len(self.keys)
+        done, mask = self._terms.pop(term, (0, 0))
+        if done < n:
+            grams = sorted({term[i:i+2] for i in range(len(term) - 1)}, key=lambda g: self._postings.get(g, 0).bit_count())
+            cand = self._postings.get(grams[0], 0) >> done << done
+            for g in grams[1:]:
+                if not cand: break
+                cand &= self._postings.get(g, 0)
+            mask |= _mask_of(d for d in _docs_of(cand) if term in self._text[d])
+        self._terms[term] = (n, mask)
+        if len(self._terms) > self.TERM_CACHE_SIZE: self._terms.pop(next(iter(self._terms)))
+        return mask
+
+    def match(self, query: str) -> Optional[int]:
+        # None = 条件なし（全件）
+        groups = parse_search_query(query or "")
+        if not groups: return None
+        hits = 0
+        for terms in groups:
+            acc = -1
+            for t in sorted(terms, key=len):
+                acc &= self.match_term(t)
+                if not acc: break
+            hits |= acc
+        return hits
+
+    def period_mask(self, start: Optional[str] = None, end: Optional[str] = None) -> int:
+        if self._period[:3] == (start, end, len(self.keys)): return self._period[3]
+        lo, hi = start or "", end or "\uffff"
+        mask = 0
+        for day, m in self._day_mask.items():
+            if lo <= day <= hi: mask |= m
+        self._period = (start, end, len(self.keys), mask)
+        return mask
+
+    def keys_mask(self, keys: Iterable[str]) -> int:
+        return _mask_of(self._ids[k] for k in keys if k in self._ids)
+
+    def search_mask(self, query: str = "", start: Optional[str] = None, end: Optional[str] = None,
+                    keys: Optional[Iterable[str]] = None) -> int:
+        mask = self.match(query)
+        if mask is None: mask = (1 << len(self.keys)) - 1
+        if start or end: mask &= self.period_mask(start, end)
+        if keys is not None: mask &= self.keys_mask(keys)
+        return mask
+
+    def facets(self, mask: int) -> Dict[str, int]:
+        out = {c: (mask & m).bit_count() for c, m in self._cat_mask.items()}
+        return {c: n for c, n in out.items() if n}
+
+    def category_mask(self, categories: Iterable[str]) -> int:
+        mask = 0
+        for c in categories: mask |= self._cat_mask.get(c, 0)
+        return mask
+
+    def ordered(self, mask: int) -> List[int]:
+        # 新しい順（day 降順、同日は追加の新しい順）
+        return sorted(_docs_of(mask), key=lambda d: (self.day[d], d), reverse=True)
+
+
+class PoliceArchive:
+    def __init__(self, path: str, index: bool = True):
+        # index=False: キーワード検索（search / index_items）を使わない用途（件数の集計だけ等）。起動時の索引構築を省く
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = self._open(path)
+        except (OSError, sqlite3.Error):
+            self.path = ":memory:"; self._conn = self._open(":memory:")
+        self.index = BigramIndex() if index else None
+        self._hashes: Dict[str, Optional[str]] = {}   # 索引に入っている key → 内容ハッシュ
+        if self.index is not None: self._index_docs((r["key"], f"{r['heading'] or ''}\n{r['body'] or ''}", r["category"], r["day"], r["content_hash"]) for r in
+                         self._conn.execute("SELECT key, heading, body, category, day, content_hash FROM police_items ORDER BY first_seen, rowid"))
+
+    @staticmethod
+    def _open(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        if path != ":memory:": conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        if conn.execute("PRAGMA user_version").fetchone()[0] < ARCHIVE_SCHEMA_VERSION:
+            with conn: PoliceArchive._migrate(conn)
+        return conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        # 版1（key = 事案ブロックのハッシュ）→ 版2: key を item_identity に付け替え（同じ組は初回取得順に n = 0, 1, …）
+        #  ※ 版1で訂正により二重になった行は本当に同じ組の別事案と区別できないため、そのまま残る
+        if "content_hash" not in {r[1] for r in conn.execute("PRAGMA table_info(police_items)")}:
+            conn.execute("ALTER TABLE police_items ADD COLUMN content_hash TEXT")
+        seen: Dict[tuple, int] = defaultdict(int); moves = []
+        for rowid, heading, date, station in conn.execute(
+                "SELECT rowid, heading, date, station FROM police_items WHERE content_hash IS NULL ORDER BY first_seen, rowid"):
+            ident = (heading, date, station); n = seen[ident]; seen[ident] += 1
+            moves.append((item_identity(heading, date, station, n), rowid))
+        conn.executemany("UPDATE police_items SET key = ? WHERE rowid = ?", moves)
+        conn.execute(f"PRAGMA user_version = {ARCHIVE_SCHEMA_VERSION}")
+
+    def upsert(self, items: Iterable[Dict], seen_at: Optional[float] = None,
+               first_seen: Optional[Dict[str, float]] = None) -> int:
+        # 既存の key は last_seen を更新し、本文等も最新の内容で上書き（first_seen は保持）。戻り値 = 新規に追加した件数
+        now = time.time() if seen_at is None else float(seen_at)
+        first_seen = first_seen or {}
+        rows = []
+        for it in items:
+            key = it.get("key")
+            if not key: continue
+            fs = float(first_seen.get(key, now))
+            rows.append((key, _day_of(it, fs), it.get("date"), it.get("municipality"), it.get("station"),
+                         it.get("category"), it.get("heading"), it.get("body"), it.get("summary"), fs, now, it.get("hash")))
+        if not rows: return 0
+        with self._lock, self._conn:
+            keys = [r[0] for r in rows]
+            known = {k: (h, d) for k, h, d in self._conn.execute(
+                f"SELECT key, content_hash, day FROM police_items WHERE key IN ({','.join('?' * len(keys))})", keys)}
+            self._conn.executemany(
+                f"INSERT INTO police_items ({','.join(ARCHIVE_COLUMNS)}) VALUES ({','.join('?' * len(ARCHIVE_COLUMNS))}) "
+                "ON CONFLICT(key) DO UPDATE SET last_seen = max(police_items.last_seen, excluded.last_seen), "
+                + ", ".join(f"{c} = excluded.{c}" for c in _UPDATABLE), rows)
+            self._index_docs((r[0], f"{r[6] or ''}\n{r[7] or ''}", r[5], known[r[0]][1] if r[0] in known else r[1], r[11]) for r in rows)
+        return len(set(keys) - set(known))
+
+    def _index_docs(self, docs: Iterable[Tuple[str, str, Optional[str], str, Optional[str]]]):
+        # docs: (key, 本文, カテゴリ, day, 内容ハッシュ)。SQLite 側の新旧ではなく索引の状態で判断する
+        #  （他プロセスが先に蓄積した事案・蓄積に失敗した事案も索引に入る）
+        if self.index is None: return
+        new = []
+        for key, text, category, day, h in docs:
+            doc = self.index.doc_id(key)
+            if doc is None: new.append((key, text, category, day)); self._hashes[key] = h
+            elif h is not None and self._hashes.get(key) != h:   # 訂正された事案（day は索引側のまま）
+                self.index.replace(key, text, category, self.index.day[doc]); self._hashes[key] = h
+        self.index.add_many(new)
+
+    def index_items(self, items: Iterable[Dict], seen_at: Optional[float] = None):
+        # 蓄積せずに索引だけ更新（現在ページの絞り込み用）
+        now = time.time() if seen_at is None else float(seen_at)
+        with self._lock:
+            self._index_docs((it["key"], f"{it.get('heading') or ''}\n{it.get('body') or ''}", it.get("category"),
+                              _day_of(it, now), it.get("hash")) for it in items if it.get("key"))
+
+    def first_seen_of(self, keys: Iterable[str]) -> Dict[str, float]:
+        # 蓄積済みの key → 初回取得時刻（未蓄積の key は含まない）
+        keys = list(keys); out: Dict[str, float] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                out.update((r[0], float(r[1])) for r in self._conn.execute(
+                    f"SELECT key, first_seen FROM police_items WHERE key IN ({','.join('?' * len(chunk))})", chunk))
+        return out
+
+    @staticmethod
+    def _where(start=None, end=None, municipalities: Optional[Sequence[str]] = None,
+               stations: Optional[Sequence[str]] = None, categories: Optional[Sequence[str]] = None,
+               text: Optional[str] = None):
+        conds, args = [], []
+        if start is not None: conds.append("day >= ?"); args.append(_iso(start))
+        if end is not None: conds.append("day <= ?"); args.append(_iso(end))
+        for col, vals in (("municipality", municipalities), ("station", stations), ("category", categories)):
+            if vals is None: continue
+            vals = list(vals)
+            if not vals: conds.append("0"); continue
+            conds.append(f"{col} IN ({','.join('?' * len(vals))})"); args += vals
+        if text:
+            conds.append("instr(coalesce(heading,'') || ' ' || coalesce(body,''), ?) > 0"); args.append(text)
+        return (" WHERE " + " AND ".join(conds)) if conds else "", args
+
+    def query(self, start=None, end=None, municipalities=None, stations=None, categories=None,
+              text: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        # start/end は day（YYYY-MM-DD, 両端含む）。新しい順
+        where, args = self._where(start, end, municipalities, stations, categories, text)
+        sql = f"SELECT * FROM police_items{where} ORDER BY day DESC, first_seen DESC"
+        if limit: sql += " LIMIT ?"; args.append(int(limit))
+        with self._lock: rows = self._conn.execute(sql, args).fetchall()
+        return [dict(r) for r in rows]
+
+    def search(self, query: str = "", start=None, end=None, categories: Optional[Sequence[str]] = None,
+               keys: Optional[Iterable[str]] = None, limit: Optional[int] = 500,
+               rows: bool = True) -> Tuple[List, Dict[str, int], int]:
+        # 索引でキーワード/期間/キー集合を絞り込み → (行[新しい順, limit 件まで・None で全件], カテゴリ別件数, カテゴリ絞り込み後の総件数)
+        # ファセットはカテゴリ指定前の件数（選択肢ごとの該当数として表示するため）。keys 指定時は keys の順に並べる
+        # rows=False なら行の代わりに該当 key を返す（SQLite は読まない）
+        if self.index is None: raise RuntimeError("PoliceArchive(index=False) では search を使えません")
+        keys = list(keys) if keys is not None else None
+        with self._lock:
+            mask = self.index.search_mask(query, _iso(start), _iso(end), keys)
+            facets = self.index.facets(mask)
+            if categories is not None: mask &= self.index.category_mask(categories)
+            total = mask.bit_count()
+            if limit == 0: return [], facets, total
+            if keys is None: pick = [self.index.keys[d] for d in self.index.ordered(mask)]
+            else: pick = [k for k in keys if self.index.doc_id(k) is not None and mask >> self.index.doc_id(k) & 1]
+            if limit is not None: pick = pick[:limit]
+            if not rows: return pick, facets, total
+            found = {}
+            for i in range(0, len(pick), 500):
+                chunk = pick[i:i+500]
+                for r in self._conn.execute(f"SELECT * FROM police_items WHERE key IN ({','.join('?' * len(chunk))})", chunk):
+                    found[r["key"]] = dict(r)
+        return [found[k] for k in pick if k in found], facets, total
+
+    def count_by(self, column: str, start=None, end=None, **filters) -> Dict[str, int]:
+        if column not in ("municipality", "station", "category", "day"): raise ValueError(column)
+        where, args = self._where(start, end, **filters)
+        sql = f"SELECT {column}, COUNT(*) FROM police_items{where} GROUP BY {column}"
+        with self._lock: rows = self._conn.execute(sql, args).fetchall()
+        return {r[0]: int(r[1]) for r in rows if r[0] is not None}
+
+    def muni_counts(self, days: int, until: Optional[date_cls] = None) -> Dict[str, int]:
+        # 直近 days 日（until を含む）の市町別件数
+        until = until or datetime.now(JST).date()
+        return self.count_by("municipality", start=until - timedelta(days=int(days) - 1), end=until)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            n, lo, hi = self._conn.execute("SELECT COUNT(*), MIN(day), MAX(day) FROM police_items").fetchone()
+        return {"items": int(n), "first_day": lo, "last_day": hi, "path": self.path}
+
+    def close(self):
+        with self._lock: self._conn.close()
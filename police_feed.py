@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# 県警速報（事件事故速報ページ）の取得と解析
+#  ・ページを1回の走査で「事案アイテム」「市町の出現回数」「カテゴリ」に分解（共通の多パターン照合器）
+#  ・PoliceFeed: 条件付きGETの増分取り込み。変化した事案ブロックだけを解析し、PoliceArchive に蓄積
+#  ・Streamlit / numpy / pandas に依存しない（app.py はインスタンスを st.cache_resource で保持、sibyl_batch.py は1回だけ取得）
+# ============================================================
+
+import os, re, time, hashlib, threading
+from collections import Counter
+from datetime import datetime
+from typing import Optional, List, Dict
+
+from police_archive import PoliceArchive, item_identity
+from municipalities import JST, CITY_NAMES
+from http_client import USER_AGENT, http_get
+import perf
+
+EHIME_POLICE_URL = "https://www.police.pref.ehime.jp/sokuho/sokuho.htm"   # 出典リンク
+POLICE_FEED_URL = os.environ.get("ESP_POLICE_FEED_URL", EHIME_POLICE_URL)  # 取得先（検証用のローカル代替も可）
+POLICE_POLL_INTERVAL_S = 120   # 条件付きGET（変化なしなら 304）なので短めの間隔でも県警サーバの負担は小さい
+POLICE_ARCHIVE_PATH = os.environ.get("ESP_POLICE_ARCHIVE_PATH", "/mnt/data/police_archive.sqlite3")
+
+# ---------------------------
+# 解析（最新記事 → 市町出現回数＆アイテム抽出）
+# ---------------------------
+
+class KeywordMatcher:
+    # 語彙を1本のコンパイル済み正規表現（長い語優先の選択）に束ねた多パターン照合器。各行を1回だけ C 側で走査
+    # 長い語に含まれる短い語（人身事故⊃事故、窃盗⊃盗 など）は expand() で補う
+    # ※ 語彙どうしの「部分的な重なり」（語末＝別語の語頭）は拾えないため、語彙追加時は注意
+    def __init__(self, words: List[str]):
+        self.words = sorted(set(words), key=len, reverse=True)
+        self._re = re.compile("|".join(map(re.escape, self.words)))
+        self._implied = {w: frozenset(v for v in self.words if v in w) for w in self.words}
+        self.findall = self._re.findall
+
+    def expand(self, matched) -> set:
+        out = set()
+        for w in set(matched): out |= self._implied[w]
+        return out
+
+
+# カテゴリ判定（先に一致した規則を採用）: (名前, いずれかを含めば該当, 順序付きペア a…b)
+POLICE_CATEGORY_RULES = (
+    ("交通事故", ("自転車", "二輪", "乗用", "衝突", "交差点", "人身事故", "バス"), ("交通", "事故")),
+    ("火災", ("火災", "出火", "全焼", "半焼", "延焼"), None),
+    ("死亡事案", ("死亡事案", "死亡が確認"), None),
+    ("窃盗", ("窃盗", "万引", "盗"), None),
+    ("詐欺", ("詐欺", "還付金", "投資詐欺", "特殊詐欺"), None),
+    ("事件", ("威力業務妨害", "条例違反", "暴行", "傷害", "脅迫", "器物損壊", "青少年保護"), None),
+)
+POLICE_MATCHER = KeywordMatcher(CITY_NAMES + [w for _, ws, pair in POLICE_CATEGORY_RULES for w in ws + (pair or ())])
+_PAIR_RES = {pair: re.compile(re.escape(pair[0]) + ".*" + re.escape(pair[1])) for _, _, pair in POLICE_CATEGORY_RULES if pair}
+_TAG_RE = re.compile(r"<[^>]+>")
+_HEAD_DATE_RE = re.compile(r"（?(\d{1,2})月(\d{1,2})日")
+_HEAD_STATION_RE = re.compile(r"（\d{1,2}月\d{1,2}日\s*([^\s）]+)）")
+_WS_RE = re.compile(r"\s+")
+
+
+def _shorten(s: str, n: int = 120) -> str:
+    s = _WS_RE.sub(" ", s).strip()
+    return s if len(s) <= n else s[:n] + "…"
+
+
+def _police_category(found: set, alltext: str) -> str:
+    for name, words, pair in POLICE_CATEGORY_RULES:
+        if found.intersection(words): return name
+        # 順序付きペアは両語が含まれるときだけ位置関係を確認
+        if pair and pair[0] in found and pair[1] in found and _PAIR_RES[pair].search(alltext): return name
+    return "その他"
+
+
+def _build_police_item(lines: List[str], words: List[str], today) -> Dict:
+    heading = lines[0]
+    body = " ".join(lines[1:]).strip()
+    # （10月16日 今治署）などから日付/署
+    m_date = _HEAD_DATE_RE.search(heading)
+    incident_date = None
+    if m_date:
+        m, d = int(m_date.group(1)), int(m_date.group(2)); y = today.year
+        try:
+            d0 = datetime(y, m, d).date()
+            if d0 > today: y -= 1
+            incident_date = datetime(y, m, d).date().isoformat()
+        except Exception:
+            incident_date = None
+    m_station = _HEAD_STATION_RE.search(heading)
+    station = m_station.group(1) if m_station else None
+
+    # 市町の推定（見出し+本文、CITY_NAMES の順で最初に出現したもの）
+    found = POLICE_MATCHER.expand(words)
+    muni = next((c for c in CITY_NAMES if c in found), None)
+
+    # 要約は原文短縮（憶測なし）
+    return {
+        "heading": heading.replace("■", "").strip(),
+        "body": body,
+        "summary": _shorten(body) if body else _shorten(heading, 80),
+        "municipality": muni,
+        "station": station,
+        "category": _police_category(found, heading + " " + body),
+        "date": incident_date,
+    }
+
+
+def parse_police_page(html: str, known: Optional[Dict[str, Dict]] = None) -> Dict:
+    # タグ除去→行分割を1回だけ行い、同じ走査で「事案アイテム」「市町の出現回数」「カテゴリ」を得る
+    # 事案ブロックは内容のハッシュ（hash）で解析結果を使い回し（known = 前回の blocks。照合・抽出を省略）
+    # 事案の key は見出し＋発生日＋署の同一性（item_identity）。本文が訂正されても key は変わらない
+    text = _TAG_RE.sub("\n", html).replace("\u3000", " ").replace("\r", " ")
+    matched_all: List[str] = []
+    raw_blocks: List[List[str]] = []
+    for ln in filter(None, map(str.strip, text.split("\n"))):
+        # 見出しは「■」で始まる行を採用
+        if ln.startswith("■"): raw_blocks.append([ln])
+        elif raw_blocks: raw_blocks[-1].append(ln)
+        else: matched_all += POLICE_MATCHER.findall(ln)
+
+    known = known or {}
+    blocks: Dict[str, Dict] = {}
+    keys: List[str] = []; items: List[Dict] = []
+    same: Counter = Counter()   # 同じ見出し・日付・署の組がページ内で何件目か
+    today = datetime.now(JST).date()
+    for lines in raw_blocks:
+        h = hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()[:16]
+        blk = known.get(h) or blocks.get(h)
+        if blk is None:
+            words = [w for ln in lines for w in POLICE_MATCHER.findall(ln)]
+            blk = {"item": _build_police_item(lines, words, today), "words": words}
+        blocks[h] = blk
+        it = blk["item"]; ident = (it["heading"], it["date"], it["station"])
+        key = item_identity(*ident, same[ident]); same[ident] += 1
+        keys.append(key); items.append({**it, "key": key, "hash": h})
+        matched_all += blk["words"]
+
+    # 市町の出現回数（市町名は他の語に含まれないため、一致した語をそのまま数える）
+    tally = Counter(matched_all)
+    counts = {c: tally.get(c, 0) for c in CITY_NAMES}
+    mx = max(counts.values()) if counts else 0
+    if mx > 0:
+        for k,v in counts.items():
+            counts[k] = int(min(v, max(1, mx)))
+    return {"items": items, "muni_counts": counts, "blocks": blocks, "keys": keys}
+
+
+def parse_police_items(html: str) -> List[Dict]:
+    return parse_police_page(html)["items"]
+
+
+class PoliceFeed:
+    # 県警速報の増分取り込み（プロセス共通）
+    #  ・POLICE_POLL_INTERVAL_S ごとに If-None-Match / If-Modified-Since 付きで取得。304 や本文ハッシュ不変なら解析しない
+    #  ・変化があれば、新規/変更された事案ブロックだけを解析（既知ブロックは再利用）
+    #  ・new_keys = 直近で内容が変わったポーリングで新たに現れた事案
+    #    起動直後の1回目は first_seen を蓄積から引き継ぎ、蓄積に無い事案だけを新着とする（蓄積が空/無しなら新着なし）
+    #  ・archive があれば、内容が変わるたびにページ上の事案を蓄積（既知の key は last_seen と訂正された内容を更新）
+    def __init__(self, url: str = POLICE_FEED_URL, interval_s: float = POLICE_POLL_INTERVAL_S,
+                 archive: Optional[PoliceArchive] = None):
+        self.url, self.interval_s, self.archive = url, float(interval_s), archive
+        self._lock = threading.Lock()
+        self.etag: Optional[str] = None; self.last_modified: Optional[str] = None; self.body_hash: Optional[str] = None
+        self.page: Optional[Dict] = None
+        self.first_seen: Dict[str, float] = {}
+        self.new_keys: List[str] = []
+        self.last_poll = 0.0; self.last_change = 0.0
+        self.polls = self.not_modified = self.errors = 0   # errors: 取得失敗（通信/ブレーカ/HTTP エラー）の回数
+
+    def poll(self, force: bool = False) -> Dict:
+        with self._lock:
+            if self.page is not None and not force and time.monotonic() - self.last_poll < self.interval_s:
+                return self.page
+            headers = {"User-Agent": USER_AGENT}
+            if self.etag: headers["If-None-Match"] = self.etag
+            if self.last_modified: headers["If-Modified-Since"] = self.last_modified
+            try:
+                r = http_get("police", self.url, headers=headers)
+                self.polls += 1
+                if r.status_code == 304 and self.page is not None:
+                    self.not_modified += 1; self.last_poll = time.monotonic(); return self.page
+                r.raise_for_status()
+            except Exception:
+                # 失敗も1回の取得として間隔を空ける（失敗中の再実行ごとに取りに行かない）
+                self.errors += 1; self.last_poll = time.monotonic()
+                if self.page is not None: return self.page   # 取得失敗時は前回の内容を維持
+                raise
+            self.last_poll = time.monotonic()
+            self.etag = r.headers.get("ETag") or self.etag
+            self.last_modified = r.headers.get("Last-Modified") or self.last_modified
+            body_hash = hashlib.sha1(r.content).hexdigest()
+            if self.page is not None and body_hash == self.body_hash:
+                self.not_modified += 1; return self.page
+            r.encoding = r.apparent_encoding or r.encoding or "utf-8"
+            with perf.span("police.parse"): page = parse_police_page(r.text, self.page["blocks"] if self.page else None)
+            now = time.time()
+            first, archived = self.page is None, False
+            if first and self.archive is not None:
+                try:
+                    self.first_seen.update(self.archive.first_seen_of(page["keys"]))
+                    archived = self.archive.stats()["items"] > 0
+                except Exception: pass
+            new_keys = [k for k in page["keys"] if k not in self.first_seen]
+            for k in new_keys: self.first_seen[k] = now
+            self.new_keys = new_keys if not first or archived else []   # 再起動で全件が新着にならないように
+            self.first_seen = {k: self.first_seen[k] for k in page["keys"]}
+            self.page, self.body_hash, self.last_change = page, body_hash, now
+            if self.archive is not None:
+                try:
+                    with perf.span("police.archive"): self.archive.upsert(page["items"], now, self.first_seen)
+                except Exception: pass   # 蓄積の失敗で速報表示は止めない
+            return page
+
+    def stats(self) -> Dict:
+        return {"polls": self.polls, "not_modified": self.not_modified, "errors": self.errors, "items": len(self.page["keys"]) if self.page else 0,
+                "new": len(self.new_keys), "last_change": self.last_change}
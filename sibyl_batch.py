@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# SIBYL 犯罪係数（CC）の一括計算・書き出し（ブラウザ/Streamlit なし。cron 等から実行）
+#  ・全市町（CITY_NAMES の代表点）× 時刻列の CC を sibyl_core の一括版で計算
+#    （compute_risk_score と同じ規則の compute_risk_scores_batch → compute_cc_batch）
+#  ・速報件数: archive = 蓄積DBの「各時刻の日付までの直近N日」/ page = 現在ページの出現回数 / none = 0
+#  ・気象: forecast = 時間別予報を補間 / current = 現在の天気を全時刻に / default = 既定値（通信なし）
+#  ・時刻列をワーカー数に分けてプロセスプールで並列計算（小さい表は逐次）
+#  ・出力は拡張子（または --format）で CSV / Parquet（要 pyarrow）/ JSON。一時ファイル経由で置き換え
+#  python sibyl_batch.py --hours 24 --out /var/lib/esp/cc_latest.parquet
+#  python sibyl_batch.py --start 2025-07-01 --end 2025-08-01 --step-hours 3 --weather default --out cc.csv
+# ============================================================
+
+import argparse, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from crime_data import load_all_crime_2019, build_historical_profile, HistoricalProfile
+from police_archive import PoliceArchive
+from police_feed import POLICE_ARCHIVE_PATH, POLICE_FEED_URL, PoliceFeed
+from municipalities import JST, CITY_NAMES
+from sibyl_core import DATA_GLOBS, default_points, weather_for_times, compute_cc_table, decode_risk_reasons
+import perf
+
+PARALLEL_MIN_ROWS = 1_000_000   # 自動モード: 行数（市町 × 時刻）がこれ未満なら逐次（逐次でも 100万行 ≈ 1.5s。プール起動と受け渡しの方が高くつく）
+OUTPUT_FORMATS = ("csv", "parquet", "json")
+OUTPUT_COLUMNS = ["time", "municipality", "lat", "lon", "cc", "score", "level", "recent",
+                  "temp_c", "humidity", "precip_mm", "moon_age", "reasons"]
+
+# ---------------------------
+# 入力（時刻列・件数・気象・2019傾向）
+# ---------------------------
+
+def parse_time(s: Optional[str]) -> pd.Timestamp:
+    # 省略時は現在の正時。タイムゾーン無しは JST とみなす
+    if not s: return pd.Timestamp(datetime.now(JST)).floor("h")
+    t = pd.Timestamp(s)
+    return t.tz_localize(JST) if t.tz is None else t.tz_convert(JST)
+
+
+def build_times(start: pd.Timestamp, end: Optional[pd.Timestamp], hours: int, step_hours: int) -> pd.DatetimeIndex:
+    # [start, end)。end 省略時は start から hours 時間
+    end = end if end is not None else start + pd.Timedelta(hours=hours)
+    return pd.date_range(start, end, freq=f"{int(step_hours)}h", inclusive="left")
+
+
+def load_history(globs: List[str]) -> Optional[HistoricalProfile]:
+    df = load_all_crime_2019(globs)
+    return build_historical_profile(df) if df is not None else None
+
+
+def muni_counts_for_times(mode: str, times: pd.DatetimeIndex, window_days: int, archive_path: str,
+                          feed_url: str = POLICE_FEED_URL, poll: bool = False) -> Dict[str, object]:
+    # 市町 → 件数（スカラー、または times と同じ長さの配列）
+    if mode == "none": return {}
+    archive = PoliceArchive(archive_path, index=False) if mode == "archive" or poll else None   # 件数の集計だけなので索引は作らない
+    if archive is not None and archive.path == ":memory:":
+        archive.close(); raise SystemExit(f"蓄積DBを開けません: {archive_path}")
+    try:
+        if mode == "page" or poll:
+            try: page = PoliceFeed(feed_url, archive=archive).poll(force=True)
+            except Exception as e:   # 通信失敗・ブレーカ開。archive なら蓄積済みの分で続ける
+                if mode == "page": raise SystemExit(f"県警速報を取得できません: {e}")
+                print(f"警告: 県警速報を取得できません（蓄積済みの件数で続行）: {e}", file=sys.stderr)
+            else:
+                if mode == "page": return dict(page["muni_counts"])
+        days = pd.Index(times.tz_convert(JST).date); uniq = days.unique()   # 蓄積DBは日単位なので日付ごとに1回だけ集計
+        per_day = [archive.muni_counts(window_days, until=d) for d in uniq]
+        inv = uniq.get_indexer(days)
+        return {m: np.array([c.get(m, 0) for c in per_day], dtype=np.int64)[inv] for m in CITY_NAMES}
+    finally:
+        if archive is not None: archive.close()
+
+# ---------------------------
+# 計算（時刻列を分割してプロセスプールで）
+# ---------------------------
+
+def _slice(v, sl: slice):
+    return v[sl] if isinstance(v, np.ndarray) and v.ndim else v
+
+
+def _cc_chunk(times: pd.DatetimeIndex, counts: Dict[str, object], history: Optional[HistoricalProfile],
+              weather: Dict[str, dict], reasons_text: bool) -> pd.DataFrame:
+    # プールのワーカー（このモジュールから import されるので Streamlit/Folium は読み込まない）
+    out = compute_cc_table(times, counts, history, weather, default_points())
+    if reasons_text and not out.empty:
+        codes, inv = np.unique(out["reasons"].to_numpy(), return_inverse=True)
+        out["reasons"] = np.array(["、".join(decode_risk_reasons(c)) for c in codes], dtype=object)[inv]
+    return out
+
+
+def compute_range(times: pd.DatetimeIndex, counts: Dict[str, object], history: Optional[HistoricalProfile],
+                  weather: Dict[str, dict], workers: Optional[int] = None, reasons_text: bool = True) -> pd.DataFrame:
+    # workers: None=自動 / 1=逐次 / 2以上=プロセス数。結果は 時刻 → 市町（CITY_NAMES 順）の並び
+    n = len(times)
+    if workers is None: workers = (os.cpu_count() or 1) if n * len(CITY_NAMES) >= PARALLEL_MIN_ROWS else 1
+    workers = max(1, min(int(workers), n))
+    bounds = np.linspace(0, n, workers + 1).astype(int)
+    jobs = []
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        sl = slice(int(a), int(b))
+        jobs.append((times[sl], {m: _slice(v, sl) for m, v in counts.items()},
+                     history, {m: {k: _slice(v, sl) for k, v in wx.items()} for m, wx in weather.items()}, reasons_text))
+    parts = None
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                parts = list(ex.map(_cc_chunk, *zip(*jobs)))
+        except Exception:
+            parts = None   # プールが使えない環境（セマフォ不可等）は逐次にフォールバック
+    if parts is None: parts = [_cc_chunk(*j) for j in jobs]
+    parts = [p for p in parts if not p.empty]
+    if not parts: return pd.DataFrame(columns=OUTPUT_COLUMNS)
+    out = pd.concat(parts, ignore_index=True).sort_values("time", kind="stable", ignore_index=True)
+    return out[OUTPUT_COLUMNS]
+
+# ---------------------------
+# 書き出し
+# ---------------------------
+
+def output_format(path: str, fmt: Optional[str]) -> str:
+    if fmt: return fmt
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    return ext if ext in OUTPUT_FORMATS else "csv"
+
+
+def write_table(df: pd.DataFrame, path: str, fmt: str):
+    # CSV/JSON の時刻は ISO 8601（+09:00）、Parquet は tz 付きタイムスタンプのまま
+    if fmt != "parquet":
+        df = df.assign(time=df["time"].dt.strftime("%Y-%m-%dT%H:%M:%S+09:00"))
+    if path == "-":
+        if fmt == "parquet": raise SystemExit("Parquet は標準出力に書けません（--out にファイルを指定）")
+        if fmt == "csv": df.to_csv(sys.stdout, index=False)
+        else: sys.stdout.write(df.to_json(orient="records", force_ascii=False) + "\n")
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    try:
+        if fmt == "csv": df.to_csv(tmp, index=False, encoding="utf-8")
+        elif fmt == "json": df.to_json(tmp, orient="records", force_ascii=False)
+        elif fmt == "parquet":
+            try: df.to_parquet(tmp, index=False)
+            except ImportError as e: raise SystemExit(f"Parquet の書き出しには pyarrow が必要です（pip install pyarrow）: {e}")
+        else: raise SystemExit(f"未対応の形式: {fmt}")
+        os.replace(tmp, path)   # 読み手（ダッシュボード等）が書きかけを見ないように置き換え
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+
+# ---------------------------
+# メイン
+# ---------------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="SIBYL 犯罪係数（市町 × 時刻）の一括計算と CSV/Parquet/JSON 出力")
+    ap.add_argument("--start", help="開始時刻（ISO 8601。TZ 無しは JST、省略時は現在の正時）")
+    ap.add_argument("--end", help="終了時刻（含まない）。省略時は --hours")
+    ap.add_argument("--hours", type=int, default=24, help="--end 省略時の期間（時間）")
+    ap.add_argument("--step-hours", type=int, default=1)
+    ap.add_argument("--weather", choices=["forecast", "current", "default"], default="forecast",
+                    help="forecast: 時間別予報（範囲外は端の値）/ current: 現在の天気 / default: 既定値（通信なし）")
+    ap.add_argument("--counts", choices=["archive", "page", "none"], default="archive",
+                    help="速報件数: 蓄積DBの直近N日 / 現在ページの出現回数 / 0")
+    ap.add_argument("--window-days", type=int, default=7)
+    ap.add_argument("--archive", default=POLICE_ARCHIVE_PATH, help="速報の蓄積DB（SQLite）")
+    ap.add_argument("--poll", action="store_true", help="計算前に県警速報を1回取得して蓄積DBを更新")
+    ap.add_argument("--data", action="append", help="2019 CSV の glob（複数可。省略時はアプリと同じ場所）")
+    ap.add_argument("--no-history", action="store_true", help="2019傾向を使わない")
+    ap.add_argument("--workers", type=int, default=None, help="プロセス数（省略時は行数で自動、1 で逐次）")
+    ap.add_argument("--reason-codes", action="store_true", help="理由を文字列でなくビットフラグ（整数）で出力")
+    ap.add_argument("--out", default="-", help="出力先（- は標準出力）")
+    ap.add_argument("--format", choices=OUTPUT_FORMATS, help="省略時は --out の拡張子から")
+    args = ap.parse_args(argv)
+    if args.step_hours < 1: ap.error("--step-hours は 1 以上")
+    if args.counts == "archive" and not args.poll and not os.path.exists(args.archive):
+        # 打ち間違えたパスに空の DB を作って件数 0 のまま正常終了しないように
+        ap.error(f"蓄積DBがありません: {args.archive}（--poll で取得して作成するか、--archive を確認）")
+
+    t0 = time.perf_counter()
+    perf.TRACER.begin_run("sibyl_batch")
+    try:
+        times = build_times(parse_time(args.start), parse_time(args.end) if args.end else None, args.hours, args.step_hours)
+        if not len(times): ap.error("時刻の範囲が空です")
+        with perf.span("batch.history"): history = None if args.no_history else load_history(args.data or DATA_GLOBS)
+        with perf.span("batch.counts"):
+            counts = muni_counts_for_times(args.counts, times, args.window_days, args.archive, poll=args.poll)
+        with perf.span("batch.weather"): weather = weather_for_times(default_points(), times, args.weather)
+        with perf.span("batch.compute", rows=len(times) * len(CITY_NAMES)):
+            df = compute_range(times, counts, history, weather, args.workers, reasons_text=not args.reason_codes)
+        fmt = output_format(args.out, args.format)
+        with perf.span("batch.write"): write_table(df, args.out, fmt)
+    finally:
+        perf.TRACER.end_run()
+    print(f"{len(df)} 行（{len(times)} 時刻 × {df['municipality'].nunique()} 市町）→ {args.out} [{fmt}] "
+          f"{time.perf_counter() - t0:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
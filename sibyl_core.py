@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+# ============================================================
+# SIBYL 犯罪係数の計算コア（Streamlit / Folium に依存しない部分）
+#  ・気象（現在/時間別予報）・月齢・リスクスコア（0–100）・CC（0–300）
+#  ・取得結果はプロセス内の TTLCache で共有（モジュールは import 1回なので、Streamlit の
+#    再実行や全セッションをまたいで同じインスタンス）
+#  ・app.py（画面）と sibyl_batch.py（コマンドライン一括出力）の両方から使う
+#  APIキーは環境変数 ESP_WEATHERAPI_KEY / ESP_OPENWEATHER_KEY（app.py は st.secrets の値で上書き）
+# ============================================================
+
+import os, time, bisect, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from datetime import datetime
+from typing import Optional, Tuple, List, Dict, Callable, Hashable
+
+import numpy as np
+import pandas as pd
+
+from crime_data import HistoricalProfile, build_historical_profile
+from municipalities import JST, CITY_NAMES, MUNI_CENTROIDS
+from http_client import CircuitOpenError, http_get
+from moon_engine import moon_age_days, moon_alt_az
+import perf
+
+# ---------------------------
+# 基本設定
+# ---------------------------
+DATA_GLOBS = [
+    "./ehime_2019*.csv",
+    "./data/ehime_2019*.csv",
+    "/mnt/data/ehime_2019*.csv",
+]
+
+WEATHERAPI_URL = os.environ.get("ESP_WEATHERAPI_URL", "https://api.weatherapi.com/v1")
+OPENWEATHER_URL = os.environ.get("ESP_OPENWEATHER_URL", "https://api.openweathermap.org/data/2.5")
+MGPN_URL = os.environ.get("ESP_MGPN_URL", "https://mgpn.org/api/moon")
+WEATHERAPI_KEY = os.environ.get("ESP_WEATHERAPI_KEY", "")
+OPENWEATHER_KEY = os.environ.get("ESP_OPENWEATHER_KEY", "")
+
+# ---------------------------
+# ユーティリティ
+# ---------------------------
+
+def clamp(v, lo, hi): return lo if v < lo else (hi if v > hi else v)
+
+
+class TTLCache:
+    # スレッドセーフな TTL + LRU キャッシュ（プロセス内で共有するインスタンスはモジュール変数か st.cache_resource で保持）
+    #  ・ttl 以内: そのまま返す（hit）
+    #  ・ttl 超過〜ttl+stale_ttl: 古い値を返しつつ裏スレッドで再取得（stale-while-revalidate）
+    #  ・それ以外: 呼び出し側で取得（miss）。None は保存しない
+    def __init__(self, ttl: float, maxsize: int = 1024, stale_ttl: float = 0.0, name: str = "cache"):
+        self.ttl, self.maxsize, self.stale_ttl, self.name = float(ttl), int(maxsize), float(stale_ttl), name
+        self._data: "OrderedDict[Hashable, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing: set = set()
+        self.hits = self.stale_hits = self.misses = self.evictions = 0
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], object]):
+        now = time.monotonic()
+        with self._lock:
+            ent = self._data.get(key)
+            if ent is not None:
+                age = now - ent[0]
+                if age <= self.ttl:
+                    self._data.move_to_end(key); self.hits += 1; perf.count(f"cache.{self.name}.hit"); return ent[1]
+                if age <= self.ttl + self.stale_ttl:
+                    self._data.move_to_end(key); self.stale_hits += 1; perf.count(f"cache.{self.name}.stale")
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(target=self._refresh, args=(key, fetch), daemon=True).start()
+                    return ent[1]
+            self.misses += 1
+        perf.count(f"cache.{self.name}.miss")
+        val = fetch()
+        self.put(key, val)
+        return val
+
+    def _refresh(self, key: Hashable, fetch: Callable[[], object]):
+        try: self.put(key, fetch())
+        except Exception: pass
+        finally:
+            with self._lock: self._refreshing.discard(key)
+
+    def put(self, key: Hashable, val):
+        if val is None: return
+        with self._lock:
+            self._data[key] = (time.monotonic(), val); self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False); self.evictions += 1
+
+    def clear(self):
+        with self._lock: self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "stale_hits": self.stale_hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+# ---------------------------
+# 気象
+# ---------------------------
+
+def get_weather_weatherapi(lat, lon):
+    try:
+        if not WEATHERAPI_KEY: return None
+        p = f"key={WEATHERAPI_KEY}&q={lat},{lon}"
+        r = http_get("weatherapi", f"{WEATHERAPI_URL}/current.json?{p}&aqi=no")
+        r.raise_for_status()
+        curr = r.json()
+        return {
+            "temp_c": curr["current"]["temp_c"],
+            "humidity": curr["current"]["humidity"],
+            "condition": curr["current"]["condition"]["text"],
+            "precip_mm": curr["current"].get("precip_mm", 0.0),
+            "wind_kph": curr["current"].get("wind_kph", 0.0),
+        }
+    except Exception:
+        return None
+
+
+def get_weather_openweather(lat, lon):
+    try:
+        if not OPENWEATHER_KEY: return None
+        p = {"lat": lat, "lon": lon, "appid": OPENWEATHER_KEY, "units": "metric", "lang":"ja"}
+        r = http_get("openweather", f"{OPENWEATHER_URL}/weather", params=p); r.raise_for_status(); jd = r.json()
+        return {
+            "temp_c": jd["main"]["temp"], "humidity": jd["main"]["humidity"],
+            "condition": jd["weather"][0]["description"], "precip_mm": 0.0,
+            "wind_kph": jd.get("wind",{}).get("speed",0.0)*3.6,
+        }
+    except Exception:
+        return None
+
+
+DEFAULT_WEATHER = {"temp_c": 26.0, "humidity": 70, "condition": "晴れ", "precip_mm": 0.0, "wind_kph": 8.0}
+
+
+# 天気キャッシュ：緯度経度を WEATHER_CELL_DEG 格子に量子化＋時間帯バケットをキーにし、近い地点・全セッションで共有
+WEATHER_CELL_DEG = float(os.environ.get("ESP_WEATHER_CELL_DEG", 0.05))         # 約5km
+WEATHER_TIME_BUCKET_S = int(os.environ.get("ESP_WEATHER_TIME_BUCKET_S", 3600))
+WEATHER_CACHE_TTL_S = float(os.environ.get("ESP_WEATHER_TTL_S", 600))
+WEATHER_CACHE_STALE_S = float(os.environ.get("ESP_WEATHER_STALE_S", 1200))
+WEATHER_CACHE_MAXSIZE = int(os.environ.get("ESP_WEATHER_CACHE_MAXSIZE", 2048))
+WEATHER_CACHE = TTLCache(WEATHER_CACHE_TTL_S, WEATHER_CACHE_MAXSIZE, WEATHER_CACHE_STALE_S, name="weather")
+
+
+def get_weather_cache() -> TTLCache:
+    return WEATHER_CACHE
+
+
+def weather_cache_key(lat: float, lon: float, now: float | None = None) -> tuple:
+    now = time.time() if now is None else now
+    return (round(lat / WEATHER_CELL_DEG), round(lon / WEATHER_CELL_DEG), int(now // WEATHER_TIME_BUCKET_S))
+
+
+def get_weather(lat, lon):
+    w = get_weather_cache().get_or_fetch(weather_cache_key(lat, lon),
+                                         lambda: get_weather_weatherapi(lat, lon) or get_weather_openweather(lat, lon))
+    return dict(w) if w else dict(DEFAULT_WEATHER)
+
+# 時間別予報（SIBYL予報タイムライン用）。各APIの時刻列 → 1時間刻みの配列に線形補間（範囲外は端の値）
+
+def get_forecast_weatherapi(lat, lon, hours: int) -> dict | None:
+    try:
+        if not WEATHERAPI_KEY: return None
+        p = {"key": WEATHERAPI_KEY, "q": f"{lat},{lon}", "days": min(14, hours // 24 + 2), "aqi": "no", "alerts": "no"}
+        r = http_get("weatherapi", f"{WEATHERAPI_URL}/forecast.json", params=p)
+        r.raise_for_status(); jd = r.json()
+        hrs = [h for d in jd["forecast"]["forecastday"] for h in d["hour"]]
+        return {
+            "epoch": np.array([h["time_epoch"] for h in hrs], dtype=float),
+            "temp_c": np.array([h["temp_c"] for h in hrs], dtype=float),
+            "humidity": np.array([h["humidity"] for h in hrs], dtype=float),
+            "precip_mm": np.array([h.get("precip_mm", 0.0) for h in hrs], dtype=float),
+        }
+    except Exception:
+        return None
+
+
+def get_forecast_openweather(lat, lon, hours: int) -> dict | None:
+    try:
+        if not OPENWEATHER_KEY: return None
+        p = {"lat": lat, "lon": lon, "appid": OPENWEATHER_KEY, "units": "metric"}   # 3時間刻み・5日分
+        r = http_get("openweather", f"{OPENWEATHER_URL}/forecast", params=p); r.raise_for_status(); lst = r.json()["list"]
+        return {
+            "epoch": np.array([e["dt"] for e in lst], dtype=float),
+            "temp_c": np.array([e["main"]["temp"] for e in lst], dtype=float),
+            "humidity": np.array([e["main"]["humidity"] for e in lst], dtype=float),
+            "precip_mm": np.array([e.get("rain", {}).get("3h", 0.0) / 3.0 for e in lst], dtype=float),
+        }
+    except Exception:
+        return None
+
+
+FORECAST_CACHE = TTLCache(30 * 60, 256, name="forecast")
+
+
+def get_weather_forecast(lat: float, lon: float, start_epoch: int, hours: int) -> dict:
+    return FORECAST_CACHE.get_or_fetch((lat, lon, int(start_epoch), int(hours)),
+                                       lambda: _weather_forecast(lat, lon, int(start_epoch), int(hours)))
+
+
+def _weather_forecast(lat: float, lon: float, start_epoch: int, hours: int) -> dict:
+    grid = start_epoch + 3600.0 * np.arange(hours)
+    fc = get_forecast_weatherapi(lat, lon, hours) or get_forecast_openweather(lat, lon, hours)
+    if not fc or len(fc["epoch"]) == 0:
+        return {k: np.full(hours, float(DEFAULT_WEATHER[k])) for k in ("temp_c", "humidity", "precip_mm")}
+    order = np.argsort(fc["epoch"])
+    return {k: np.interp(grid, fc["epoch"][order], fc[k][order]) for k in ("temp_c", "humidity", "precip_mm")}
+
+# ---------------------------
+# 月齢（ローカル計算。mgpn v2→v3 は任意の照合用）
+# ---------------------------
+
+def _extract_moonage(payload) -> float | None:
+    if payload is None: return None
+    obj = payload[0] if isinstance(payload, list) and payload else payload
+    for k in ["moonage","moon_age","moonAge","age"]:
+        if obj and k in obj and obj[k] is not None:
+            try: return float(obj[k])
+            except: pass
+    return None
+
+
+MOON_PHASE_EDGES = (1.0, 6.0, 8.9, 13.5, 16.0, 21.0, 23.5, 28.0)   # 月齢（日）の区切り。age < edge[i] → LABELS[i]
+MOON_PHASE_LABELS = ("新月", "三日月（若月）", "上弦前後", "十三夜～満月前", "満月前後",
+                     "満月後～下弦前", "下弦前後", "有明月（残月）", "新月に近い")
+
+
+def _phase_text_from_age(age: float | None) -> str | None:
+    if age is None: return None
+    return MOON_PHASE_LABELS[bisect.bisect_right(MOON_PHASE_EDGES, age % 29.53)]
+
+
+MGPN_CACHE = TTLCache(30 * 60, 256, name="mgpn")
+
+
+def get_mgpn_moon(lat: float, lon: float, dt_jst: datetime) -> dict | None:
+    t = dt_jst.strftime("%Y-%m-%dT%H:%M")
+    return MGPN_CACHE.get_or_fetch((round(lat, 6), round(lon, 6), t), lambda: _mgpn_moon(lat, lon, t))
+
+
+def _mgpn_moon(lat: float, lon: float, t: str) -> dict | None:
+    # 再試行（バックオフ）と停止中の即失敗は http_client 側。v2 が駄目なら v3
+    headers = {"Accept":"application/json"}
+    for base in [f"{MGPN_URL}/v2position.cgi", f"{MGPN_URL}/v3position.cgi"]:
+        try:
+            params = {"time": t, "lat": f"{lat:.6f}", "lon": f"{lon:.6f}"}
+            if "v2" in base: params.update({"loop":1,"interval":0})
+            r = http_get("mgpn", base, params=params, headers=headers)
+            r.raise_for_status(); payload = r.json()
+            age = _extract_moonage(payload)
+            obj = payload[0] if isinstance(payload,list) and payload else payload
+            alt = float(obj.get("altitude")) if obj and "altitude" in obj else None
+            azi = float(obj.get("azimuth")) if obj and "azimuth" in obj else None
+            return {"moon_age":age, "phase_text":_phase_text_from_age(age), "altitude":alt, "azimuth":azi}
+        except CircuitOpenError:
+            break
+        except Exception:
+            perf.count("http.mgpn.error")
+    return None
+
+
+def get_moon_info(lat: float, lon: float, dt: datetime) -> dict:
+    # get_mgpn_moon と同じ形の dict をネットワーク無しで返す
+    age = float(moon_age_days(dt))
+    alt, azi = moon_alt_az(dt, lat, lon)
+    return {"moon_age": round(age, 2), "phase_text": _phase_text_from_age(age),
+            "altitude": round(float(alt), 1), "azimuth": round(float(azi), 1)}
+
+
+def is_full_moon_like_text(phase_text: str | None, age: float | None) -> bool:
+    if phase_text and ("満月" in phase_text): return True
+    if age is not None:
+        a = age % 29.53
+        return 13.3 <= a <= 16.3
+    return False
+
+# ---------------------------
+# リスクスコア（0–100）
+# ---------------------------
+
+def compute_risk_score(weather: dict, now_dt: datetime, history: HistoricalProfile | pd.DataFrame | None, moon_info: dict | None,
+                       nearby: dict | None = None) -> dict:
+    score = 0.0; reasons = []
+    temp = float(weather.get("temp_c", 20.0))
+    precip = float(weather.get("precip_mm", 0.0))
+    humidity = float(weather.get("humidity", 60))
+    cond = str(weather.get("condition", ""))
+
+    if   temp >= 32: add = 42
+    elif temp >= 30: add = 36
+    elif temp >= 27: add = 28
+    elif temp >= 25: add = 20
+    elif temp >= 22: add = 10
+    else: add = 0
+    score += add
+    if add>0: reasons.append(f"気温{temp:.0f}℃:+{add}")
+
+    if precip >= 10: score -= 20; reasons.append("強い降雨:-20")
+    elif precip >= 1: score -= 8; reasons.append("降雨あり:-8")
+
+    hour = now_dt.hour
+    if 20 <= hour <= 23 or 0 <= hour <= 4: score += 15; reasons.append("夜間:+15")
+    elif 17 <= hour < 20: score += 7; reasons.append("夕方:+7")
+
+    if now_dt.weekday() in (4,5): score += 6; reasons.append("週末(+金土):+6")
+
+    moon_age = moon_info.get("moon_age") if moon_info else None
+    phase_tx = moon_info.get("phase_text") if moon_info else None
+    if is_full_moon_like_text(phase_tx, moon_age): score += 5; reasons.append("満月相当:+5")
+
+    if humidity >= 80: score += 3; reasons.append("高湿度:+3")
+
+    # 2019傾向は事前集計（HistoricalProfile）を参照するだけ。DataFrame が渡された場合はその場で集計
+    if isinstance(history, pd.DataFrame): history = build_historical_profile(history)
+    if history is not None and not history.empty:
+        month_ratio = history.month_share[now_dt.month]
+        if   month_ratio >= 0.12: score += 6; reasons.append("2019傾向(同月比 多め):+6")
+        elif month_ratio >= 0.08: score += 3; reasons.append("2019傾向(同月比 やや多め):+3")
+        outdoor_like = history.outdoor_like
+        if outdoor_like is not None:
+            if   outdoor_like >= 0.45: score += 5; reasons.append("2019傾向(屋外系多):+5")
+            elif outdoor_like >= 0.30: score += 2; reasons.append("2019傾向(屋外系やや多):+2")
+
+    # 選択地点周辺の2019件数（nearby_summary の密度比。県平均=1.0）。地点を持たない一括計算では使わない
+    ratio = nearby.get("density_ratio") if nearby else None
+    if ratio is not None:
+        if   ratio >= 2.0: score += 8; reasons.append("周辺の2019件数(県平均の2倍以上):+8")
+        elif ratio >= 1.2: score += 4; reasons.append("周辺の2019件数(県平均より多め):+4")
+
+    score = float(np.clip(score, 0, 100))
+    level = "Low" if score<25 else ("Moderate" if score<50 else ("High" if score<75 else "Very High"))
+    color = RISK_LEVEL_COLORS[level]
+    return {"score": round(score,1), "level": level, "color": color, "reasons": reasons,
+            "moon_phase": phase_tx, "moon_age": moon_age,
+            "temp_c": temp, "humidity": humidity, "precip_mm": precip, "condition": cond}
+
+RISK_LEVEL_COLORS = {"Low":"#0aa0ff","Moderate":"#ffd033","High":"#ff7f2a","Very High":"#ff2a2a"}
+
+# バッチ版の理由コード：このタプルの添字をビット位置とするフラグの OR
+RISK_REASON_LABELS = (
+    "気温32℃以上:+42", "気温30℃以上:+36", "気温27℃以上:+28", "気温25℃以上:+20", "気温22℃以上:+10",
+    "強い降雨:-20", "降雨あり:-8", "夜間:+15", "夕方:+7", "週末(+金土):+6", "満月相当:+5", "高湿度:+3",
+    "2019傾向(同月比 多め):+6", "2019傾向(同月比 やや多め):+3", "2019傾向(屋外系多):+5", "2019傾向(屋外系やや多):+2",
+)
+_FULL_MOON_LIKE_PHASE = np.array(["満月" in lb for lb in MOON_PHASE_LABELS])
+
+
+def decode_risk_reasons(code: int) -> List[str]:
+    return [lb for i, lb in enumerate(RISK_REASON_LABELS) if (int(code) >> i) & 1]
+
+
+def compute_risk_scores_batch(temp_c, precip_mm, humidity, times, moon_age=None,
+                              history: Optional[HistoricalProfile] = None) -> Dict[str, np.ndarray]:
+    # compute_risk_score と同じ規則を配列で一括評価。気象/月齢はスカラーなら全要素に適用（月齢 NaN = 不明）
+    # times: tz付きなら JST に変換、naive はそのまま現地時刻とみなす
+    ts = pd.DatetimeIndex(times)
+    if ts.tz is not None: ts = ts.tz_convert(JST)
+    n = len(ts)
+    hour = ts.hour.to_numpy(); wday = ts.weekday.to_numpy(); month = ts.month.to_numpy()
+    temp, precip, hum, age = (np.broadcast_to(np.asarray(v, dtype=float), (n,)) for v in
+                              (temp_c, precip_mm, humidity, np.nan if moon_age is None else moon_age))
+    score = np.zeros(n); code = np.zeros(n, dtype=np.int64)
+
+    def rule(bit: int, mask: np.ndarray, pts: float):
+        nonlocal score, code
+        score = score + np.where(mask, pts, 0.0); code |= mask.astype(np.int64) << bit
+
+    temp_steps = ((32, 42), (30, 36), (27, 28), (25, 20), (22, 10))
+    t_idx = np.select([temp >= th for th, _ in temp_steps], range(len(temp_steps)), -1)
+    for bit, (_, pts) in enumerate(temp_steps): rule(bit, t_idx == bit, pts)
+    rule(5, precip >= 10, -20); rule(6, (precip >= 1) & (precip < 10), -8)
+    rule(7, (hour >= 20) | (hour <= 4), 15); rule(8, (hour >= 17) & (hour < 20), 7)
+    rule(9, (wday == 4) | (wday == 5), 6)
+    a = np.mod(age, 29.53)
+    with np.errstate(invalid="ignore"):
+        phase_full = _FULL_MOON_LIKE_PHASE[np.searchsorted(MOON_PHASE_EDGES, np.nan_to_num(a), side="right")]
+        rule(10, ~np.isnan(a) & (phase_full | ((a >= 13.3) & (a <= 16.3))), 5)
+    rule(11, hum >= 80, 3)
+    if history is not None and not history.empty:
+        ms = np.asarray(history.month_share)[month]
+        rule(12, ms >= 0.12, 6); rule(13, (ms >= 0.08) & (ms < 0.12), 3)
+        if history.outdoor_like is not None:
+            od = np.full(n, history.outdoor_like)
+            rule(14, od >= 0.45, 5); rule(15, (od >= 0.30) & (od < 0.45), 2)
+
+    score = np.clip(score, 0, 100)
+    level = np.select([score < 25, score < 50, score < 75], ["Low", "Moderate", "High"], "Very High")
+    return {"score": np.round(score, 1), "level": level, "reasons": code}
+
+# ---------------------------
+# CC（Crime Coefficient 0–300）
+# ---------------------------
+
+def compute_cc_from_risk_and_news(risk_score_0_100: float, recent_count: int) -> int:
+    cc = int(round(risk_score_0_100 * 2.4 + 30 * min(int(recent_count), 5)))
+    return int(clamp(cc, 0, 300))
+
+
+def compute_cc_batch(risk_scores, recent_counts) -> np.ndarray:
+    cc = np.round(np.asarray(risk_scores, dtype=float) * 2.4 + 30 * np.minimum(np.asarray(recent_counts, dtype=np.int64), 5))
+    return np.clip(cc, 0, 300).astype(np.int64)
+
+# ---------------------------
+# 市町ごとの気象/月齢
+# ---------------------------
+
+SIBYL_FETCH_DEADLINE_S = 12.0   # 全市町の気象/月齢取得に掛ける上限（超過分は既定値）
+
+
+def _run_concurrent(calls: Dict[object, Callable[[], object]], deadline_s: float) -> Dict[object, object]:
+    # calls を一斉に発行し、締切までに返った結果だけを返す（例外・None・締切超過のキーは含めない）
+    if not calls: return {}
+    ex = ThreadPoolExecutor(max_workers=min(32, len(calls)), thread_name_prefix="sibyl-fetch")
+    futs = {ex.submit(perf.bind(fn)): k for k, fn in calls.items()}
+    done, _ = wait(futs, timeout=deadline_s)
+    ex.shutdown(wait=False, cancel_futures=True)   # 締切超過の要求は待たない
+    out = {}
+    for f in done:
+        try: v = f.result()
+        except Exception: v = None
+        if v is not None: out[futs[f]] = v
+    return out
+
+
+def fetch_conditions_concurrent(points: Dict[str, Tuple[float, float]], dt: datetime,
+                                deadline_s: float = SIBYL_FETCH_DEADLINE_S) -> Dict[str, dict]:
+    # 地点ごとの get_weather を一斉に発行し、締切までに返ったものだけ採用（月齢はローカル計算）
+    out = {k: {"weather": dict(DEFAULT_WEATHER), "moon": get_moon_info(lat, lon, dt)} for k, (lat, lon) in points.items()}
+    got = _run_concurrent({k: partial(get_weather, lat, lon) for k, (lat, lon) in points.items()}, deadline_s)
+    for k, v in got.items(): out[k]["weather"] = v
+    return out
+
+
+def fetch_forecasts_concurrent(points: Dict[str, Tuple[float, float]], start_epoch: int, hours: int,
+                               deadline_s: float = SIBYL_FETCH_DEADLINE_S) -> Dict[str, dict]:
+    # 地点ごとの時間別予報を一斉に取得（締切超過の地点は既定値の一定値）
+    got = _run_concurrent({k: partial(get_weather_forecast, lat, lon, start_epoch, hours) for k, (lat, lon) in points.items()}, deadline_s)
+    flat = {k: np.full(hours, float(DEFAULT_WEATHER[k])) for k in ("temp_c", "humidity", "precip_mm")}
+    return {k: got.get(k, flat) for k in points}
+
+
+def default_points() -> Dict[str, Tuple[float, float]]:
+    return {m: MUNI_CENTROIDS[m] for m in CITY_NAMES}
+
+
+def weather_for_times(points: Dict[str, Tuple[float, float]], times: pd.DatetimeIndex, source: str = "forecast") -> Dict[str, dict]:
+    # 地点ごとの {temp_c, humidity, precip_mm}（スカラーか times と同じ長さの配列）
+    #  forecast: 時間別予報を times に線形補間（予報の範囲外は端の値） / current: 現在の天気を全時刻に / default: 既定値
+    if source == "default": return {m: dict(DEFAULT_WEATHER) for m in points}
+    if source == "current": return {m: c["weather"] for m, c in fetch_conditions_concurrent(points, datetime.now(JST)).items()}
+    if source != "forecast": raise ValueError(source)
+    epochs = times.as_unit("s").asi8.astype(float)
+    start = int(epochs.min() // 3600 * 3600); hours = int((epochs.max() - start) // 3600) + 2
+    grid = start + 3600.0 * np.arange(hours)
+    return {m: {k: np.interp(epochs, grid, wx[k]) for k in ("temp_c", "humidity", "precip_mm")}
+            for m, wx in fetch_forecasts_concurrent(points, start, hours).items()}
+
+# ---------------------------
+# SIBYL：犯罪係数の一括計算（市町 × 時刻）
+# ---------------------------
+
+def compute_cc_table(times, muni_counts: Dict[str, object], history: Optional[HistoricalProfile],
+                     weather: Optional[Dict[str, dict]] = None, points: Optional[Dict[str, Tuple[float, float]]] = None) -> pd.DataFrame:
+    # 市町ごとに時刻が並ぶ縦持ちの表。weather[muni] / muni_counts[muni] はスカラーか times と同じ長さの配列
+    # times: naive は JST とみなす
+    times = pd.DatetimeIndex(times)
+    times = times.tz_localize(JST) if times.tz is None else times.tz_convert(JST)
+    points = default_points() if points is None else points
+    n = len(times)
+    if not n or not points: return pd.DataFrame()
+    ages = moon_age_days(times)   # 月齢は地点に依存しないので時刻列だけで一括計算
+    cols: Dict[str, list] = {"municipality": [], "lat": [], "lon": [], "temp_c": [], "humidity": [], "precip_mm": [], "recent": []}
+    for muni, (lat0, lon0) in points.items():
+        wx = (weather or {}).get(muni) or DEFAULT_WEATHER
+        cols["municipality"].append(np.full(n, muni, dtype=object))
+        cols["lat"].append(np.full(n, lat0)); cols["lon"].append(np.full(n, lon0))
+        for k in ("temp_c", "humidity", "precip_mm"): cols[k].append(np.broadcast_to(np.asarray(wx[k], dtype=float), (n,)))
+        cols["recent"].append(np.broadcast_to(np.asarray(muni_counts.get(muni, 0), dtype=np.int64), (n,)))
+    out = pd.DataFrame({k: np.concatenate(v) for k, v in cols.items()})
+    k = len(points)
+    out["time"] = times[np.tile(np.arange(n), k)]; out["moon_age"] = np.tile(ages, k)
+    res = compute_risk_scores_batch(out["temp_c"], out["precip_mm"], out["humidity"], out["time"], out["moon_age"], history)
+    out["score"] = res["score"]; out["level"] = res["level"]; out["reasons"] = res["reasons"]
+    out["cc"] = compute_cc_batch(out["score"], out["recent"])
+    return out
+
+
+def compute_cc_forecast(muni_counts: Dict[str,int], start_dt: datetime, hours: int,
+                        history: Optional[HistoricalProfile], points: Optional[Dict[str, Tuple[float, float]]] = None) -> pd.DataFrame:
+    start = start_dt.astimezone(JST).replace(minute=0, second=0, microsecond=0)
+    times = pd.date_range(start, periods=hours, freq="h")
+    points = default_points() if points is None else points
+    weather = fetch_forecasts_concurrent(points, int(start.timestamp()), hours)
+    return compute_cc_table(times, muni_counts, history, weather, points)
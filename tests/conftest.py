@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+# リポジトリ直下のモジュールと bench/（スタブサーバ）を import できるようにする
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for p in (ROOT, os.path.join(ROOT, "bench")):
+    if p not in sys.path: sys.path.insert(0, p)
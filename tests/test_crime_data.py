@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import glob, os
+
+import pandas as pd
+
+from crime_data import (CRIME_TYPE_BY_FILENAME, build_historical_profile, build_incident_bins, guess_columns,
+                        load_all_crime_2019, normalize_crime_frame, read_csv_robust)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CSV_FILES = sorted(glob.glob(os.path.join(ROOT, "ehime_2019*.csv")))
+CENTROIDS = {"松山市": (33.84, 132.77), "今治市": (34.07, 133.00)}
+
+
+def test_incident_bins_ctypes_by_count():
+    df = pd.DataFrame({"municipality": ["松山市"] * 3 + ["今治市"] * 2,
+                       "ctype": ["ひったくり", "車上ねらい", "車上ねらい", "車上ねらい", "自転車盗"],
+                       "date": pd.to_datetime(["2019-01-05", "2019-01-06", "2019-02-01", "2019-03-01", "2019-03-02"])})
+    bins = build_incident_bins(df, CENTROIDS, "v")
+    assert bins.ctypes()[0] == "車上ねらい" and set(bins.ctypes()) == {"ひったくり", "車上ねらい", "自転車盗"}
+    assert bins.cell_totals("ひったくり", 3).empty and not bins.cell_totals("自転車盗", 3).empty
+    assert build_incident_bins(None, CENTROIDS).ctypes() == []
+
+
+
+def test_real_headers_map_to_teguchi():
+    # 公開CSVの見出し（罪名は全件「窃盗」、手口がファイルごとの種別）→ ctype は手口の列
+    assert CSV_FILES
+    for fp in CSV_FILES:
+        df = read_csv_robust(fp)
+        g = guess_columns(df)
+        assert (g["date"], g["municipality"], g["ctype"]) == ("発生年月日（始期）", "市区町村（発生地）", "手口")
+        stem = os.path.basename(fp)[len("ehime_2019"):-len(".csv")]
+        assert normalize_crime_frame(df, fp)["ctype"].unique().tolist() == [CRIME_TYPE_BY_FILENAME[stem]]
+
+
+def test_real_data_profile_uses_teguchi():
+    df = load_all_crime_2019([os.path.join(ROOT, "ehime_2019*.csv")], use_snapshot=False, workers=1)
+    assert "窃盗" not in set(df["ctype"])
+    assert build_historical_profile(df).outdoor_like > 0.45   # 自転車盗・車上ねらい等が大半
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# HTTP クライアントの再試行/ブレーカ/Retry-After（ローカルのスタブ相手）
+#  ホストごとのブレーカはスタブ全体で共通なので、確認ごとに別のクライアントを使う
+import time
+
+import pytest
+
+import http_client as hc
+from stubs import StubServer
+
+PATH = "/weatherapi/current.json"
+Q = {"q": "33.8,132.7"}
+
+
+@pytest.fixture(scope="module")
+def stub():
+    s = StubServer().start()
+    yield s
+    s.stop()
+
+
+@pytest.fixture
+def url(stub):
+    yield f"{stub.base}{PATH}"
+    stub.fail.pop(PATH, None); stub.fail_headers.pop(PATH, None)
+
+
+def client(**kw) -> hc.HttpClient:
+    return hc.HttpClient(**{"backoff_base_s": 0.01, "backoff_max_s": 2.0, "breaker_fails": 3, "breaker_cooldown_s": 0.3, **kw})
+
+
+def test_retry_after_503(stub, url):
+    # 503 → 200: 1回の再試行で成功
+    stub.fail[PATH] = [503]; n0 = stub.calls[PATH]
+    r = client().get("weatherapi", url, params=Q)
+    assert r.status_code == 200 and stub.calls[PATH] - n0 == 2
+
+
+def test_breaker_opens_and_half_open_probe_closes(stub, url):
+    # 連続 breaker_fails 回の失敗で open、以降は要求を送らずに CircuitOpenError
+    cl = client(); stub.fail[PATH] = 503
+    for _ in range(3): assert cl.get("weatherapi", url, params=Q, retries=0).status_code == 503
+    assert cl.breaker(url).stats()["state"] == "open"
+    n0 = stub.calls[PATH]
+    with pytest.raises(hc.CircuitOpenError): cl.get("weatherapi", url, params=Q)
+    assert stub.calls[PATH] == n0
+    # cooldown 後の1本（half_open）が成功すれば closed
+    stub.fail.pop(PATH); time.sleep(0.35)
+    assert cl.get("weatherapi", url, params=Q).status_code == 200
+    assert cl.breaker(url).stats()["state"] == "closed"
+
+
+def test_half_open_probe_failure_reopens(stub, url):
+    cl = client(); stub.fail[PATH] = 503
+    for _ in range(3): cl.get("weatherapi", url, params=Q, retries=0)
+    time.sleep(0.35); n0 = stub.calls[PATH]
+    assert cl.get("weatherapi", url, params=Q, retries=0).status_code == 503 and stub.calls[PATH] - n0 == 1
+    assert cl.breaker(url).stats()["state"] == "open"
+
+
+def test_retry_after_is_honoured(stub, url):
+    # Retry-After（秒）に従って待ってから再試行
+    stub.fail[PATH] = [429]; stub.fail_headers[PATH] = {"Retry-After": "1"}
+    t0 = time.perf_counter(); r = client(backoff_base_s=0.0).get("weatherapi", url, params=Q)
+    assert r.status_code == 200 and time.perf_counter() - t0 >= 0.95
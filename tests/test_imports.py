@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# 解析だけ/計算だけの利用やプールのワーカーに、地図・HTTP・Streamlit の読み込みを持ち込まない
+#  新しいインタプリタで import し、読み込まれてはいけないモジュールが sys.modules に無いことを確認
+import json, os, subprocess, sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FORBIDDEN = {
+    "police_feed": ("numpy", "pandas", "requests", "chardet", "streamlit", "folium"),
+    "crime_data":  ("requests", "chardet", "streamlit", "folium"),
+    "sibyl_core":  ("requests", "chardet", "streamlit", "folium"),
+    "sibyl_batch": ("requests", "chardet", "streamlit", "folium"),
+    "app":         ("requests", "chardet", "folium", "branca", "streamlit_folium"),
+}
+
+
+@pytest.mark.parametrize("mod", list(FORBIDDEN))
+def test_import_does_not_load(mod):
+    p = subprocess.run([sys.executable, "-W", "ignore", "-c", f"import json, sys; import {mod}; print(json.dumps(sorted(sys.modules)))"],
+                       cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert p.returncode == 0, p.stderr[-500:]
+    loaded = {m.split(".")[0] for m in json.loads(p.stdout.strip().splitlines()[-1])}
+    assert not loaded & set(FORBIDDEN[mod]), sorted(loaded & set(FORBIDDEN[mod]))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# 月齢計算の精度: 既知の新月/満月時刻（MOON_REFERENCE_PHASES_UTC）との差が一定以内
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+from moon_engine import (DELTA_T_DAYS, MOON_REFERENCE_PHASES_UTC, SYNODIC_MONTH, check_against_reference, moon_age_days,
+                         phase_jde, to_julian_day)
+
+MAX_ERROR_MIN = 2.0   # Meeus 49章の誤差は数分。現状の実測は 0.5 分程度
+NEW_MOONS = [ts for kind, ts in MOON_REFERENCE_PHASES_UTC if kind == "new"]
+
+
+def test_phase_times_scalar():
+    errs = [abs(d) for *_, d in check_against_reference()]
+    assert len(errs) == len(MOON_REFERENCE_PHASES_UTC)
+    assert max(errs) < MAX_ERROR_MIN
+
+
+def test_phase_times_vectorized():
+    # 同じ k を配列でまとめて評価しても、スカラー評価と同じ精度
+    jd = to_julian_day(np.array([ts for _, ts in MOON_REFERENCE_PHASES_UTC], dtype="datetime64[m]"))
+    full = np.array([kind == "full" for kind, _ in MOON_REFERENCE_PHASES_UTC])
+    k = np.round((jd - 2451550.09766) / SYNODIC_MONTH - np.where(full, 0.5, 0.0))
+    calc = np.where(full, phase_jde(k, full=True), phase_jde(k)) - DELTA_T_DAYS
+    assert np.abs(calc - jd).max() * 1440.0 < MAX_ERROR_MIN
+
+
+def test_moon_age_scalar():
+    # 新月の30分後の月齢は 30 分（直前の新月が正しく選ばれ、時刻の誤差も一定以内）
+    for ts in NEW_MOONS:
+        t = datetime.fromisoformat(ts).replace(tzinfo=timezone.utc) + timedelta(minutes=30)
+        assert abs(float(moon_age_days(t)) * 1440.0 - 30.0) < MAX_ERROR_MIN, ts
+
+
+def test_moon_age_vectorized():
+    times = pd.DatetimeIndex(NEW_MOONS).tz_localize("UTC") + pd.Timedelta(minutes=30)
+    err = np.abs(moon_age_days(times) * 1440.0 - 30.0)
+    assert err.max() < MAX_ERROR_MIN
+    # タイムゾーン付き（JST）でも同じ結果
+    assert np.allclose(moon_age_days(times.tz_convert("Asia/Tokyo")), moon_age_days(times))
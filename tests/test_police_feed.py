@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# 県警速報の取得失敗: 前回の内容を返し、失敗回数を数え、次の取得まで間隔を空ける
+import pytest
+
+import police_feed
+import synth
+from police_feed import PoliceFeed
+from stubs import StubServer
+
+
+@pytest.fixture
+def stub():
+    s = StubServer().start()
+    s.police_html = synth.police_page(20)
+    yield s
+    s.stop()
+
+
+def test_failed_poll_keeps_page_and_backs_off(stub, monkeypatch):
+    feed = PoliceFeed(f"{stub.base}/police", interval_s=60)
+    page = feed.poll()
+    assert feed.stats()["items"] == 20 and feed.stats()["errors"] == 0
+    calls = []
+
+    def down(*a, **kw):
+        calls.append(a); raise ConnectionError("down")
+    monkeypatch.setattr(police_feed, "http_get", down)
+    assert feed.poll(force=True) is page
+    assert feed.stats()["errors"] == 1 and feed.stats()["polls"] == 1
+    assert feed.poll() is page and len(calls) == 1   # 失敗直後は間隔内なので取りに行かない
+
+
+def test_failed_first_poll_raises(monkeypatch):
+    def down(*a, **kw): raise ConnectionError("down")
+    monkeypatch.setattr(police_feed, "http_get", down)
+    feed = PoliceFeed("http://127.0.0.1:9/police")
+    with pytest.raises(ConnectionError): feed.poll()
+    assert feed.stats()["errors"] == 1
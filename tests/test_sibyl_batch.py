@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# --poll の取得失敗: archive は蓄積済みの件数で続行（stderr に警告）、page は失敗
+import pandas as pd
+import pytest
+
+import police_feed
+from http_client import CircuitOpenError
+from municipalities import CITY_NAMES, JST
+from sibyl_batch import muni_counts_for_times
+
+TIMES = pd.date_range("2026-01-01", periods=6, freq="h", tz=JST)
+
+
+@pytest.fixture
+def feed_down(monkeypatch):
+    def down(*a, **kw): raise CircuitOpenError("police: 一時停止中")
+    monkeypatch.setattr(police_feed, "http_get", down)
+
+
+def test_poll_failure_falls_back_to_archive(feed_down, tmp_path, capsys):
+    counts = muni_counts_for_times("archive", TIMES, 7, str(tmp_path / "arc.sqlite3"), "http://127.0.0.1:9/", poll=True)
+    assert set(counts) == set(CITY_NAMES) and all(len(v) == len(TIMES) and not v.any() for v in counts.values())
+    assert "警告" in capsys.readouterr().err
+
+
+def test_poll_failure_fails_page_mode(feed_down, tmp_path):
+    with pytest.raises(SystemExit): muni_counts_for_times("page", TIMES, 7, str(tmp_path / "arc.sqlite3"), "http://127.0.0.1:9/")